@@ -7,6 +7,18 @@
 #include <stdlib.h>
 #include <assert.h>
 #include <string.h>
+#include <stdint.h>
+#include <math.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#ifdef _WIN32
+# include <process.h>
+# define getpid _getpid
+#else
+# include <fcntl.h>
+# include <unistd.h>
+# include <sys/mman.h>
+#endif
 
 //#define MOTAB_DEBUG
 #ifdef MOTAB_DEBUG
@@ -38,14 +50,66 @@ static cbool parseMetaDataHeaders(Parser *P,MotabData *tab);
 
 static unsigned motab_get_nmeta(MotabData *tab);
 
+static void motab_add_meta(MotabData *tab,char *row);
+
+static MotabData *motab_load_text(const char *filepath);
+
 /* INPUT/OUTPUT FUNCTIONS */
 
+/* modification time of a file, with sub-second resolution where available */
+static int file_mtime(const char *filepath,double *mtime){
+	struct stat st;
+	if(stat(filepath,&st))return 1;
+#if defined(__linux__)
+	*mtime = st.st_mtim.tv_sec + 1e-9*st.st_mtim.tv_nsec;
+#else
+	*mtime = st.st_mtime;
+#endif
+	return 0;
+}
+
+MotabData *motab_load(const char *filepath){
+	if(motab_is_binary(filepath)){
+		return motab_load_binary(filepath);
+	}
+
+	/* use the binary copy of the text file, if it is up to date */
+	size_t l = strlen(filepath);
+	char *binpath = malloc(l + sizeof(MOTAB_BINARY_EXT));
+	assert(binpath);
+	memcpy(binpath,filepath,l);
+	memcpy(binpath + l,MOTAB_BINARY_EXT,sizeof(MOTAB_BINARY_EXT));
+	double t_text, t_bin;
+	MotabData *tab;
+	if(0 == file_mtime(filepath,&t_text) && 0 == file_mtime(binpath,&t_bin)
+		&& t_bin >= t_text && motab_is_binary(binpath)
+	){
+		MSG("Using binary copy '%s'",binpath);
+		tab = motab_load_binary(binpath);
+		if(tab){
+			free(binpath);
+			return tab;
+		}
+	}
+
+	tab = motab_load_text(filepath);
+	if(tab && getenv("ST_MOTAB_CACHE")){
+		/* failure (e.g. a read-only directory) just means no copy */
+		if(motab_write_binary(tab,binpath)){
+			MSG("Unable to write binary copy '%s'",binpath);
+		}
+	}
+	free(binpath);
+	return tab;
+}
+
+
 /**
 	Selectively read just the time and DNI from a weather data file.
 	
 	FIXME transition to using Modelica's external functions for loading data and interpolating.
 */
-MotabData *motab_load(const char *filepath){
+static MotabData *motab_load_text(const char *filepath){
 	char line[MAXCHARS];
 	unsigned i = 0;
 
@@ -59,10 +123,15 @@ MotabData *motab_load(const char *filepath){
 
 	/* read the metadata line */
 	MotabData *tab = NEW(MotabData);if(!tab)return NULL;
+	tab->name = NULL;
 	tab->meta = NULL;
 	tab->vals = NULL;
 	tab->timecol = MOTAB_NO_COL;
 	tab->timestep = 0;
+	tab->map = NULL;
+	tab->mapsize = 0;
+	tab->timecheck = -1;
+	tab->cursor = 0;
 
 	Parser *P = parseCreateFile(fp);
 	
@@ -138,6 +207,206 @@ cbool parseMotabHeader(Parser *P,char *name,unsigned maxl,unsigned *nrows,unsign
 		);
 }
 
+/* BINARY FILES */
+
+static int motab_little_endian(){
+	const uint32_t one = 1;
+	return *(const char *)&one == 1;
+}
+
+int motab_is_binary(const char *filepath){
+	char magic[sizeof(MOTAB_BINARY_MAGIC)];
+	FILE *fp = fopen(filepath,"rb");
+	if(fp == NULL)return 0;
+	size_t n = fread(magic,1,sizeof(magic),fp);
+	fclose(fp);
+	return n == sizeof(magic) && 0 == memcmp(magic,MOTAB_BINARY_MAGIC,sizeof(magic));
+}
+
+static void motab_unmap(void *map,size_t size){
+#ifdef _WIN32
+	free(map);
+#else
+	munmap(map,size);
+#endif
+}
+
+MotabData *motab_load_binary(const char *filepath){
+	if(!motab_little_endian()){
+		ERR("Binary motab files are only supported on little-endian machines");
+		return NULL;
+	}
+	void *map;
+	size_t size;
+#ifdef _WIN32
+	FILE *fp = fopen(filepath,"rb");
+	if(fp == NULL){
+		ERR("Unable open motab file '%s'. Please check the file name",filepath);
+		return NULL;
+	}
+	fseek(fp,0,SEEK_END);
+	size = ftell(fp);
+	fseek(fp,0,SEEK_SET);
+	map = malloc(size ? size : 1);
+	assert(map);
+	if(fread(map,1,size,fp) != size){
+		ERR("Unable to read motab file '%s'",filepath);
+		fclose(fp);
+		free(map);
+		return NULL;
+	}
+	fclose(fp);
+#else
+	int fd = open(filepath,O_RDONLY);
+	if(fd < 0){
+		ERR("Unable open motab file '%s'. Please check the file name",filepath);
+		return NULL;
+	}
+	struct stat st;
+	if(fstat(fd,&st) || st.st_size < MOTAB_BINARY_HEADER){
+		ERR("Binary motab file '%s' is truncated",filepath);
+		close(fd);
+		return NULL;
+	}
+	size = st.st_size;
+	/* private: pages are shared between processes until written to */
+	map = mmap(NULL,size,PROT_READ|PROT_WRITE,MAP_PRIVATE,fd,0);
+	close(fd);
+	if(map == MAP_FAILED){
+		ERR("Unable to map motab file '%s'",filepath);
+		return NULL;
+	}
+#endif
+	const char *b = (const char *)map;
+	uint32_t version, nrows, ncols, namelen, metalen;
+	uint64_t dataoffset;
+	if(size < MOTAB_BINARY_HEADER || memcmp(b,MOTAB_BINARY_MAGIC,sizeof(MOTAB_BINARY_MAGIC))){
+		ERR("'%s' is not a binary motab file",filepath);
+		motab_unmap(map,size);
+		return NULL;
+	}
+	memcpy(&version,b + 8,4);
+	memcpy(&nrows,b + 12,4);
+	memcpy(&ncols,b + 16,4);
+	memcpy(&namelen,b + 20,4);
+	memcpy(&metalen,b + 24,4);
+	memcpy(&dataoffset,b + 32,8);
+	if(version != MOTAB_BINARY_VERSION){
+		ERR("Unsupported version %u of binary motab file '%s'",version,filepath);
+		motab_unmap(map,size);
+		return NULL;
+	}
+	if(namelen < 1 || metalen < 1 || nrows < 1 || ncols < 1 || dataoffset % 8
+		|| (uint64_t)MOTAB_BINARY_HEADER + namelen + metalen > dataoffset
+		|| dataoffset + (uint64_t)nrows*ncols*sizeof(double) > size
+		|| b[MOTAB_BINARY_HEADER + namelen - 1] != '\0'
+		|| b[MOTAB_BINARY_HEADER + namelen + metalen - 1] != '\0'
+	){
+		ERR("Binary motab file '%s' is corrupt or truncated",filepath);
+		motab_unmap(map,size);
+		return NULL;
+	}
+
+	MotabData *tab = NEW(MotabData);
+	assert(tab);
+	tab->name = newcopy(b + MOTAB_BINARY_HEADER);
+	tab->nrows = nrows;
+	tab->ncols = ncols;
+	tab->meta = NULL;
+	tab->timecol = MOTAB_NO_COL;
+	tab->timestep = 0;
+	tab->vals = (double *)(b + dataoffset);
+	tab->map = map;
+	tab->mapsize = size;
+	tab->timecheck = -1;
+	tab->cursor = 0;
+
+	/* metadata rows, in the order of the text file */
+	char *meta = newcopy(b + MOTAB_BINARY_HEADER + namelen);
+	char *row = meta;
+	char *end;
+	while(*row != '\0'){
+		end = strchr(row,'\n');
+		if(end)*end = '\0';
+		motab_add_meta(tab,row);
+		if(!end)break;
+		row = end + 1;
+	}
+	free(meta);
+	MSG("Mapped %u rows and %u cols with %u metadata rows",nrows,ncols,motab_get_nmeta(tab));
+	return tab;
+}
+
+
+int motab_write_binary(MotabData *tab, const char *filepath){
+	assert(tab);
+	if(!motab_little_endian()){
+		ERR("Binary motab files are only supported on little-endian machines");
+		return 1;
+	}
+
+	/* metadata rows in file order (the list holds the last one first) */
+	size_t metalen = 1;
+	MotabMetaData *M;
+	for(M = tab->meta; M; M = M->next){
+		metalen += strlen(M->row) + 1;
+	}
+	char *meta = malloc(metalen);
+	assert(meta);
+	size_t pos = metalen - 1;
+	meta[pos] = '\0';
+	for(M = tab->meta; M; M = M->next){
+		size_t l = strlen(M->row);
+		pos -= l + 1;
+		memcpy(meta + pos,M->row,l);
+		meta[pos + l] = '\n';
+	}
+	assert(pos == 0);
+
+	uint32_t namelen = strlen(tab->name) + 1;
+	uint64_t dataoffset = MOTAB_BINARY_HEADER + namelen + metalen;
+	dataoffset = (dataoffset + 7)/8*8;
+	char header[MOTAB_BINARY_HEADER];
+	memset(header,0,sizeof(header));
+	memcpy(header,MOTAB_BINARY_MAGIC,sizeof(MOTAB_BINARY_MAGIC));
+	uint32_t u[6] = {MOTAB_BINARY_VERSION,tab->nrows,tab->ncols,namelen,metalen,0};
+	memcpy(header + 8,u,sizeof(u));
+	memcpy(header + 32,&dataoffset,8);
+
+	char tmppath[MAXCHARS];
+	snprintf(tmppath,MAXCHARS,"%s.tmp%d",filepath,(int)getpid());
+	FILE *fp = fopen(tmppath,"wb");
+	if(fp == NULL){
+		free(meta);
+		return 1;
+	}
+	size_t npad = dataoffset - (MOTAB_BINARY_HEADER + namelen + metalen);
+	const char zeros[8] = {0};
+	size_t nvals = (size_t)tab->nrows*tab->ncols;
+	int ok = fwrite(header,1,sizeof(header),fp) == sizeof(header)
+		&& fwrite(tab->name,1,namelen,fp) == namelen
+		&& fwrite(meta,1,metalen,fp) == metalen
+		&& fwrite(zeros,1,npad,fp) == npad
+		&& fwrite(tab->vals,sizeof(double),nvals,fp) == nvals;
+	free(meta);
+	if(fclose(fp) || !ok){
+		ERR("Unable to write binary motab file '%s'",tmppath);
+		remove(tmppath);
+		return 1;
+	}
+#ifdef _WIN32
+	remove(filepath);
+#endif
+	if(rename(tmppath,filepath)){
+		ERR("Unable to rename '%s' to '%s'",tmppath,filepath);
+		remove(tmppath);
+		return 1;
+	}
+	MSG("Wrote binary motab file '%s'",filepath);
+	return 0;
+}
+
+
 /**
 	Store a metadata row in the linked list tab->meta.
 	Note that we take a copy of the string `row` which must later be freed.
@@ -260,6 +529,10 @@ MotabData *motab_new(unsigned nrows, unsigned ncols, const char *name
 	data->meta = NULL;
 	data->timecol = MOTAB_NO_COL;
 	data->timestep = 0;
+	data->map = NULL;
+	data->mapsize = 0;
+	data->timecheck = -1;
+	data->cursor = 0;
 
 	char line[MAXCHARS] = "";
 	if(collabels){
@@ -286,7 +559,10 @@ MotabData *motab_new(unsigned nrows, unsigned ncols, const char *name
 
 void motab_free(MotabData *tab){
 	if(tab){
-		if(tab->vals){
+		if(tab->map){
+			/* vals points into the mapping */
+			motab_unmap(tab->map,tab->mapsize);
+		}else if(tab->vals){
 			free(tab->vals);
 		}
 		if(tab->meta){
@@ -495,138 +771,209 @@ int motab_find_col_by_label(MotabData *tab, const char *label){
 
 /* DATA FUNCTIONS */
 
-int motab_check_timestep(MotabData *tab, double *step_return){
+int motab_check_time(MotabData *tab){
 	assert(tab);
-	// only run the check if it hasn't already been done and a result stored
-	if(tab->timecol == MOTAB_NO_COL || tab->timestep != 0){
-		int time_col = motab_find_col_by_label(tab,"time");
-		if(time_col == -1){
-			ERR("No 'time' column found in Motab");
-			tab->timecol = MOTAB_NO_COL;
-			return 1;
-		}
-		tab->timecol = time_col;
+	if(tab->timecheck >= 0)return tab->timecheck;
+	int err = 0;
+	int time_col = motab_find_col_by_label(tab,"time");
+	if(time_col == -1){
+		ERR("No 'time' column found in Motab");
+		err = 1;
+	}else{
 		char *units = motab_get_col_units(tab,"time");
-		if(0 != strcmp(units,"s")){
-			ERR("Units for column 'time' are not 's' as expected. Got '%s' instead.",units);
-			free(units);
-			return 2;
-		}
-		free(units);
-		if(tab->nrows < 2){
+		if(units == NULL || 0 != strcmp(units,"s")){
+			ERR("Units for column 'time' are not 's' as expected. Got '%s' instead.",units ? units : "");
+			err = 2;
+		}else if(tab->nrows < 2){
 			ERR("Table does not have two or more rows");
-			return 3;
+			err = 3;
 		}
+		free(units);
+	}
+	if(!err){
 		double delta = MOTAB_VAL(tab,1,time_col) - MOTAB_VAL(tab,0,time_col);
-		double t;
+		tab->timestep = delta;
+		for(int r=1;r < tab->nrows; ++r){
+			double step = MOTAB_VAL(tab,r,time_col) - MOTAB_VAL(tab,r-1,time_col);
+			if(step < 0 || step != step){
+				ERR("Time decreases at t = %lf",MOTAB_VAL(tab,r,time_col));
+				err = 4;
+				break;
+			}
+			if(step != delta)tab->timestep = 0;
+		}
+	}
+	if(err){
+		tab->timecol = MOTAB_NO_COL;
+		tab->timestep = 0;
+	}else{
+		tab->timecol = time_col;
+	}
+	tab->cursor = 0;
+	tab->timecheck = err;
+	return err;
+}
+
+
+int motab_check_timestep(MotabData *tab, double *step_return){
+	int err = motab_check_time(tab);
+	if(err)return err;
+	if(tab->timestep == 0){
+		double delta = MOTAB_VAL(tab,1,tab->timecol) - MOTAB_VAL(tab,0,tab->timecol);
 		for(int r=2;r < tab->nrows; ++r){
-			t = MOTAB_VAL(tab,r,time_col);
-			//MSG("t = %lf",t);
-			if(delta != t - MOTAB_VAL(tab,r-1,time_col)){
+			double t = MOTAB_VAL(tab,r,tab->timecol);
+			if(delta != t - MOTAB_VAL(tab,r-1,tab->timecol)){
 				ERR("Incorrect time increment at t = %lf",t);
-				return 4;
+				break;
 			}
 		}
-		tab->timestep = delta;
+		return 4;
 	}
 	if(step_return)*step_return = tab->timestep;
 	return 0;
 }
 
 
-double motab_get_value(MotabData *tab, double time, int col){
-	assert(tab);
-	int err;
-	MSG("Evaluating at t=%f, col=%d",time,col);
-	if(tab->timecol == MOTAB_NO_COL){
-		if(err = motab_check_timestep(tab,NULL)){
-			ERR("Error %d in motab timestep.",err);
-			return MOTAB_NO_REAL;
+/**
+	Find the row `r` such that T[r] <= t < T[r+1], where T is the time column
+	and T[0] <= t <= T[nrows-1], returning nrows-2 for t == T[nrows-1]. Equal
+	times give the later row, so that steps in the values are right-continuous.
+	The search starts from the cursor, then the next interval, then bisects.
+*/
+static unsigned motab_find_row(MotabData *tab, double t){
+	const unsigned n = tab->nrows;
+	const unsigned nc = tab->ncols;
+	const double *T = tab->vals + tab->timecol;
+	unsigned lo, hi;
+	unsigned r = tab->cursor;
+	if(r > n - 2)r = 0;
+	if(T[r*nc] <= t){
+		if(t < T[(r+1)*nc])return r;
+		if(r + 2 < n && t < T[(r+2)*nc]){
+			tab->cursor = r + 1;
+			return r + 1;
+		}
+		lo = r + 1;
+		hi = n - 1;
+	}else{
+		lo = 0;
+		hi = r;
+	}
+	/* T[lo] <= t, and t < T[hi] unless hi == n - 1 */
+	if(t >= T[(n-1)*nc]){
+		lo = n - 1;
+	}else{
+		while(hi - lo > 1){
+			unsigned mid = lo + (hi - lo)/2;
+			if(T[mid*nc] <= t)lo = mid;
+			else hi = mid;
 		}
 	}
-	MSG("Timestep = %f",tab->timestep);
-	assert(tab->nrows >= 1);
-	double t0 = MOTAB_VAL(tab,0,tab->timecol);
-	double rowrat = (time - t0)/tab->timestep;
-	int row = (int)rowrat;
-	double frac = rowrat - row;
-	if(row < 0){
-			ERR("Time t = %f (row %d) is below table range (t_min = %f)",time,row,MOTAB_VAL(tab,0,tab->timecol));
-			return MOTAB_NO_REAL;
+	if(lo > n - 2)lo = n - 2;
+	tab->cursor = lo;
+	return lo;
+}
+
+
+/**
+	Find the interval holding `t` and the fraction of the way through it,
+	or return nonzero if the time column is not usable or `t` is outside it.
+*/
+static int motab_locate(MotabData *tab, double t, unsigned *row, double *frac){
+	int err;
+	if(tab->timecheck != 0 && (err = motab_check_time(tab))){
+		ERR("Error %d in motab time column.",err);
+		return err;
+	}
+	const double t0 = MOTAB_VAL(tab,0,tab->timecol);
+	const double t1 = MOTAB_VAL(tab,tab->nrows-1,tab->timecol);
+	if(!(t >= t0)){
+		ERR("Time t = %f is below table range (t_min = %f)",t,t0);
+		return 5;
 	}
-	if(row >= tab->nrows){
-			ERR("Time t = %f (row %d) is above table range (t_max = %f)",time,row,MOTAB_VAL(tab,tab->nrows-1,tab->timecol));
-			return MOTAB_NO_REAL;
+	if(t > t1){
+		ERR("Time t = %f is above table range (t_max = %f)",t,t1);
+		return 6;
 	}
+	unsigned r = motab_find_row(tab,t);
+	double ta = MOTAB_VAL(tab,r,tab->timecol);
+	double dt = MOTAB_VAL(tab,r+1,tab->timecol) - ta;
+	*row = r;
+	*frac = dt > 0 ? (t - ta)/dt : 1;
+	return 0;
+}
+
+
+double motab_get_value(MotabData *tab, double time, int col){
+	assert(tab);
+	unsigned row;
+	double frac;
 	if(col < 0 || col >= tab->ncols){
-			ERR("Column is out of range of Motab");
-			return MOTAB_NO_REAL;
+		ERR("Column is out of range of Motab");
+		return MOTAB_NO_REAL;
 	}
-	
-	MSG("row = %d, col = %d", row, col);
+	if(motab_locate(tab,time,&row,&frac))return MOTAB_NO_REAL;
 	double val = MOTAB_VAL(tab,row,col);
 	if(frac > 0){
-		if(row == tab->nrows - 1){
-			ERR("Value %f is beyond the last row.",time);
-			return MOTAB_NO_REAL;
-		}
 		val = val * (1-frac) + MOTAB_VAL(tab,row + 1,col) * frac;
 	}
-		
-	MSG("val = %f",val);
 	return val;
 }
 
-double motab_get_value_wraparound(MotabData *tab, double time, int col){
+
+int motab_get_values(MotabData *tab, double time, const int *cols, int n, double *vals){
 	assert(tab);
-	int err;
-	MSG("Evaluating at t=%f, col=%d",time,col);
-	if(tab->timecol == MOTAB_NO_COL){
-		if(err = motab_check_timestep(tab,NULL)){
-			ERR("Error %d in motab timestep.",err);
-			return MOTAB_NO_REAL;
+	unsigned row;
+	double frac;
+	int i, err = 0;
+	for(i = 0; i < n; ++i){
+		if(cols[i] < 0 || cols[i] >= tab->ncols){
+			ERR("Column %d is out of range of Motab",cols[i]);
+			err = 7;
 		}
 	}
-	MSG("Timestep = %f",tab->timestep);
-	assert(tab->nrows >= 1);
-	double t0 = MOTAB_VAL(tab,0,tab->timecol);
-	double tmax = t0 + tab->nrows * tab->timestep;
-	double offset = time - t0;
-	MSG("time = %f, t0 = %f, offset = %f, tmax = %f", time,t0,offset,tmax);
-	double rowrat = (time - t0)/tab->timestep;
-	int rowratint = (int)rowrat;
-	int row = rowratint % tab->nrows;
-	double frac = rowrat - rowratint;
-	MSG("rowrat = %f, rowratint = %d, row = %d, frac = %f",rowrat,rowratint,row,frac);
-	if(row < 0){
-			ERR("Time t = %f (row %d) is below table range (t_min = %f)",time,row,MOTAB_VAL(tab,0,tab->timecol));
-			return MOTAB_NO_REAL;
-	}
-	if(row >= tab->nrows){
-			ERR("Time t = %f (row %d) is above table range (t_max = %f)",time,row,MOTAB_VAL(tab,tab->nrows-1,tab->timecol));
-			return MOTAB_NO_REAL;
+	if(!err)err = motab_locate(tab,time,&row,&frac);
+	if(err){
+		for(i = 0; i < n; ++i)vals[i] = MOTAB_NO_REAL;
+		return err;
+	}
+	const double *a = tab->vals + (size_t)row*tab->ncols;
+	const double *b = a + tab->ncols;
+	for(i = 0; i < n; ++i){
+		vals[i] = frac > 0 ? a[cols[i]] * (1-frac) + b[cols[i]] * frac : a[cols[i]];
+	}
+	return 0;
+}
+
+
+double motab_get_value_wraparound(MotabData *tab, double time, int col){
+	assert(tab);
+	int err;
+	if(tab->timecheck != 0 && (err = motab_check_time(tab))){
+		ERR("Error %d in motab time column.",err);
+		return MOTAB_NO_REAL;
 	}
 	if(col < 0 || col >= tab->ncols){
-			ERR("Column is out of range of Motab");
-			return MOTAB_NO_REAL;
+		ERR("Column is out of range of Motab");
+		return MOTAB_NO_REAL;
 	}
-	
-	MSG("row = %d, col = %d", row, col);
-	double val1 = MOTAB_VAL(tab,row,col);
-	MSG("val1 = %f",val1);
-	if(frac > 0){
-		double val2;
-		if(row == tab->nrows - 1){
-			MSG("val2 = first row");
-			val2 = MOTAB_VAL(tab,0,col);
-		}else{
-			val2 = MOTAB_VAL(tab,row+1,col);
-		}
-		val1 = val1 * (1-frac) + val2 * frac;
+	const unsigned n = tab->nrows;
+	const double t0 = MOTAB_VAL(tab,0,tab->timecol);
+	const double tn = MOTAB_VAL(tab,n-1,tab->timecol);
+	/* the last row is followed, one last timestep later, by the first */
+	const double tail = tn - MOTAB_VAL(tab,n-2,tab->timecol);
+	const double period = tn - t0 + tail;
+	double t = time - t0;
+	if(t < 0 || t >= period){
+		t = fmod(t,period);
+		if(t < 0)t += period;
+	}
+	t += t0;
+	if(t <= tn){
+		return motab_get_value(tab,t,col);
 	}
-		
-	MSG("val = %f",val1);
-	return val1;
+	double frac = tail > 0 ? (t - tn)/tail : 0;
+	return MOTAB_VAL(tab,n-1,col) * (1-frac) + MOTAB_VAL(tab,0,col) * frac;
 }
 
 /* METADATA ITEM FUNCTIONS */
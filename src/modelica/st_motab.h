@@ -44,6 +44,29 @@ typical use is with files having 8,760 rows and ~10 cols (hourly data for one
 year), but up to larger is probably fine too OK (1 minute data), up to some 
 limit where a memory-mapped file may become preferable.
 
+For that, and to avoid parsing the same text files in every process of a
+sweep, tables can also be stored in a binary format, which `motab_load`
+recognises by its first bytes and memory-maps, so that all the processes
+reading a table share one copy of it in the page cache. The layout (all
+little-endian) is:
+
+	char magic[8]          "STMOTAB" and a NUL
+	uint32 version         MOTAB_BINARY_VERSION
+	uint32 nrows, ncols
+	uint32 namelen         length of the table name, including its NUL
+	uint32 metalen         length of the metadata rows (without their '#',
+	                       each ended by a newline), including a final NUL
+	uint32 reserved        zero
+	uint64 dataoffset      offset of the data, a multiple of 8
+	name, metadata, zero padding
+	double data[nrows*ncols] row by row, as in MotabData.vals
+
+Binary files are written by `motab_write_binary` or by the st_motab_bin tool
+(see solartherm.motab). When loading a text file 'X.motab', a binary copy
+'X.motab.bin' that is at least as recent is used instead; with the
+environment variable ST_MOTAB_CACHE set, `motab_load` writes that copy after
+parsing the text file, if the directory is writable.
+
 FIXME: st_motab doesn't yet handle multiple tables in a single text file, although
 that feature is in fact supported by Modelica.
 */
@@ -130,9 +153,18 @@ typedef struct{
 	unsigned ncols;
 	MotabMetaData *meta; ///< owned by us
 	unsigned timecol;  ///< will be initialised to MOTAB_NO_COL
-	double timestep; ///< will be intitialise to zero (0)
+	double timestep; ///< will be intitialise to zero (0); zero for irregular times
+	void *map; ///< mapping of a binary file holding `vals`, or NULL
+	size_t mapsize; ///< size of `map`
+	int timecheck; ///< result of `motab_check_time`, -1 until it has run
+	unsigned cursor; ///< row starting the time interval of the last lookup
 } MotabData;
 
+#define MOTAB_BINARY_MAGIC "STMOTAB"
+#define MOTAB_BINARY_VERSION 1
+#define MOTAB_BINARY_HEADER 40
+#define MOTAB_BINARY_EXT ".bin"
+
 
 /* INPUT/OUTPUT FUNCTIONS ----------------------------------------------------*/
 
@@ -142,6 +174,25 @@ typedef struct{
 */
 ST_EXPORT MotabData *motab_load(const char *filepath);
 
+/**
+	Return 1 if `filepath` is a binary motab file (see above), else 0.
+*/
+ST_EXPORT int motab_is_binary(const char *filepath);
+
+/**
+	Load a binary motab file, memory-mapping its data. The mapping is
+	private: values changed through this table are not written to the file.
+	Return NULL if anything is wrong, with error messages to stderr.
+*/
+ST_EXPORT MotabData *motab_load_binary(const char *filepath);
+
+/**
+	Write the table in the binary format to `filepath`, through a temporary
+	file that is renamed into place, so that readers never see a partly
+	written file. Return 0 on success.
+*/
+ST_EXPORT int motab_write_binary(MotabData *tab, const char *filepath);
+
 /**
 	Write out the table in human-readable text (TTY) to `fp`.
 	
@@ -191,8 +242,15 @@ ST_EXPORT void motab_free(MotabData *tab);
 #define MOTAB_VAL(TABLE,ROW,COL) (TABLE)->vals[(COL) + (ROW)*(TABLE->ncols)]
 
 /**
-	Get value, with linear interpolation. First scratch test function, not
-	for serious use.
+	Get value, with linear interpolation in the 'time' column, which must be
+	increasing but need not have a uniform timestep (see `motab_check_time`).
+	Times outside the range of the table give MOTAB_NO_REAL.
+
+	The row found is kept as a cursor in the table, and the next lookup
+	starts from it: the times asked for by a solver are mostly increasing and
+	close together, so that the interval is usually found in one or two
+	comparisons, falling back to a binary search. The cursor is only a hint,
+	so that tables may be shared between threads.
 	
 	TODO For more serious use, we propose to integrate st_motab with the MSL
 	ModelicaStandardTables, namely ExternalCombiTable1D, via the 'usertab'
@@ -200,11 +258,20 @@ ST_EXPORT void motab_free(MotabData *tab);
 */
 ST_EXPORT double motab_get_value(MotabData *tab, double t, int col);
 
+/**
+	Get the values of the `n` columns `cols` at time `t` into `vals`, finding
+	the time interval only once, as for a weather table read at every solver
+	step. Return 0 on success, else the values are MOTAB_NO_REAL and the
+	return is nonzero. See `motab_get_value`.
+*/
+ST_EXPORT int motab_get_values(MotabData *tab, double t, const int *cols, int n, double *vals);
+
 
 /**
 	Get value, with wraparound. The table is assumed to be circular, such that
 	the last value in the table comes one timestep before the first value in the
-	table. See `motab_get_value`.
+	table (with irregular times, the timestep between the last two rows). See
+	`motab_get_value`.
 	
 	This function is useful in st_linprog, when attempting to run forecasts
 	for the last nsteps time-periods of the year.
@@ -227,6 +294,14 @@ ST_EXPORT double motab_get_value_wraparound(MotabData *tab, double t, int col);
 */
 ST_EXPORT int motab_check_timestep(MotabData *tab, double *step);
 
+/**
+	As `motab_check_timestep` for conditions (1) to (3), but with (4) only
+	that the times never decrease (equal times give a step in the values).
+	The timestep is stored in `tab->timestep` if uniform, else zero. The
+	result is stored too, so that the check runs only once for a table.
+*/
+ST_EXPORT int motab_check_time(MotabData *tab);
+
 
 /* METADATA FUNCTIONS --------------------------------------------------------*/
 
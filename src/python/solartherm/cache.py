@@ -0,0 +1,545 @@
+"""
+On-disk caches shared between SolarTherm processes.
+
+`ModelCache` stores compiled simulation executables (plus the `_init.xml` file
+written by omc) under a key derived from everything that affects compilation:
+the .mo file, the Modelica libraries it is compiled against, the omc version
+and the compilation flags. Entries are published atomically (written to a
+temporary directory inside the cache, then renamed into place), so several
+workers compiling the same model at once will never see a partial entry.
+The total size of the cache is kept under a limit by evicting the least
+recently used entries.
+
+The cache directory defaults to `~/.cache/solartherm/models` and can be
+changed via the ST_MODEL_CACHE environment variable.
+
+`ResultCache` stores the outcome of simulations (the performance vector, plus
+optional extra values and reduced trajectories) under a key derived from the
+compiled model, the parameter values and the simulation settings, so that a
+design point that was already simulated by st_simulate, st_optimise or a
+Dakota study is not simulated again. Entries are kept in an SQLite file,
+which handles concurrent readers and writers on a local file system. The
+total size is kept under a limit by evicting the least recently used
+entries. The cache directory defaults to `~/.cache/solartherm/results` and
+can be changed via the ST_RESULT_CACHE environment variable.
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import io
+import json
+import math
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import time
+import subprocess as sp
+import numpy as np
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	try:
+		import msvcrt
+	except ImportError:
+		msvcrt = None
+
+DEFAULT_CACHE_ROOT = os.path.join(os.path.expanduser('~'), '.cache', 'solartherm')
+DEFAULT_MODEL_CACHE_SIZE = 5*1024**3 # bytes
+DEFAULT_RESULT_CACHE_SIZE = 1024**3 # bytes
+
+# file extensions that affect a compiled model, when hashing library trees
+LIB_EXTS = ('.mo', '.order', '.c', '.h', '.so', '.dll', '.a', '.py')
+
+
+class FileLock(object):
+	"""Advisory lock on a file, usable as a context manager.
+
+	`shared` locks may be held by several processes at once, exclusive locks
+	by only one. On platforms with neither fcntl nor msvcrt, locking is a
+	no-op.
+	"""
+	def __init__(self, fn, shared=False):
+		self.fn = fn
+		self.shared = shared
+		self.f = None
+
+	def acquire(self):
+		self.f = open(self.fn, 'a+')
+		if fcntl is not None:
+			fcntl.flock(self.f.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+		elif msvcrt is not None:
+			self.f.seek(0)
+			while True:
+				try:
+					msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except OSError:
+					time.sleep(0.05)
+
+	def release(self):
+		if self.f is None:
+			return
+		if fcntl is not None:
+			fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+		elif msvcrt is not None:
+			self.f.seek(0)
+			msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+		self.f.close()
+		self.f = None
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+
+
+def dir_size(path):
+	"""Total size in bytes of the regular files below `path`."""
+	size = 0
+	for root, dirs, fns in os.walk(path):
+		for fn in fns:
+			try:
+				size += os.path.getsize(os.path.join(root, fn))
+			except OSError:
+				pass
+	return size
+
+
+_file_digests = {}
+
+def file_digest(fn):
+	"""SHA-256 hex digest of the file `fn`.
+
+	Digests are memoised on (path, size, mtime) so that hashing a whole
+	library tree repeatedly in one process is cheap.
+	"""
+	st = os.stat(fn)
+	k = (os.path.abspath(fn), st.st_size, st.st_mtime)
+	d = _file_digests.get(k)
+	if d is None:
+		h = hashlib.sha256()
+		with open(fn, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				h.update(chunk)
+		d = h.hexdigest()
+		_file_digests[k] = d
+	return d
+
+
+def find_library(name):
+	"""Locate Modelica library `name` on OPENMODELICALIBRARY, as omc does.
+
+	Returns the path of the library directory (or single .mo file), or None if
+	it cannot be found, for example for the Modelica Standard Library if it is
+	installed with a version suffix.
+	"""
+	paths = os.environ.get('OPENMODELICALIBRARY', '').split(os.pathsep)
+	paths.append(os.path.join(os.path.expanduser('~'), '.openmodelica', 'libraries'))
+	for p in paths:
+		if not p:
+			continue
+		for cand in (os.path.join(p, name), os.path.join(p, name + '.mo')):
+			if os.path.exists(cand):
+				return cand
+	return None
+
+
+def library_digest(path):
+	"""Hash every source file of a Modelica library directory (or .mo file).
+
+	This is a conservative stand-in for the set of library classes actually
+	loaded by a model: any change to the library invalidates the entry.
+	"""
+	h = hashlib.sha256()
+	if os.path.isfile(path):
+		h.update(file_digest(path).encode())
+		return h.hexdigest()
+	for root, dirs, fns in os.walk(path):
+		dirs.sort()
+		for fn in sorted(fns):
+			if os.path.splitext(fn)[1] in LIB_EXTS:
+				full = os.path.join(root, fn)
+				h.update(os.path.relpath(full, path).encode())
+				h.update(file_digest(full).encode())
+	return h.hexdigest()
+
+
+_omc_version = None
+
+def omc_version():
+	"""Version string reported by `omc --version`, or '' if omc is missing."""
+	global _omc_version
+	if _omc_version is None:
+		try:
+			_omc_version = sp.check_output(['omc', '--version']).decode().strip()
+		except (OSError, sp.CalledProcessError):
+			_omc_version = ''
+	return _omc_version
+
+
+class ModelCache(object):
+	"""Content-addressed store of compiled models.
+
+	Each entry is a directory named by its key, containing the files that
+	make up a compiled model (executable, init XML, info JSON) and a `.used`
+	marker whose mtime records the last time the entry was fetched.
+	"""
+	def __init__(self, root=None, maxsize=None):
+		if root is None:
+			root = os.environ.get('ST_MODEL_CACHE', os.path.join(DEFAULT_CACHE_ROOT, 'models'))
+		if maxsize is None:
+			maxsize = int(os.environ.get('ST_MODEL_CACHE_SIZE', DEFAULT_MODEL_CACHE_SIZE))
+		self.root = os.path.abspath(root)
+		self.maxsize = maxsize
+		if not os.path.isdir(self.root):
+			os.makedirs(self.root, exist_ok=True)
+		self.lock_fn = os.path.join(self.root, '.lock')
+
+	def key(self, fn, model, libs=[], args=[]):
+		"""Compute the cache key for compiling `model` from file `fn`."""
+		h = hashlib.sha256()
+		h.update(model.encode())
+		h.update(file_digest(fn).encode())
+		for lib in libs:
+			h.update(lib.encode())
+			path = find_library(lib)
+			if path is not None:
+				h.update(library_digest(path).encode())
+		h.update(' '.join(args).encode())
+		h.update(omc_version().encode())
+		return h.hexdigest()
+
+	def entry(self, key):
+		return os.path.join(self.root, key)
+
+	def fetch(self, key, destdir):
+		"""Copy the files for `key` into `destdir`. Returns False on a miss."""
+		with FileLock(self.lock_fn, shared=True):
+			src = self.entry(key)
+			if not os.path.isdir(src):
+				return False
+			for fn in os.listdir(src):
+				if fn.startswith('.'):
+					continue
+				# copy then rename, so that a concurrent reader of the
+				# destination file never sees it half-written
+				dst = os.path.join(destdir, fn)
+				tmp = '%s.tmp%d' % (dst, os.getpid())
+				shutil.copy2(os.path.join(src, fn), tmp)
+				os.replace(tmp, dst)
+			marker = os.path.join(src, '.used')
+			with open(marker, 'a'):
+				pass
+			os.utime(marker, None)
+		return True
+
+	def publish(self, key, files):
+		"""Atomically add `files` to the cache under `key`, then evict."""
+		if os.path.isdir(self.entry(key)):
+			return
+		tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+		try:
+			for fn in files:
+				shutil.copy2(fn, os.path.join(tmp, os.path.basename(fn)))
+			open(os.path.join(tmp, '.used'), 'w').close()
+			with FileLock(self.lock_fn):
+				try:
+					os.rename(tmp, self.entry(key))
+				except OSError:
+					pass # another worker published the same key first
+		finally:
+			if os.path.isdir(tmp):
+				shutil.rmtree(tmp)
+		self.evict()
+
+	def entries(self):
+		"""List of (last used time, size, key) for all entries."""
+		res = []
+		for key in os.listdir(self.root):
+			path = self.entry(key)
+			if key.startswith('.') or not os.path.isdir(path):
+				continue
+			try:
+				used = os.path.getmtime(os.path.join(path, '.used'))
+			except OSError:
+				used = os.path.getmtime(path)
+			res.append((used, dir_size(path), key))
+		return res
+
+	def evict(self, maxsize=None):
+		"""Remove least recently used entries until under `maxsize` bytes."""
+		if maxsize is None:
+			maxsize = self.maxsize
+		with FileLock(self.lock_fn):
+			ents = sorted(self.entries())
+			total = sum(e[1] for e in ents)
+			while ents and total > maxsize:
+				used, size, key = ents.pop(0)
+				shutil.rmtree(self.entry(key), ignore_errors=True)
+				total -= size
+
+	def clear(self):
+		self.evict(maxsize=0)
+
+
+def model_digest(files):
+	"""Digest of a compiled model, from the files listed by
+	`Simulator.compiled_files`. These must not have been modified by
+	`update_pars`, so tools reusing a compiled model between runs use
+	`Simulator(override=True)`."""
+	h = hashlib.sha256()
+	for fn in sorted(files, key=os.path.basename):
+		h.update(os.path.basename(fn).encode())
+		h.update(file_digest(fn).encode())
+	return h.hexdigest()
+
+
+def normalise_value(v, digits=9):
+	"""Canonical string for a parameter or setting value: numbers rounded to
+	`digits` significant digits, anything else stripped of white space."""
+	if v is None:
+		return None
+	try:
+		return '%.*g'%(digits, float(v))
+	except (TypeError, ValueError):
+		return str(v).strip()
+
+
+def sim_settings(start, stop, step, tolerance='1e-04', initStep=None, maxStep=None,
+		integOrder=None, solver=None, nls=None, args=None, result=None, peaker=False):
+	"""Settings that affect a cached result, in the same form for every tool,
+	so that st_simulate, st_optimise and Dakota studies share entries.
+
+	`result` names what is stored, e.g. the result class computing the
+	performance vector.
+	"""
+	return {'start': start, 'stop': stop, 'step': step, 'tolerance': tolerance,
+		'initStep': initStep, 'maxStep': maxStep, 'integOrder': integOrder,
+		'solver': solver, 'nls': nls, 'args': args or None, 'result': result,
+		'peaker': bool(peaker)}
+
+
+RESULT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+	key TEXT PRIMARY KEY,
+	model TEXT,
+	params TEXT,
+	settings TEXT,
+	perf TEXT,
+	extra TEXT,
+	traj BLOB,
+	size INTEGER,
+	created REAL,
+	used REAL,
+	hits INTEGER);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE TABLE IF NOT EXISTS stats (
+	name TEXT PRIMARY KEY,
+	value INTEGER);
+"""
+
+
+class ResultCache(object):
+	"""Cache of simulation results, keyed by model, parameters and settings.
+
+	Parameter values that agree to a relative tolerance `rtol` share an entry
+	(they are rounded to the corresponding number of significant digits).
+	The store may be used from several processes at once; each process opens
+	its own connection.
+
+	>>> cache = ResultCache()
+	>>> key = cache.key(model_digest(sim.compiled_files()), par_n, par_v,
+	...     {'stop': '1y', 'solver': 'dassl'})
+	>>> res = cache.get(key)
+	>>> if res is None:
+	...     perf = simulate_and_calc_perf(...)
+	...     cache.put(key, perf)
+	"""
+	def __init__(self, root=None, maxsize=None, rtol=1e-9, timeout=60.):
+		if root is None:
+			root = os.environ.get('ST_RESULT_CACHE', os.path.join(DEFAULT_CACHE_ROOT, 'results'))
+		if maxsize is None:
+			maxsize = int(os.environ.get('ST_RESULT_CACHE_SIZE', DEFAULT_RESULT_CACHE_SIZE))
+		self.root = os.path.abspath(root)
+		self.maxsize = maxsize
+		self.digits = max(1, int(math.ceil(-math.log10(rtol))))
+		self.timeout = timeout
+		if not os.path.isdir(self.root):
+			os.makedirs(self.root, exist_ok=True)
+		self.fn = os.path.join(self.root, 'results.db')
+		self.con = None
+		self.pid = None
+		self.base = self.counters()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['con'] = None
+		return state
+
+	def connect(self):
+		"""Connection for the calling process (a forked child opens its own)."""
+		if self.con is None or self.pid != os.getpid():
+			self.con = sqlite3.connect(self.fn, timeout=self.timeout,
+				isolation_level=None, check_same_thread=False)
+			self.con.execute('PRAGMA journal_mode=WAL')
+			self.con.execute('PRAGMA synchronous=NORMAL')
+			self.con.executescript(RESULT_SCHEMA)
+			self.pid = os.getpid()
+		return self.con
+
+	def close(self):
+		if self.con is not None and self.pid == os.getpid():
+			self.con.close()
+		self.con = None
+
+	def key(self, model, par_n, par_v, settings={}):
+		"""Key for parameters `par_n` set to `par_v` in the model with digest
+		`model`, simulated with `settings` (a dict of everything else that
+		affects the result, e.g. stop time, solver and result class)."""
+		pars = sorted((str(n), normalise_value(v, self.digits)) for n, v in zip(par_n, par_v))
+		sets = sorted((str(k), normalise_value(v, self.digits)) for k, v in settings.items())
+		h = hashlib.sha256()
+		h.update(model.encode())
+		h.update(json.dumps(pars).encode())
+		h.update(json.dumps(sets).encode())
+		return h.hexdigest()
+
+	def count(self, name, n=1):
+		con = self.connect()
+		con.execute('INSERT OR IGNORE INTO stats VALUES (?,0)', (name,))
+		con.execute('UPDATE stats SET value=value+? WHERE name=?', (n, name))
+
+	def __contains__(self, key):
+		"""Whether `key` is stored (not counted as a hit or miss)."""
+		con = self.connect()
+		return con.execute('SELECT 1 FROM results WHERE key=?', (key,)).fetchone() is not None
+
+	def get(self, key):
+		"""Cached result for `key` as a dict with 'perf', 'extra' and 'traj'
+		(None where not stored), or None on a miss."""
+		con = self.connect()
+		row = con.execute('SELECT perf, extra, traj FROM results WHERE key=?', (key,)).fetchone()
+		if row is None:
+			self.count('misses')
+			return None
+		con.execute('UPDATE results SET used=?, hits=hits+1 WHERE key=?', (time.time(), key))
+		self.count('hits')
+		traj = None
+		if row[2] is not None:
+			with np.load(io.BytesIO(row[2])) as f:
+				traj = dict((n, f[n]) for n in f.files)
+		return {'perf': json.loads(row[0]),
+			'extra': None if row[1] is None else json.loads(row[1]),
+			'traj': traj}
+
+	def put(self, key, perf, extra=None, traj=None, model=None, params=None, settings=None):
+		"""Store a result, then evict old entries if over the size limit.
+
+		perf: performance vector (list of numbers)
+		extra: optional JSON-serialisable value stored alongside
+		traj: optional dict of name -> array of reduced trajectories
+		model, params, settings: optional description of the entry, for
+		inspecting the cache only
+		"""
+		blob = None
+		if traj is not None:
+			buf = io.BytesIO()
+			np.savez_compressed(buf, **dict((n, np.asarray(v)) for n, v in traj.items()))
+			blob = buf.getvalue()
+		perf = json.dumps([None if v is None else float(v) for v in perf])
+		extra = None if extra is None else json.dumps(extra)
+		desc = [None if d is None else json.dumps(d) for d in (params, settings)]
+		size = len(perf) + len(extra or '') + len(blob or b'')
+		t = time.time()
+		self.connect().execute('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+			(key, model, desc[0], desc[1], perf, extra, blob, size, t, t, 0))
+		self.evict()
+
+	def size(self):
+		"""Number of entries and their total size in bytes."""
+		n, size = self.connect().execute('SELECT COUNT(*), SUM(size) FROM results').fetchone()
+		return n, size or 0
+
+	def evict(self, maxsize=None):
+		"""Remove least recently used entries until under `maxsize` bytes."""
+		if maxsize is None:
+			maxsize = self.maxsize
+		con = self.connect()
+		n, total = self.size()
+		if total <= maxsize:
+			return
+		con.execute('BEGIN IMMEDIATE')
+		try:
+			rows = con.execute('SELECT key, size FROM results ORDER BY used').fetchall()
+			total = sum(r[1] for r in rows)
+			drop = []
+			for key, size in rows:
+				if total <= maxsize:
+					break
+				drop.append((key,))
+				total -= size
+			con.executemany('DELETE FROM results WHERE key=?', drop)
+			self.count('evictions', len(drop))
+			con.execute('COMMIT')
+		except Exception:
+			con.execute('ROLLBACK')
+			raise
+
+	def clear(self):
+		self.evict(maxsize=0)
+
+	def counters(self):
+		"""Hits, misses and evictions since the cache was created."""
+		rows = dict(self.connect().execute('SELECT name, value FROM stats'))
+		return dict((n, rows.get(n, 0)) for n in ('hits', 'misses', 'evictions'))
+
+	def stats(self):
+		"""Counters since this object was created (from all processes using
+		the cache), plus the current number of entries and size."""
+		c = self.counters()
+		st = dict((n, c[n] - self.base[n]) for n in c)
+		st['entries'], st['size'] = self.size()
+		return st
+
+	def report(self):
+		st = self.stats()
+		n = st['hits'] + st['misses']
+		return 'Result cache: %d hits, %d misses (%.0f%% hit rate), %d evicted; %d entries, %.1f MB in %s'%(
+			st['hits'], st['misses'], 100*st['hits']/max(n, 1), st['evictions'],
+			st['entries'], st['size']/1024**2, self.root)
+
+
+def get_result_cache(cache=None):
+	"""Result cache for the command line options of st_simulate and similar.
+
+	`cache` can be a `ResultCache`, a cache directory, `True` to use the
+	default directory, or `False` to disable caching. If `None`, caching is
+	enabled only when the ST_RESULT_CACHE environment variable is set.
+	"""
+	if cache is None:
+		cache = bool(os.environ.get('ST_RESULT_CACHE'))
+	if cache is True:
+		return ResultCache()
+	if cache and not isinstance(cache, ResultCache):
+		return ResultCache(cache)
+	return cache or None
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='report on, or clear, the result cache')
+	parser.add_argument('dir', nargs='?', default=None,
+			help='directory of the cache (default: $ST_RESULT_CACHE, or ~/.cache/solartherm/results)')
+	parser.add_argument('--clear', action='store_true',
+			help='remove all entries')
+	args = parser.parse_args()
+	cache = ResultCache(args.dir)
+	if args.clear:
+		cache.clear()
+	cache.base = dict((n, 0) for n in cache.base) # totals over the life of the cache
+	print(cache.report())
+
+# vim: ts=4:sw=4:noet:tw=80
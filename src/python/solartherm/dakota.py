@@ -26,8 +26,26 @@
 
 
 import os
+import copy
+import json
+import atexit
+import shutil
+import socket
+import tempfile
+import threading
+import traceback
+import socketserver
 
-def gen_dakota_in(response, method, variables, savedir):
+try:
+	import dakota.interfacing as di
+except ImportError:
+	di = None
+
+from solartherm import postproc
+from solartherm import simulation
+from solartherm import cache as caches
+
+def gen_dakota_in(response, method, variables, savedir, concurrency=1, work_directory=None, link_files=[]):
 	"""
 	Generate dakota input file: sample.in
 
@@ -40,6 +58,12 @@ def gen_dakota_in(response, method, variables, savedir):
                          e.g. generated by the Uncertainty class
 	* `mofn` (str): the absolute directory of the modelica file
 	* `savedir` (str): directory to save the sample.in file	
+	* `concurrency` (int): number of evaluations that each Dakota process
+		runs at once (asynchronous evaluation_concurrency)
+	* `work_directory` (str): if given, each evaluation runs in its own
+		directory `<work_directory>/eval.<n>` (relative to `savedir`),
+		removed afterwards, with links to the `link_files` (e.g. the
+		compiled model and its init XML)
 	"""
 
 	tmpl="""\
@@ -57,13 +81,13 @@ model
     single
 
 interface
-	fork
+	fork%s
 	analysis_drivers = "%s/interface_bb.py"
 	parameters_file = "params.in"
 	results_file = "results.out"
 	file_tag 
 	#file_save 
-
+%s
 responses
 	%s
 
@@ -73,7 +97,16 @@ method
 %s
 """
 
-	sample = tmpl%(savedir, response, variables, method)
+	asynch = ''
+	if concurrency > 1:
+		asynch = '\n\tasynchronous evaluation_concurrency = %s'%concurrency
+	workdir = ''
+	if work_directory is not None:
+		workdir = '\twork_directory named "%s/eval"\n\t\tdirectory_tag\n'%work_directory
+		if len(link_files):
+			workdir += '\t\tlink_files%s\n'%''.join(' "%s"'%os.path.abspath(f) for f in link_files)
+
+	sample = tmpl%(asynch, savedir, workdir, response, variables, method)
 
 	if not os.path.exists(savedir):
 		os.makedirs(savedir)
@@ -365,153 +398,341 @@ output silent
 		return r
 
 
+# environment variable through which the analysis driver finds the socket of
+# the evaluation daemon
+SOCKET_ENV = 'ST_DAKOTA_SOCKET'
+
+
 def gen_interface_bb(savedir):
 	"""
 	This function generate the interface_bb.py script 
 	which will be excuted by DAKOTA
 
 	* `savedir` (str): directory to save the interface_bb.py file	
-	* `perf_n` (list of str): a list of the names of the resulting performance
-		, e.g. lcoe, capf, epy, srev	
-	* `perf_sign` (list of float): a list of signs for the optimisation
-		, e.g. 1 is to minimise, -1 is to maximise; 
-		perf_sign=None if it is a study other than optimisation		
+
+	The script hands the evaluation to the `EvaluationDaemon` whose socket is
+	given by the ST_DAKOTA_SOCKET environment variable, so that it does not
+	have to start Python, import SolarTherm and load the model for every
+	evaluation. Without a daemon (or where the daemon cannot be reached, e.g.
+	on another node), the evaluation is done by an `Evaluator` in the
+	script's own process.
 	"""
 	
 
-	bb="""\
-#!/usr/bin/env python3
-# Dakota will execute this script
-# The command line arguments will be extracted by dakota.interfacing automatically.
+	bb=r"""#!/usr/bin/env python3
+# Dakota will execute this script with the names of the parameters and results
+# files. The evaluation is done by the SolarTherm evaluation daemon listening
+# on $ST_DAKOTA_SOCKET (see solartherm.dakota.EvaluationDaemon), or else here.
 
-# load the necessary Python modeuls
-import dakota.interfacing as di
 import os
-import glob
-
-##### Parse Dakota parameters file
-params, results = di.read_parameters_file()
-
-##### obtain the modelica file name
-# TODO surely there is a cleaner way of writing this part...
-# variable names and values
-# index of the case (suffix for output)
-names=params.descriptors
-fn=params.__getitem__("fn") #the modelica file
-system=params.__getitem__("system") # fuel system or power system
-num_perf=int(params.__getitem__("num_perf")) # number of the performance results 
-model=os.path.splitext(os.path.split(fn)[1])[0] # model name
-start=str(params.__getitem__("start")) 
-stop=str(params.__getitem__("stop")) 
-step=str(params.__getitem__("step"))
-initStep=params.__getitem__("initStep")
-maxStep=params.__getitem__("maxStep") 
-integOrder=str(params.__getitem__("integOrder"))
-solver=str(params.__getitem__("solver"))
-nls=str(params.__getitem__("nls"))
-lv=str(params.__getitem__("lv"))
-
-runsolstice=params.__getitem__("runsolstice")
-peaker=params.__getitem__("peaker")
-
-initStep = None if initStep == 'None' else str(initStep)
-maxStep = None if maxStep == 'None' else str(maxStep)
-
-var_n=[] # variable names
-var_v=[] # variable values
-
-print('')
-
-print(names[:-(14+2*num_perf)])
-for n in names[:-(14+2*num_perf)]:
-	#var_n.append(n.encode("UTF-8"))
-	var_n.append(str(n))
-	var_v.append(str(params.__getitem__(n)))
-	print('variable   : ', n, '=', params.__getitem__(n))
-
-##### case suffix
-suffix=results.results_file.split(".")[-1]
-
-if runsolstice=='True':
-	optic_folder='optic_case_%s'%suffix
-	var_n.append('casefolder')
-	var_v.append(optic_folder)
-	print('casefolder = '+ optic_folder)
-
-##### run solartherm
-from solartherm import postproc
-from solartherm import simulation
-sim = simulation.Simulator(fn=fn, suffix=suffix, fusemount=False)
-if not os.path.exists(model):
-	sim.compile_model()
-	sim.compile_sim(args=['-s'])
+import sys
+import json
+import socket
+
+params_fn, results_fn = sys.argv[1:3]
+
+reply = None
+sock_fn = os.environ.get('ST_DAKOTA_SOCKET')
+if sock_fn and hasattr(socket, 'AF_UNIX'):
+	s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		s.connect(sock_fn)
+		req = {'params': os.path.abspath(params_fn),
+			'results': os.path.abspath(results_fn), 'cwd': os.getcwd()}
+		s.sendall((json.dumps(req) + '\n').encode())
+		line = s.makefile('rb').readline()
+		reply = json.loads(line.decode()) if line else None
+	except (OSError, ValueError):
+		reply = None
+	finally:
+		s.close()
+
+if reply is None or reply.get('local'):
+	from solartherm import dakota
+	dakota.Evaluator().run(params_fn, results_fn)
+elif not reply['ok']:
+	sys.exit('Evaluation failed: ' + reply['error'])
+"""
+	if not os.path.exists(savedir):
+		os.makedirs(savedir)
+	with open(savedir+'/interface_bb.py', 'w') as f:
+		f.write(bb)
 
-sim.update_pars(var_n, var_v)
-#sim.simulate(start=0, stop='1y', step='5m',solver='dassl', nls='newton')
-#sim.simulate(start=0, stop='1y', step='1h',initStep='60s', maxStep='60s', solver='dassl', nls='newton')
-sim.simulate(start=start, stop=stop, step=step, initStep=initStep, maxStep=maxStep, integOrder=integOrder, solver=solver, nls=nls, lv=lv)
 
-try:
-	if system=='TEST':
-		import sys
-		print("SYS.EXECUTABLE =",sys.executable)
-		print("SYS.PATH =",sys.path)
-		import DyMat
-		res=DyMat.DyMatFile(sim.res_fn)
+def cache_settings(params):
+	"""
+	Result-cache settings (see `cache.sim_settings`) of the evaluations with
+	the Dakota state `params` (name -> value, as set up by
+	`UncertaintyDakotaIn` or `OptimisationDakotaIn.variables`).
+	"""
+	num_perf = int(params["num_perf"])
+	if params["system"]=='TEST':
+		result = 'TEST:'+','.join(str(params["index%s"%i]) for i in range(num_perf))
+	elif params["system"]=='FUEL':
+		result = 'SimResultFuel'
 	else:
-		if system=='FUEL':
-			resultclass = postproc.SimResultFuel(sim.res_fn)
-		else:
-			resultclass = postproc.SimResultElec(sim.res_fn)
+		result = 'SimResultElec'
+	initStep = None if params["initStep"] == 'None' else str(params["initStep"])
+	maxStep = None if params["maxStep"] == 'None' else str(params["maxStep"])
+	return caches.sim_settings(str(params["start"]), str(params["stop"]), str(params["step"]),
+		initStep=initStep, maxStep=maxStep, integOrder=str(params["integOrder"]),
+		solver=str(params["solver"]), nls=str(params["nls"]), result=result,
+		peaker=(params["peaker"]=='True'))
 
-		if peaker=='True':
-			perf = resultclass.calc_perf(peaker=True)
-		else:
-			perf = resultclass.calc_perf()
 
+def prepare_model(fn):
+	"""
+	Simulator of the model file `fn`, compiled in the working directory
+	unless it is there already.
 
-	solartherm_res=[]
+	A lock file serialises this between processes, so that concurrent
+	evaluations compile the model only once and never use a partly written
+	executable or init XML. Run it before the study starts, so that the
+	evaluations do not wait for the compilation.
+	"""
+	sim = simulation.Simulator(fn=fn, fusemount=False, override=True)
+	with caches.FileLock(sim.model + '.lock'):
+		if not (os.path.exists(sim.model) and os.path.exists(sim.init_in_fn)):
+			sim.compile_model()
+			sim.compile_sim(args=['-s'])
+	return sim
 
-	for i in range(num_perf):
-		sign=float(params.__getitem__("sign%s"%i))
 
-		if system=='TEST':
-			name=params.__getitem__("index%s"%i)
-			solartherm_res.append(sign*res.data(name)[0])
-			print('objective %s: '%i, name, sign*res.data(name)[0])
+class Evaluator(object):
+	"""
+	Evaluation of SolarTherm models for the Dakota analysis driver.
+
+	The parameters of an evaluation are those set up by
+	`UncertaintyDakotaIn` or `OptimisationDakotaIn.variables`: the model
+	file, simulation settings, result indices and signs, followed by the
+	design variables. The model is compiled (see `prepare_model`) and its
+	init XML loaded once per model file; each evaluation then runs
+	on a copy of that Simulator with the suffix of the evaluation, passing
+	the parameter values through an override file rather than a new init
+	XML. Evaluations may run concurrently in several threads.
+
+	`rcache` is the result cache (see `cache.get_result_cache`), by default
+	enabled by the ST_RESULT_CACHE environment variable.
+	"""
+	def __init__(self, rcache=None):
+		self.sims = {}
+		self.digests = {}
+		self.lock = threading.Lock()
+		self.rcache = caches.get_result_cache(rcache)
+
+	def simulator(self, fn):
+		"""Simulator of the model file `fn`, with its init XML loaded."""
+		with self.lock:
+			sim = self.sims.get(fn)
+			if sim is None:
+				sim = prepare_model(fn)
+				sim.load_init()
+				if self.rcache is not None:
+					self.digests[fn] = caches.model_digest(sim.compiled_files())
+				self.sims[fn] = sim
+		return sim
+
+	def evaluate(self, params, suffix):
+		"""Responses for the Dakota parameters `params` (a
+		`dakota.interfacing` Parameters, or anything with its `descriptors`
+		and item access), simulated with init file suffix `suffix`."""
+		names = params.descriptors
+		fn = params["fn"] #the modelica file
+		system = params["system"] # fuel system or power system
+		num_perf = int(params["num_perf"]) # number of the performance results
+		start = str(params["start"])
+		stop = str(params["stop"])
+		step = str(params["step"])
+		initStep = params["initStep"]
+		maxStep = params["maxStep"]
+		integOrder = str(params["integOrder"])
+		solver = str(params["solver"])
+		nls = str(params["nls"])
+		lv = str(params["lv"])
+		runsolstice = params["runsolstice"]
+		peaker = params["peaker"]
+
+		initStep = None if initStep == 'None' else str(initStep)
+		maxStep = None if maxStep == 'None' else str(maxStep)
+
+		var_n = [] # variable names
+		var_v = [] # variable values
+		for n in names[:-(14+2*num_perf)]:
+			var_n.append(str(n))
+			var_v.append(str(params[n]))
+			print('variable   : ', n, '=', params[n])
+
+		if runsolstice=='True':
+			optic_folder = 'optic_case_%s'%suffix
+			var_n.append('casefolder')
+			var_v.append(optic_folder)
+			print('casefolder = '+ optic_folder)
+
+		sim = copy.copy(self.simulator(fn))
+		sim.suffix = suffix
+
+		# result cache, not for solstice cases
+		rcache = None if runsolstice=='True' else self.rcache
+		cached = None
+		if rcache is not None:
+			key = rcache.key(self.digests[fn], var_n, var_v, cache_settings(params))
+			with self.lock:
+				cached = rcache.get(key)
+			if cached is not None and (cached['extra'] or {}).get('partial'):
+				# taken from the responses of another study (see dakotadata)
+				if any(cached['perf'][int(params["index%s"%i])] is None for i in range(num_perf)):
+					cached = None
+
+		try:
+			if cached is not None:
+				print('Result taken from the result cache')
+				perf = cached['perf']
+			else:
+				sim.update_pars(var_n, var_v)
+				sim.simulate(start=start, stop=stop, step=step, initStep=initStep, maxStep=maxStep, integOrder=integOrder, solver=solver, nls=nls, lv=lv)
+				if system=='TEST':
+					import DyMat
+					res = DyMat.DyMatFile(sim.res_fn)
+					perf = [res.data(str(params["index%s"%i]))[0] for i in range(num_perf)]
+					if rcache is not None:
+						with self.lock:
+							rcache.put(key, perf, params=var_v)
+				else:
+					if system=='FUEL':
+						res = postproc.SimResultFuel(sim.res_fn)
+					else:
+						res = postproc.SimResultElec(sim.res_fn)
+					if peaker=='True':
+						perf = res.calc_perf(peaker=True)
+					else:
+						perf = res.calc_perf()
+					if rcache is not None:
+						constr, distance = res.constrained_optimisation()
+						with self.lock:
+							rcache.put(key, perf, extra={'constrained': [bool(constr), float(distance)]}, params=var_v)
+
+			solartherm_res = []
+			perf_n = postproc.SimResultFuel.perf_n if system=='FUEL' else postproc.SimResultElec.perf_n
+			for i in range(num_perf):
+				sign = float(params["sign%s"%i])
+				if system=='TEST':
+					name = params["index%s"%i]
+					solartherm_res.append(sign*perf[i])
+					print('objective %s: '%i, name, sign*perf[i])
+				else:
+					idx = int(params["index%s"%i])
+					solartherm_res.append(sign*perf[idx])
+					print('objective %s: '%i, perf_n[idx], sign*perf[idx])
+		except Exception as e:
+			solartherm_res = []
+			for i in range(num_perf):
+				sign = float(params["sign%s"%i])
+				if sign>0: #minimisation
+					error = 99999
+				else: # maxmisation
+					error = 0
+				solartherm_res.append(sign*error)
+			print('Simulation Failed:', e)
+		finally:
+			for f in (sim.res_fn, sim.override_fn):
+				if os.path.exists(f):
+					os.remove(f)
+
+		return solartherm_res
+
+	def run(self, params_fn, results_fn):
+		"""Evaluate the Dakota parameters file `params_fn` and write the
+		responses to the results file `results_fn`."""
+		assert di is not None, 'Library for Dakota interfacing (dakota.interfacing) is not installed'
+		params, results = di.read_parameters_file(params_fn, results_fn)
+		suffix = results.results_file.split(".")[-1]
+		responses = self.evaluate(params, suffix)
+		for i, r in enumerate(results.responses()):
+			if r.asv.function:
+				r.function = responses[i]
+		results.write()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+	def handle(self):
+		line = self.rfile.readline()
+		if not line:
+			return
+		req = json.loads(line.decode())
+		cwd = os.path.realpath(os.getcwd())
+		if os.path.commonpath([os.path.realpath(req['cwd']), cwd]) != cwd:
+			# the model files are looked up relative to the working directory
+			reply = {'ok': False, 'local': True}
 		else:
-			idx=int(params.__getitem__("index%s"%i))
-			solartherm_res.append(sign*perf[idx])
-			print('objective %s: '%i, resultclass.perf_n[idx], sign*perf[idx])
-except:
-	solartherm_res=[]
-	for i in range(num_perf):	
-		sign=float(params.__getitem__("sign%s"%i))
-		if sign>0: #minimisation
-			error=99999
-		else: # maxmisation
-			error=0 
-
-		idx=int(params.__getitem__("index%s"%i))
-		solartherm_res.append(sign*error)
-	print('Simulation Failed')
-
-
-print()
-
-# Return the results to Dakota
-for i, r in enumerate(results.responses()):
-	if r.asv.function:
-		r.function = solartherm_res[i]
-results.write()
-
-map(os.unlink, glob.glob(sim.res_fn))
-#map(os.unlink, glob.glob(model+'_init_*.xml'))
-"""
-	if not os.path.exists(savedir):
-		os.makedirs(savedir)
-	with open(savedir+'/interface_bb.py', 'w') as f:
-		f.write(bb)
+			try:
+				self.server.evaluator.run(req['params'], req['results'])
+				reply = {'ok': True}
+			except Exception as e:
+				traceback.print_exc()
+				reply = {'ok': False, 'error': '%s: %s'%(type(e).__name__, e)}
+		self.wfile.write((json.dumps(reply) + '\n').encode())
+
+
+class EvaluationDaemon(object):
+	"""
+	Resident server of Dakota evaluations for the analysis driver written by
+	`gen_interface_bb`.
+
+	The daemon runs in threads of the calling process (e.g. st_optimise,
+	while it runs Dakota) and listens on a Unix socket, whose file name it
+	puts in the ST_DAKOTA_SOCKET environment variable for the Dakota
+	processes started meanwhile. Each driver passes the names of its
+	parameters and results files; the evaluation is run by `evaluator` (by
+	default an `Evaluator`), which keeps the Simulator and result cache
+	between evaluations. Concurrent evaluations (several Dakota processes,
+	or asynchronous evaluations) each get a thread.
+
+	Evaluations requested from outside the working directory of the daemon
+	are left to the driver; those from Dakota work directories below it
+	(see `gen_dakota_in`) are simulated in the working directory.
+
+	>>> with EvaluationDaemon():
+	...     subprocess.call('dakota -i sample.in -o sample.out', shell=True)
+	"""
+	def __init__(self, socket_fn=None, evaluator=None):
+		assert hasattr(socket, 'AF_UNIX'), 'The evaluation daemon needs Unix sockets'
+		self.tempdir = None
+		if socket_fn is None:
+			# socket paths are limited to about 100 characters
+			self.tempdir = tempfile.mkdtemp(prefix='st-dakota-')
+			socket_fn = os.path.join(self.tempdir, 'eval.sock')
+		self.socket_fn = socket_fn
+		self.evaluator = Evaluator() if evaluator is None else evaluator
+		self.server = socketserver.ThreadingUnixStreamServer(socket_fn, _Handler)
+		self.server.daemon_threads = True
+		self.server.evaluator = self.evaluator
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		self.environ = os.environ.get(SOCKET_ENV)
+		os.environ[SOCKET_ENV] = socket_fn
+		atexit.register(self.close)
+
+	def close(self):
+		if self.server is None:
+			return
+		self.server.shutdown()
+		self.server.server_close()
+		self.server = None
+		if self.environ is None:
+			os.environ.pop(SOCKET_ENV, None)
+		else:
+			os.environ[SOCKET_ENV] = self.environ
+		if os.path.exists(self.socket_fn):
+			os.remove(self.socket_fn)
+		if self.tempdir is not None:
+			shutil.rmtree(self.tempdir, ignore_errors=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
 
 if __name__=='__main__':
 	# FIXME move all test code to tests folder if possible
@@ -0,0 +1,189 @@
+"""
+Reuse of the evaluations of Dakota studies.
+
+Dakota only reuses the evaluations in its restart file, and only for a study
+asking for exactly the same variables. `ingest` reads the evaluations of a
+study set up by `dakota.gen_dakota_in` (from its tabular data file, or its
+restart file converted with dakota_restart_util) and adds them
+
+ * to a `store.SweepStore`, one row per distinct parameter vector, for
+   analysis alongside st_simulate sweeps, and
+ * to the result cache (see `cache.ResultCache`), under the same keys as
+   the evaluations of `dakota.Evaluator`, so that any later study of the
+   same model and simulation settings (e.g. a new sample overlapping an old
+   one) does not simulate those points again.
+
+The responses of a study are (signed) elements of the performance vector
+only, so the cached performance vectors are partial: they are marked as
+such, and used only by Dakota evaluations needing the elements they have.
+Evaluations that failed (with the penalty responses of `dakota.Evaluator`)
+are stored as failed and not cached.
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import shlex
+import shutil
+import subprocess as sp
+
+from solartherm import postproc
+from solartherm import simulation
+from solartherm import cache as caches
+from solartherm.dakota import cache_settings
+
+
+class Study(object):
+	"""Settings of a Dakota study, from the input file written by
+	`dakota.gen_dakota_in` (usually sample.in)."""
+	def __init__(self, fn='sample.in'):
+		self.fn = fn
+		self.state = None
+		self.par_n = []
+		values = None
+		with open(fn) as f:
+			for line in f:
+				toks = shlex.split(line, comments=True)
+				if not toks:
+					continue
+				if toks[0] == 'set_values' and self.state is None:
+					values = toks[1:]
+				elif toks[0] == 'descriptors':
+					if values is not None and self.state is None:
+						self.state = dict(zip(toks[1:], values))
+					else:
+						self.par_n.extend(toks[1:])
+		if self.state is None:
+			raise ValueError("No SolarTherm study settings in '%s'"%(fn,))
+		self.system = self.state['system']
+		self.num_perf = int(self.state['num_perf'])
+		self.sign = [float(self.state['sign%d'%i]) for i in range(self.num_perf)]
+		if self.system == 'TEST':
+			self.index = list(range(self.num_perf))
+			self.perf_n = [self.state['index%d'%i] for i in range(self.num_perf)]
+		else:
+			self.index = [int(self.state['index%d'%i]) for i in range(self.num_perf)]
+			if self.system == 'FUEL':
+				self.perf_n = postproc.SimResultFuel.perf_n
+			else:
+				self.perf_n = postproc.SimResultElec.perf_n
+
+	@property
+	def model_fn(self):
+		return self.state['fn']
+
+	def settings(self):
+		"""Result-cache settings of the evaluations."""
+		return cache_settings(self.state)
+
+	def model_digest(self):
+		"""Digest of the compiled model in the working directory."""
+		sim = simulation.Simulator(self.model_fn, fusemount=False, cache=False, scratch=False)
+		files = sim.compiled_files()
+		if not os.path.exists(sim.model):
+			raise RuntimeError("Model '%s' is not compiled in '%s'"%(sim.model, os.getcwd()))
+		return caches.model_digest(files)
+
+	def perf(self, responses):
+		"""Performance vector (with None for the elements not given by the
+		responses) and whether the evaluation failed."""
+		perf = [None]*len(self.perf_n)
+		failed = True
+		for i, r in enumerate(responses):
+			# see the penalties in dakota.Evaluator.evaluate
+			if r != self.sign[i]*(99999 if self.sign[i] > 0 else 0):
+				failed = False
+			perf[self.index[i]] = r/self.sign[i]
+		return perf, failed
+
+
+def read_tabular(fn, par_n, num_resp):
+	"""Iterate over the evaluations in the annotated Dakota tabular data file
+	`fn`, as (evaluation id, values of the variables `par_n`, responses),
+	where the responses are the last `num_resp` columns."""
+	with open(fn) as f:
+		header = None
+		for line in f:
+			toks = line.split()
+			if not toks:
+				continue
+			if header is None:
+				if not toks[0].startswith('%'):
+					raise ValueError("'%s' is not an annotated tabular data file"%(fn,))
+				header = [toks[0][1:]] + toks[1:]
+				missing = [n for n in par_n if n not in header]
+				if missing:
+					raise ValueError("Variables %s are not in '%s'"%(', '.join(missing), fn))
+				cols = [header.index(n) for n in par_n]
+				continue
+			if len(toks) != len(header):
+				continue # an evaluation being written, or a repeated header
+			yield (int(toks[0]), [toks[j] for j in cols],
+				[float(v) for v in toks[len(toks) - num_resp:]])
+
+
+def restart_to_tabular(rst_fn, out_fn):
+	"""Convert the Dakota restart file `rst_fn` to the tabular data file
+	`out_fn`, with dakota_restart_util."""
+	util = shutil.which('dakota_restart_util')
+	assert util is not None, 'dakota_restart_util is not installed'
+	sp.check_call([util, 'to_tabular', rst_fn, out_fn])
+	return out_fn
+
+
+def ingest(study, tabular, store=None, rcache=None, digits=9):
+	"""Add the evaluations in the tabular data file `tabular` of `study` (a
+	`Study`) to the sweep store `store` and the result cache `rcache`
+	(either may be None). The model must be compiled in the working
+	directory for the result cache.
+
+	Evaluations are deduplicated by parameter vector (compared to `digits`
+	significant digits), also against the runs already in the store, which
+	keep their rows. Points already in the result cache are left as they
+	are. Returns a dict of counts: 'read', 'duplicate', 'failed', 'stored'
+	and 'cached'.
+	"""
+	def norm(par_v):
+		return tuple(caches.normalise_value(v, digits) for v in par_v)
+
+	counts = dict(read=0, duplicate=0, failed=0, stored=0, cached=0)
+	seen = set()
+	i = 0
+	if store is not None:
+		if store.get_meta('par_n') is None:
+			store.set_meta(model=os.path.splitext(os.path.basename(study.model_fn))[0],
+				par_n=study.par_n, perf_n=study.perf_n)
+		elif store.get_meta('par_n') != study.par_n:
+			raise ValueError("The parameters of '%s' differ from those of the study"%(store.fn,))
+		for r in store.runs():
+			seen.add(norm(r['params']))
+			i = max(i, r['index'] + 1)
+	if rcache is not None:
+		model = study.model_digest()
+		settings = study.settings()
+
+	for eval_id, par_v, responses in read_tabular(tabular, study.par_n, study.num_perf):
+		counts['read'] += 1
+		key = norm(par_v)
+		if key in seen:
+			counts['duplicate'] += 1
+			continue
+		seen.add(key)
+		perf, failed = study.perf(responses)
+		if failed:
+			counts['failed'] += 1
+		if store is not None:
+			store.add(i, par_v, None if failed else perf, status='failed' if failed else 'ok',
+				message='dakota evaluation %d in %s'%(eval_id, tabular))
+			counts['stored'] += 1
+			i += 1
+		if rcache is not None and not failed:
+			k = rcache.key(model, study.par_n, par_v, settings)
+			if k not in rcache:
+				partial = study.system != 'TEST'
+				rcache.put(k, perf, extra={'partial': True} if partial else None,
+					model=model, params=par_v, settings=settings)
+				counts['cached'] += 1
+	if store is not None:
+		store.commit()
+	return counts
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,483 @@
+"""
+Executors for running the design points of a sweep.
+
+All executors have the same interface: `run(func, tasks, callback, files)`
+evaluates `func(i, val)` for each `(i, val)` in `tasks` and calls
+`callback(i, ret)` in the calling process as each result arrives. `files`
+are the files of the compiled model, used by executors that stage the model
+on each node. `tasks` may be a list, or a `solartherm.schedule.Scheduler`
+to choose the order in which points are run as the sweep progresses.
+
+	SerialExecutor  one point after another, in the calling process
+	PoolExecutor    a multiprocessing pool on the local machine
+	MPIExecutor     dynamic dispatch to MPI ranks (needs mpi4py); launch the
+	                whole program with mpirun, see `is_root` and `serve`
+	QueueExecutor   work queue in a directory on a shared file system;
+	                workers on any node start with
+	                `python -m solartherm.executor QUEUE_DIR`
+
+With `stage`, MPI and queue workers copy the compiled model once per node
+into a node-local directory (under $TMPDIR) and run their simulations there,
+moving the files they produce back to the original working directory after
+each point. Otherwise they run in the working directory of the sweep, which
+then has to be on a file system shared by all nodes.
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import time
+import glob
+import shutil
+import socket
+import pickle
+import hashlib
+import tempfile
+import threading
+import traceback
+import multiprocessing as mp
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from solartherm.cache import FileLock
+from solartherm.schedule import as_tasks
+from solartherm.scratch import pid_alive
+
+# MPI message tags
+TAG_TASK = 1
+TAG_RESULT = 2
+
+# file marking a directory as a work queue, which may be cleared
+QUEUE_MARKER = '.st-queue'
+
+
+class Stage(object):
+	"""Node-local copy of a compiled model, shared by the workers of a node.
+
+	`enter` creates a private directory for the calling worker, with links to
+	the node copy of `files`, and changes into it. `collect` moves everything
+	else that appeared in that directory back to `outdir`.
+	"""
+	def __init__(self, files, outdir):
+		self.files = [os.path.abspath(f) for f in files]
+		self.outdir = os.path.abspath(outdir)
+		# a recompiled model gets a new node copy
+		h = hashlib.sha1()
+		h.update(self.outdir.encode())
+		for f in self.files:
+			st = os.stat(f)
+			h.update(('\n%s %d %f'%(f, st.st_size, st.st_mtime)).encode())
+		h = h.hexdigest()[:12]
+		self.nodedir = os.path.join(tempfile.gettempdir(), 'solartherm-stage-' + h)
+		self.wdir = None
+
+	def enter(self):
+		if not os.path.isdir(self.nodedir):
+			os.makedirs(self.nodedir, exist_ok=True)
+		with FileLock(self.nodedir + '.lock'):
+			done = os.path.join(self.nodedir, '.complete')
+			if not os.path.exists(done):
+				for f in self.files:
+					shutil.copy2(f, self.nodedir)
+				open(done, 'w').close()
+		self.wdir = tempfile.mkdtemp(prefix='worker-', dir=self.nodedir)
+		for f in self.files:
+			n = os.path.basename(f)
+			try:
+				os.symlink(os.path.join(self.nodedir, n), os.path.join(self.wdir, n))
+			except (OSError, NotImplementedError):
+				shutil.copy2(os.path.join(self.nodedir, n), self.wdir)
+		os.chdir(self.wdir)
+
+	def collect(self):
+		staged = set(os.path.basename(f) for f in self.files)
+		for n in os.listdir(self.wdir):
+			if n not in staged:
+				shutil.move(os.path.join(self.wdir, n), os.path.join(self.outdir, n))
+
+	def leave(self):
+		os.chdir(self.outdir)
+		shutil.rmtree(self.wdir, ignore_errors=True)
+		self.wdir = None
+
+
+def run_task(func, i, val, stage=None):
+	"""Evaluate one point, collecting its files if running in a stage.
+
+	Errors are printed and reported to the caller as a None result, so that
+	a remote worker keeps serving.
+	"""
+	try:
+		return func(i, val)
+	except Exception:
+		traceback.print_exc()
+		return None
+	finally:
+		if stage is not None:
+			stage.collect()
+
+
+class SerialExecutor(object):
+	is_root = True
+
+	def run(self, func, tasks, callback, files=[]):
+		tasks = as_tasks(tasks)
+		tasks.start(1)
+		while len(tasks):
+			i, val = tasks.pop()
+			ret = func(i, val)
+			tasks.done(i)
+			callback(i, ret)
+
+	def close(self):
+		pass
+
+
+class PoolExecutor(object):
+	is_root = True
+
+	def __init__(self, np=mp.cpu_count()):
+		self.np = np
+
+	def run(self, func, tasks, callback, files=[]):
+		tasks = as_tasks(tasks)
+		tasks.start(self.np)
+		results = queue.Queue()
+		pool = mp.Pool(processes=self.np)
+
+		def submit():
+			i, val = tasks.pop()
+			pool.apply_async(func, args=(i, val),
+				callback=(lambda ret, i=i: results.put((i, ret))),
+				error_callback=(lambda e, i=i: results.put((i, None))))
+
+		# only keep as many points in flight as there are workers, so that
+		# the order of the remaining points can still be changed
+		running = 0
+		while len(tasks) and running < self.np:
+			submit()
+			running += 1
+		while running:
+			i, ret = results.get()
+			running -= 1
+			tasks.done(i)
+			callback(i, ret)
+			if len(tasks):
+				submit()
+				running += 1
+		pool.close()
+		pool.join()
+
+	def close(self):
+		pass
+
+
+class MPIExecutor(object):
+	"""Dispatch points to MPI ranks, one at a time as ranks become free.
+
+	Rank 0 runs the sweep (`run`); every other rank must call `serve`
+	instead, and will get its work from rank 0.
+	"""
+	def __init__(self, stage=False):
+		try:
+			from mpi4py import MPI
+		except ImportError:
+			MPI = None
+		assert MPI is not None, 'Library for MPI (mpi4py) is not installed'
+		self.MPI = MPI
+		self.comm = MPI.COMM_WORLD
+		self.rank = self.comm.Get_rank()
+		self.size = self.comm.Get_size()
+		self.is_root = self.rank == 0
+		self.stage = stage
+		self.started = False
+
+	def run(self, func, tasks, callback, files=[]):
+		assert self.size > 1, 'MPI executor needs at least 2 ranks (use mpirun -np N)'
+		assert not self.started, 'MPI executor can only run one sweep'
+		self.started = True
+		self.comm.bcast((func, files, os.getcwd(), self.stage), root=0)
+		tasks = as_tasks(tasks)
+		tasks.start(self.size - 1)
+		active = self.size - 1
+		status = self.MPI.Status()
+		while active:
+			msg = self.comm.recv(source=self.MPI.ANY_SOURCE, tag=TAG_RESULT, status=status)
+			if msg is not None:
+				tasks.done(msg[0])
+				callback(*msg)
+			if len(tasks):
+				self.comm.send(tasks.pop(), dest=status.Get_source(), tag=TAG_TASK)
+			else:
+				self.comm.send(None, dest=status.Get_source(), tag=TAG_TASK)
+				active -= 1
+
+	def close(self):
+		"""Release the other ranks if no sweep was run."""
+		if self.is_root and not self.started:
+			self.started = True
+			self.comm.bcast(None, root=0)
+
+	def serve(self):
+		job = self.comm.bcast(None, root=0)
+		if job is None:
+			return
+		func, files, outdir, stage = job
+		os.chdir(outdir)
+		st = None
+		if stage:
+			st = Stage(files, outdir)
+			st.enter()
+		try:
+			self.comm.send(None, dest=0, tag=TAG_RESULT)
+			while True:
+				task = self.comm.recv(source=0, tag=TAG_TASK)
+				if task is None:
+					break
+				i, val = task
+				self.comm.send((i, run_task(func, i, val, st)), dest=0, tag=TAG_RESULT)
+		finally:
+			if st is not None:
+				st.leave()
+
+
+def _write_pickle(fn, obj):
+	"""Write `obj` to `fn` atomically, for readers on other nodes."""
+	tmp = '%s.tmp-%s-%d'%(fn, socket.gethostname(), os.getpid())
+	with open(tmp, 'wb') as f:
+		pickle.dump(obj, f, protocol=2)
+	os.rename(tmp, fn)
+
+def _read_pickle(fn):
+	with open(fn, 'rb') as f:
+		return pickle.load(f)
+
+
+def _heartbeat(current, interval, stop):
+	"""Touch the task file being run every `interval` seconds, so that the
+	sweep can tell a busy worker on another node from a dead one."""
+	while not stop.wait(interval):
+		fn = current.get('claimed')
+		if fn is not None:
+			try:
+				os.utime(fn, None)
+			except OSError:
+				pass
+
+
+def queue_worker(qdir, poll=0.5):
+	"""Take points from the queue in `qdir` until the sweep is finished.
+
+	Points are claimed by renaming their task file, which is atomic on
+	POSIX file systems (including NFS), so any number of workers on any
+	number of nodes can share a queue. The claimed file is named after the
+	host and process of the worker, and touched while the point runs.
+	"""
+	qdir = os.path.abspath(qdir)
+	job_fn = os.path.join(qdir, 'job.pkl')
+	while not os.path.exists(job_fn):
+		time.sleep(poll)
+	func, files, outdir, stage, lease = _read_pickle(job_fn)
+	os.chdir(outdir)
+	st = None
+	if stage:
+		st = Stage(files, outdir)
+		st.enter()
+	me = '%s-%d'%(socket.gethostname(), os.getpid())
+	current = {}
+	stop = threading.Event()
+	beat = threading.Thread(target=_heartbeat, args=(current, lease/4., stop))
+	beat.daemon = True
+	beat.start()
+	try:
+		while True:
+			claimed = None
+			for fn in sorted(glob.glob(os.path.join(qdir, 'tasks', '*.pkl'))):
+				dst = os.path.join(qdir, 'claimed', me + '-' + os.path.basename(fn))
+				try:
+					os.rename(fn, dst)
+				except OSError:
+					continue # taken by another worker
+				claimed = dst
+				break
+			if claimed is None:
+				if os.path.exists(os.path.join(qdir, 'stop')):
+					break
+				time.sleep(poll)
+				continue
+			current['claimed'] = claimed
+			i, val = _read_pickle(claimed)
+			t = time.time()
+			ret = run_task(func, i, val, st)
+			current['claimed'] = None
+			_write_pickle(os.path.join(qdir, 'done', os.path.basename(claimed)[len(me) + 1:]),
+				(i, ret, time.time() - t))
+			try:
+				os.remove(claimed)
+			except OSError:
+				pass # put back in the queue, taking too long
+	finally:
+		stop.set()
+		if st is not None:
+			st.leave()
+
+
+class QueueExecutor(object):
+	"""Work queue in directory `qdir`, served by `queue_worker` processes.
+
+	`nlocal` workers are started on this machine; more can be started on
+	other nodes sharing the file system at any time during the sweep.
+
+	The directory is cleared at the start of a sweep, so it must be new,
+	empty or a queue of an earlier sweep. Points claimed by a worker that has
+	gone (a dead process on this host, or no heartbeat for `lease` seconds on
+	another one) are put back in the queue, and reported as failed once
+	their workers have gone `attempts` times.
+	"""
+	is_root = True
+
+	def __init__(self, qdir, nlocal=0, stage=False, poll=0.5, lease=60., attempts=3):
+		self.qdir = os.path.abspath(qdir)
+		self.nlocal = nlocal
+		self.stage = stage
+		self.poll = poll
+		self.lease = lease
+		self.attempts = attempts
+
+	def prepare(self):
+		"""Start from an empty queue, refusing to clear any other directory."""
+		if os.path.isdir(self.qdir) and os.listdir(self.qdir):
+			if not os.path.exists(os.path.join(self.qdir, QUEUE_MARKER)):
+				raise ValueError("Queue directory '%s' is not empty and is not"
+					" the queue of an earlier sweep"%(self.qdir,))
+			shutil.rmtree(self.qdir)
+		for d in ('tasks', 'claimed', 'done'):
+			os.makedirs(os.path.join(self.qdir, d), exist_ok=True)
+		open(os.path.join(self.qdir, QUEUE_MARKER), 'w').close()
+
+	def claims(self, tasks, seen, workers):
+		"""Report to `tasks` the points that workers have started."""
+		for fn in glob.glob(os.path.join(self.qdir, 'claimed', '*.pkl')):
+			try:
+				whost, pid, n, rest = os.path.basename(fn).rsplit('-', 3)
+				i = int(rest.split('.')[0])
+			except ValueError:
+				continue
+			workers.add((whost, pid))
+			if fn not in seen:
+				seen.add(fn)
+				tasks.claimed(i, len(workers))
+
+	def reclaim(self, outstanding, gone, tasks, callback):
+		"""Put back the points of workers that have gone."""
+		host = socket.gethostname()
+		now = time.time()
+		for fn in glob.glob(os.path.join(self.qdir, 'claimed', '*.pkl')):
+			try:
+				whost, pid, n, rest = os.path.basename(fn).rsplit('-', 3)
+				pid = int(pid)
+			except ValueError:
+				continue
+			name = n + '-' + rest
+			try:
+				if whost == host:
+					dead = not pid_alive(pid)
+				else:
+					dead = now - os.path.getmtime(fn) > self.lease
+			except OSError:
+				continue # finished meanwhile
+			if not dead or name not in outstanding:
+				continue
+			gone[name] = gone.get(name, 0) + 1
+			try:
+				if gone[name] < self.attempts:
+					os.rename(fn, os.path.join(self.qdir, 'tasks', name))
+					print("Worker %s-%d has gone, point %s is queued again"%(whost, pid, name))
+					continue
+				i, val = _read_pickle(fn)
+				os.remove(fn)
+			except (OSError, EOFError):
+				continue
+			print("Point %s failed: its workers have gone %d times"%(name, gone[name]))
+			outstanding.discard(name)
+			tasks.done(i)
+			callback(i, None)
+
+	def run(self, func, tasks, callback, files=[]):
+		self.prepare()
+		# workers take tasks in file name order, so the order is fixed here
+		tasks = as_tasks(tasks)
+		tasks.start(max(1, self.nlocal))
+		outstanding = set()
+		while len(tasks):
+			i, val = tasks.pop(queued=True)
+			name = '%09d-%09d.pkl'%(len(outstanding), i)
+			_write_pickle(os.path.join(self.qdir, 'tasks', name), (i, val))
+			outstanding.add(name)
+		_write_pickle(os.path.join(self.qdir, 'job.pkl'),
+			(func, files, os.getcwd(), self.stage, self.lease))
+
+		workers = []
+		for j in range(self.nlocal):
+			p = mp.Process(target=queue_worker, args=(self.qdir, self.poll))
+			p.start()
+			workers.append(p)
+		gone = {}
+		seen = set()
+		active = set()
+		try:
+			while outstanding:
+				self.claims(tasks, seen, active)
+				done = sorted(glob.glob(os.path.join(self.qdir, 'done', '*.pkl')))
+				for fn in done:
+					i, ret, walltime = _read_pickle(fn)
+					os.remove(fn)
+					name = os.path.basename(fn)
+					# a point queued again may finish twice
+					if name in outstanding:
+						outstanding.discard(name)
+						tasks.done(i, walltime)
+						callback(i, ret)
+				if outstanding:
+					for p in workers:
+						p.is_alive() # reaps local workers that have died
+					self.reclaim(outstanding, gone, tasks, callback)
+				if not done:
+					time.sleep(self.poll)
+		finally:
+			open(os.path.join(self.qdir, 'stop'), 'w').close()
+			for p in workers:
+				p.join()
+
+	def close(self):
+		pass
+
+
+def get_executor(kind='pool', np=mp.cpu_count(), queue=None, stage=False):
+	"""Executor for the command line options of st_simulate and similar.
+
+	kind: 'pool' (serial if `np` is 0), 'mpi' or 'queue'
+	queue: directory of the queue, for kind 'queue'
+	"""
+	if kind == 'pool':
+		if np:
+			return PoolExecutor(np)
+		return SerialExecutor()
+	elif kind == 'mpi':
+		return MPIExecutor(stage=stage)
+	elif kind == 'queue':
+		assert queue is not None, 'The queue executor needs a queue directory'
+		return QueueExecutor(queue, nlocal=np, stage=stage)
+	raise ValueError("Unknown executor '%s'"%(kind,))
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='serve a sweep work queue')
+	parser.add_argument('queue',
+			help='directory of the queue, as given to the sweep')
+	parser.add_argument('--poll', type=float, default=0.5,
+			help='polling interval in seconds')
+	args = parser.parse_args()
+	queue_worker(args.queue, args.poll)
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,282 @@
+"""
+Export of selected variables from simulation results to compact columnar
+files.
+
+A full `_res.mat` file holds every variable of the model, while only a few of
+them are normally used afterwards (for instance the inputs of
+`SimResultElec.calc_perf`). `export_result` extracts a chosen list of
+variables, optionally resamples the trajectories onto a regular time grid,
+and writes them to one of the following formats, chosen by file extension:
+
+	.parquet          Apache Parquet (needs pyarrow)
+	.arrow, .feather  Arrow IPC / Feather v2 (needs pyarrow)
+	.h5, .hdf5        HDF5 (needs h5py)
+	.npz              compressed numpy archive (no extra dependency)
+
+Trajectories are stored as columns alongside a `time` column. Parameters
+(constant over the simulation) and the units of all variables are stored as
+metadata. `ExportedResult` reads the files back with the same interface as
+the mat-file readers, so that `SimResult` and its `calc_perf` methods work
+on exported files unchanged.
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import json
+import fnmatch
+import numpy as np
+
+FORMATS = {
+	'.parquet': 'parquet',
+	'.arrow': 'arrow',
+	'.feather': 'arrow',
+	'.h5': 'hdf5',
+	'.hdf5': 'hdf5',
+	'.npz': 'npz',
+	}
+
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'hdf5': '.h5', 'npz': '.npz'}
+
+META_KEY = 'solartherm'
+
+def get_format(fn):
+	"""Export format for the file name `fn`, or None if it is not an export."""
+	return FORMATS.get(os.path.splitext(fn)[1].lower())
+
+def export_fn(res_fn, fmt):
+	"""Name of the exported file for results file `res_fn`."""
+	return os.path.splitext(res_fn)[0] + EXTENSIONS[fmt]
+
+def perf_vars(resultclass, peaker=False):
+	"""Variables needed by `resultclass.calc_perf`."""
+	names = list(resultclass.perf_vars)
+	if peaker:
+		names += getattr(resultclass, 'peaker_vars', [])
+	return names
+
+def recorded_vars(patterns, resultclass, peaker=False, keep=[]):
+	"""Variables to record for the patterns given to st_simulate --vars.
+
+	'perf' is accepted for the variables of `resultclass.calc_perf`, which
+	are always added, as every sweep point calculates its performance, and so
+	are the variables `keep` (e.g. those exported or stored).
+	"""
+	names = [p for p in patterns if p != 'perf']
+	for n in perf_vars(resultclass, peaker) + list(keep):
+		if n not in names:
+			names.append(n)
+	return names
+
+def select_vars(mat, patterns, strict=True):
+	"""Names of the variables of `mat` matching `patterns`.
+
+	Patterns may contain shell-style wildcards. With `strict`, a pattern
+	without wildcards that does not name a variable raises a KeyError,
+	otherwise it is silently skipped.
+	"""
+	avail = [str(n) for n in mat.names()]
+	names = []
+	for p in patterns:
+		if any(c in p for c in '*?['):
+			found = sorted(fnmatch.filter(avail, p))
+		elif p in mat.names():
+			found = [p]
+		elif strict:
+			raise KeyError("Variable '%s' not found in results" % p)
+		else:
+			found = []
+		for n in found:
+			if n not in names:
+				names.append(n)
+	return names
+
+def extract(res, names, step=None):
+	"""Extract variables `names` from the SimResult `res`.
+
+	Returns (time, traj, params, units), where traj maps trajectory names to
+	arrays over `time` and params maps parameter names to values. If `step`
+	is given, trajectories are linearly interpolated onto a regular grid with
+	that step (always including the final time).
+	"""
+	traj_n = []
+	params = {}
+	for n in names:
+		if n == 'time':
+			continue # always written
+		if res.mat.block(n) == 1:
+			params[n] = float(res.get_values(n)[0])
+		else:
+			traj_n.append(n)
+
+	t = np.asarray(res.mat.abscissa(2, valuesOnly=True), dtype=float)
+	if step is not None:
+		grid = np.arange(t[0], t[-1], step)
+		t = np.append(grid, t[-1])
+		val = res.interpolate(traj_n, t) if traj_n else np.empty((len(t), 0))
+		traj = dict((n, val[:,i]) for i, n in enumerate(traj_n))
+	else:
+		traj = dict((n, np.array(res.get_values(n), dtype=float)) for n in traj_n)
+
+	units = {}
+	for n in names:
+		units[n] = res.units.get(n, '') if res.units else ''
+	return t, traj, params, units
+
+def write(fn, time, traj, params={}, units={}, fmt=None):
+	"""Write an export file; the format is guessed from `fn` if not given."""
+	if fmt is None:
+		fmt = get_format(fn)
+	assert fmt in EXTENSIONS, "Unknown export format for '%s'" % fn
+
+	names = list(traj)
+	meta = json.dumps({'params': params, 'units': units, 'columns': names})
+
+	if fmt in ('parquet', 'arrow'):
+		try:
+			import pyarrow as pa
+		except ImportError:
+			pa = None
+		assert pa is not None, 'Library for parquet/arrow export (pyarrow) is not installed'
+		cols = [pa.array(time)] + [pa.array(traj[n]) for n in names]
+		table = pa.Table.from_arrays(cols, names=['time'] + names)
+		table = table.replace_schema_metadata({META_KEY: meta})
+		if fmt == 'parquet':
+			import pyarrow.parquet as pq
+			pq.write_table(table, fn, compression='zstd')
+		else:
+			import pyarrow.feather as feather
+			feather.write_feather(table, fn, compression='zstd')
+	elif fmt == 'hdf5':
+		try:
+			import h5py
+		except ImportError:
+			h5py = None
+		assert h5py is not None, 'Library for hdf5 export (h5py) is not installed'
+		with h5py.File(fn, 'w') as f:
+			f.attrs[META_KEY] = meta
+			f.create_dataset('time', data=time, compression='gzip')
+			g = f.create_group('traj')
+			for n in names:
+				g.create_dataset(n, data=traj[n], compression='gzip')
+	else:
+		arrs = dict(('traj:' + n, traj[n]) for n in names)
+		with open(fn, 'wb') as f: # numpy would add '.npz' to a file name
+			np.savez_compressed(f, time=time, meta=np.array(meta), **arrs)
+
+def read(fn, fmt=None):
+	"""Read an export file, returning (time, traj, params, units)."""
+	if fmt is None:
+		fmt = get_format(fn)
+	assert fmt in EXTENSIONS, "Unknown export format for '%s'" % fn
+
+	if fmt in ('parquet', 'arrow'):
+		if fmt == 'parquet':
+			import pyarrow.parquet as pq
+			table = pq.read_table(fn)
+		else:
+			import pyarrow.feather as feather
+			table = feather.read_table(fn)
+		md = table.schema.metadata
+		meta = json.loads(md[META_KEY.encode()].decode())
+		time = table.column('time').to_numpy()
+		traj = dict((n, table.column(n).to_numpy()) for n in meta['columns'])
+	elif fmt == 'hdf5':
+		import h5py
+		with h5py.File(fn, 'r') as f:
+			meta = json.loads(f.attrs[META_KEY])
+			time = f['time'][()]
+			traj = dict((n, f['traj'][n][()]) for n in meta['columns'])
+	else:
+		with np.load(fn) as f:
+			meta = json.loads(str(f['meta']))
+			time = f['time']
+			traj = dict((n, f['traj:' + n]) for n in meta['columns'])
+	return time, traj, meta['params'], meta['units']
+
+def export_result(res, names=None, fmt='parquet', step=None, out_fn=None,
+		remove=False, peaker=False):
+	"""Export variables of the SimResult `res` (see `extract`).
+
+	`names` is a list of variable names or wildcard patterns; by default the
+	variables used by the `calc_perf` method of `res` are exported. The
+	output file name defaults to the results file name with the extension of
+	`fmt`. With `remove`, the original results file is deleted once the
+	export has been written. Returns the output file name.
+	"""
+	if names is None:
+		names = select_vars(res.mat, perf_vars(type(res), peaker), strict=False)
+	else:
+		names = select_vars(res.mat, names)
+	if out_fn is None:
+		out_fn = export_fn(res.fn, fmt)
+	t, traj, params, units = extract(res, names, step)
+	# write to a temporary name first so that an interrupted export never
+	# leaves a truncated file behind next to a deleted mat-file
+	tmp = out_fn + '.tmp'
+	write(tmp, t, traj, params, units, fmt)
+	os.replace(tmp, out_fn)
+	if remove:
+		close = getattr(res.mat, 'close', None)
+		if close is not None:
+			close()
+		os.remove(res.fn)
+	return out_fn
+
+
+class ExportedResult(object):
+	"""Reader for export files, with the interface of the mat-file readers.
+
+	Parameters are presented as in OpenModelica results: in block 1, with two
+	values at the start and end times of the simulation.
+	"""
+	def __init__(self, fn):
+		self.fn = fn
+		self.time, self.traj, self.params, self.units = read(fn)
+		self.ptime = np.array([self.time[0], self.time[-1]])
+
+	@classmethod
+	def from_arrays(cls, time, traj, params={}, units={}, fn=None):
+		"""Reader for results held in memory, in the form of `read`."""
+		self = cls.__new__(cls)
+		self.fn = fn
+		self.time, self.traj, self.params, self.units = time, traj, params, units
+		self.ptime = np.array([self.time[0], self.time[-1]])
+		return self
+
+	def names(self, block=None):
+		if block == 1:
+			return list(self.params)
+		if block == 2:
+			return list(self.traj)
+		return list(self.params) + list(self.traj)
+
+	def data(self, varName):
+		if varName in self.traj:
+			return self.traj[varName]
+		v = self.params[varName]
+		return np.array([v, v])
+
+	__getitem__ = data
+
+	def block(self, varName):
+		return 2 if varName in self.traj else 1
+
+	def description(self, varName):
+		return ''
+
+	def size(self, blockOrName):
+		return len(self.abscissa(blockOrName, valuesOnly=True))
+
+	def abscissa(self, blockOrName, valuesOnly=False):
+		try:
+			b = int(blockOrName)
+		except ValueError:
+			b = self.block(blockOrName)
+		t = self.time if b == 2 else self.ptime
+		if valuesOnly:
+			return t
+		return t, 'time', 'Time in [s]'
+
+	def close(self):
+		pass
+
+# vim: ts=4:sw=4:noet:tw=80
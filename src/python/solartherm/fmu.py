@@ -0,0 +1,131 @@
+"""
+In-process simulation of models exported as FMUs.
+
+`Simulator.compile_fmu` exports a model as a Functional Mock-up Unit with
+OpenModelica's buildModelFMU. `FMURunner` unpacks and instantiates the FMU
+once (with fmpy), then runs any number of simulations in the calling
+process: parameters are set through the FMI API, only the requested
+variables are recorded, straight into numpy arrays, and the instance is
+reset between runs. This avoids the start-up of a simulation process, the
+rewriting of the init XML and the parsing of a results file for each run,
+which dominate the cost of short simulations in optimisations.
+
+Results are returned as `export.ExportedResult` readers, so that they can
+be used with `SimResult` and its `calc_perf` methods (see
+`SimResult.from_reader`).
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import shutil
+import numpy as np
+
+try:
+	import fmpy
+except ImportError:
+	fmpy = None
+
+from solartherm import export
+
+# variabilities of values that are constant over a simulation
+CONSTANT = ('constant', 'fixed', 'tunable')
+
+
+def convert_start(var, v):
+	"""Value `v` (a number or string) as the type of FMI variable `var`."""
+	if var.type == 'Real':
+		return float(v)
+	if var.type in ('Integer', 'Enumeration'):
+		return int(float(v))
+	if var.type == 'Boolean':
+		if isinstance(v, str):
+			return v.strip().lower() in ('true', '1', '1.0')
+		return bool(v)
+	return str(v)
+
+
+class FMURunner(object):
+	"""Simulate the FMU `fn` in this process.
+
+	outputs: names of the variables to record (default: all); names not in
+		the model are ignored, as with `export.select_vars(strict=False)`
+	solver: fmpy solver for model-exchange FMUs ('CVode' or 'Euler')
+
+	The unpacked FMU and its instance cannot be shared between processes: a
+	runner sent to another process (e.g. a multiprocessing worker) unpacks
+	and instantiates its own copy there.
+	"""
+	def __init__(self, fn, outputs=None, solver='CVode'):
+		assert fmpy is not None, 'Library for FMU simulation (fmpy) is not installed'
+		self.fn = os.path.abspath(fn)
+		self.outputs = outputs
+		self.solver = solver
+		self.open()
+
+	def open(self):
+		self.unzipdir = fmpy.extract(self.fn)
+		self.description_fn = os.path.join(self.unzipdir, 'modelDescription.xml')
+		self.description = fmpy.read_model_description(self.description_fn)
+		self.variables = dict((v.name, v) for v in self.description.modelVariables)
+		if self.description.modelExchange is not None:
+			self.fmi_type = 'ModelExchange'
+		else:
+			self.fmi_type = 'CoSimulation'
+		if self.outputs is None:
+			self.recorded = [n for n in self.variables if not n.startswith('der(')]
+		else:
+			self.recorded = [n for n in self.outputs if n in self.variables]
+		self.units = dict((n, self.variables[n].unit or '') for n in self.recorded)
+		self.instance = fmpy.instantiate_fmu(self.unzipdir, self.description,
+			fmi_type=self.fmi_type)
+		self.used = False
+
+	def __getstate__(self):
+		return {'fn': self.fn, 'outputs': self.outputs, 'solver': self.solver}
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.open()
+
+	def close(self):
+		if self.instance is not None:
+			self.instance.freeInstance()
+			self.instance = None
+		shutil.rmtree(self.unzipdir, ignore_errors=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def simulate(self, pars={}, start=0., stop=86400., step=60., tolerance=1e-4):
+		"""Simulate from `start` to `stop` (s) with parameters `pars` (name ->
+		value) and the recorded variables sampled every `step` seconds (and at
+		events). Returns an `export.ExportedResult`."""
+		start_values = {}
+		for n, v in pars.items():
+			try:
+				start_values[n] = convert_start(self.variables[n], v)
+			except KeyError:
+				raise KeyError("Parameter '%s' is not a variable of '%s'"%(n, self.fn))
+		if self.used:
+			self.instance.reset()
+		self.used = True
+		res = fmpy.simulate_fmu(self.unzipdir, validate=False, start_time=float(start),
+			stop_time=float(stop), solver=self.solver, relative_tolerance=float(tolerance),
+			output_interval=float(step), fmi_type=self.fmi_type, start_values=start_values,
+			output=self.recorded, model_description=self.description,
+			fmu_instance=self.instance)
+
+		time = np.asarray(res['time'], dtype=float)
+		traj = {}
+		params = {}
+		for n in self.recorded:
+			v = res[n]
+			if self.variables[n].variability in CONSTANT:
+				params[n] = float(v[0])
+			else:
+				traj[n] = np.asarray(v, dtype=float)
+		return export.ExportedResult.from_arrays(time, traj, params, self.units)
+
+# vim: ts=4:sw=4:noet:tw=80
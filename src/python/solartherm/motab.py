@@ -0,0 +1,143 @@
+"""
+Binary motab files.
+
+Parsing a year of text weather or price data takes most of the start-up of a
+short simulation. The C loader in st_motab.c (used by the STMotab external
+object) therefore also reads a binary format, which it maps into memory
+without parsing: pages are shared between the simulations on a node and
+only those that are used are read from disk.
+
+The layout (little-endian) is a 40-byte header
+
+	magic    8 bytes  b'STMOTAB\\0'
+	version  uint32   1
+	nrows    uint32
+	ncols    uint32
+	namelen  uint32   length of the table name, with its terminating NUL
+	metalen  uint32   length of the metadata, with its terminating NUL
+	reserved uint32   0
+	offset   uint64   offset of the values, a multiple of 8
+
+followed by the table name, the metadata rows of the text file (without
+their '#', each ending with a newline), zero padding and the values as
+float64. The values are stored row by row, as held in memory by the C
+loader (`MOTAB_VAL`), so that they can be used straight from the mapping.
+
+`motab_load` in C reads a binary file given in place of a text one, and also
+uses `X.motab.bin` in place of `X.motab` when it is at least as recent; with
+$ST_MOTAB_CACHE set, it writes that copy after parsing a text file. Copies
+are made ahead of time with `to_binary` (or the st_motab_bin script).
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import re
+import struct
+import numpy as np
+
+MAGIC = b'STMOTAB\0'
+VERSION = 1
+HEADER = struct.Struct('<8s6IQ')
+EXT = '.bin'
+
+_decl_re = re.compile(r'^\s*(double|float)\s+(\w+)\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)')
+
+
+def is_binary(fn):
+	with open(fn, 'rb') as f:
+		return f.read(len(MAGIC)) == MAGIC
+
+
+def read_text(fn):
+	"""Read the first table of a text motab file.
+
+	Returns (name, meta, data), where meta are the comment rows after the
+	table declaration (without their '#') and data is a 2D array.
+	"""
+	name, shape = None, None
+	meta = []
+	rows = []
+	with open(fn) as f:
+		for line in f:
+			if line.startswith('#'):
+				if name is not None and not rows:
+					meta.append(line[1:].rstrip('\r\n'))
+				continue
+			m = _decl_re.match(line)
+			if m is not None:
+				if name is not None:
+					break # only the first table
+				name, shape = m.group(2), (int(m.group(3)), int(m.group(4)))
+				continue
+			line = line.strip()
+			if line:
+				rows.append([float(v) for v in re.split(r'[,\s]+', line) if v])
+	assert name is not None, "No table found in '%s'"%(fn,)
+	data = np.array(rows, dtype=float)
+	assert data.shape == shape, "Table '%s' in '%s' has shape %s, expected %s"%(
+		name, fn, data.shape, shape)
+	return name, meta, data
+
+
+def read_binary(fn, mmap=True):
+	"""Read a binary motab file, as (name, meta, data). With `mmap`, data is a
+	read-only view of the file (see numpy.memmap)."""
+	with open(fn, 'rb') as f:
+		head = f.read(HEADER.size)
+		assert len(head) == HEADER.size, "Binary motab file '%s' is truncated"%(fn,)
+		magic, version, nrows, ncols, namelen, metalen, _, offset = HEADER.unpack(head)
+		assert magic == MAGIC, "'%s' is not a binary motab file"%(fn,)
+		assert version == VERSION, "Unsupported version %d of binary motab file '%s'"%(
+			version, fn)
+		name = f.read(namelen).rstrip(b'\0').decode('utf-8')
+		meta = f.read(metalen).rstrip(b'\0').decode('utf-8')
+	assert os.path.getsize(fn) >= offset + 8*nrows*ncols, \
+		"Binary motab file '%s' is truncated"%(fn,)
+	meta = meta.split('\n')[:-1] if meta else []
+	if mmap:
+		data = np.memmap(fn, dtype='<f8', mode='r', offset=offset, shape=(nrows, ncols))
+	else:
+		data = np.fromfile(fn, dtype='<f8', count=nrows*ncols, offset=offset)
+		data = data.reshape(nrows, ncols)
+	return name, meta, data
+
+
+def read(fn):
+	"""Read a motab file in either format, as (name, meta, data)."""
+	if is_binary(fn):
+		return read_binary(fn)
+	return read_text(fn)
+
+
+def write_binary(fn, name, meta, data):
+	"""Write a binary motab file, replacing `fn` only once it is complete."""
+	data = np.ascontiguousarray(data, dtype='<f8')
+	assert data.ndim == 2
+	bname = name.encode('utf-8') + b'\0'
+	bmeta = ''.join(m + '\n' for m in meta).encode('utf-8') + b'\0'
+	start = HEADER.size + len(bname) + len(bmeta)
+	offset = (start + 7)//8*8
+	tmp_fn = '%s.tmp%d'%(fn, os.getpid())
+	try:
+		with open(tmp_fn, 'wb') as f:
+			f.write(HEADER.pack(MAGIC, VERSION, data.shape[0], data.shape[1],
+				len(bname), len(bmeta), 0, offset))
+			f.write(bname)
+			f.write(bmeta)
+			f.write(b'\0'*(offset - start))
+			f.write(data.tobytes())
+		os.replace(tmp_fn, fn)
+	finally:
+		if os.path.exists(tmp_fn):
+			os.remove(tmp_fn)
+
+
+def to_binary(fn, out_fn=None):
+	"""Convert the text motab file `fn` to binary, by default as the copy that
+	the C loader picks up in its place. Returns the name of the binary file."""
+	if out_fn is None:
+		out_fn = fn + EXT
+	name, meta, data = read_text(fn)
+	write_binary(out_fn, name, meta, data)
+	return out_fn
+
+# vim: ts=4:sw=4:noet:tw=80
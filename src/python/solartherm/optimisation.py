@@ -1,10 +1,164 @@
+import os
 import time
+import multiprocessing as mp
 import numpy as np
 
-
-def st_pso(objfunc, par_b, maxiter, scale, offset):
+# objective value given by st_optimise to points that could not be simulated
+PENALTY = 9.999e+99
+
+
+class IsolatedObjective(object):
+	"""Objective function giving each process its own simulation files.
+
+	`objfunc` runs simulations with the Simulator `sim`. On the first call in
+	each process, the suffix of `sim` is set from the process id, so that
+	processes evaluating points at the same time write separate init and
+	result files. The object can be pickled, e.g. to the workers of a pool.
+	"""
+	def __init__(self, objfunc, sim):
+		self.objfunc = objfunc
+		self.sim = sim
+		self.pid = None
+
+	def __call__(self, x, **kwargs):
+		pid = os.getpid()
+		if self.pid != pid:
+			self.pid = pid
+			self.sim.suffix = 'w%d'%(pid,)
+		return self.objfunc(x, **kwargs)
+
+
+_batch_func = None
+
+def _batch_init(func):
+	global _batch_func
+	_batch_func = func
+
+def _batch_eval(task):
+	x, kwargs = task
+	return _batch_func(x, **kwargs)
+
+
+class BatchEvaluator(object):
+	"""Evaluate a whole population of points in parallel.
+
+	`nproc` worker processes each evaluate `objfunc` (see
+	`IsolatedObjective`) on one point at a time; results are returned in the
+	order of the population. `map` can be registered as the `map` of a DEAP
+	toolbox: it evaluates the objective in parallel, and runs any other
+	function serially. Keyword arguments of `__call__` are passed on to the
+	objective for every point.
+
+	>>> ev = BatchEvaluator(objfunc, sim, nproc=8)
+	>>> fitnesses = ev([x1, x2, x3])
+	>>> ev.close()
+	"""
+	def __init__(self, objfunc, sim, nproc=mp.cpu_count()):
+		self.objfunc = objfunc
+		self.func = IsolatedObjective(objfunc, sim)
+		self.nproc = nproc
+		self.pool = mp.Pool(processes=nproc, initializer=_batch_init, initargs=(self.func,))
+
+	def __call__(self, pop, **kwargs):
+		return self.pool.map(_batch_eval, [(list(x), kwargs) for x in pop], chunksize=1)
+
+	def map(self, func, pop):
+		if func is self.objfunc or getattr(func, 'func', None) is self.objfunc:
+			return self(pop)
+		return list(map(func, pop))
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class SuccessiveHalving(object):
+	"""Evaluate populations by successive halving over simulation horizons.
+
+	`objfunc(x, stop=...)` must evaluate a single objective from a
+	simulation stopped at `stop`, estimating full-horizon values (e.g. with
+	`calc_perf(extrapolate=True)`), and `objfunc(x)` from the full
+	simulation. All points of a population are first simulated up to
+	`stops[0]`; the best 1/`eta` of them continue to `stops[1]`, and so on,
+	and only the points left after the last of `stops` are simulated over
+	the full horizon. A point dropped at some rung keeps its estimate from
+	that rung, but never ranks ahead of a point that reached the full
+	horizon.
+
+	Evaluation of each rung is in parallel if a BatchEvaluator is given.
+	Like the BatchEvaluator, it can be called on a population, or used as a
+	DEAP toolbox map.
+	"""
+	def __init__(self, objfunc, stops, eta=3, evaluator=None):
+		assert eta > 1, 'eta must be greater than 1'
+		self.objfunc = objfunc
+		self.stops = list(stops)
+		self.eta = eta
+		self.evaluator = evaluator
+		self.nproc = evaluator.nproc if evaluator is not None else 1
+		self.nsim = [0]*(len(self.stops) + 1) # simulations run at each rung
+
+	def evaluate(self, pop, stop):
+		kwargs = {} if stop is None else {'stop': stop}
+		if self.evaluator is not None:
+			return self.evaluator(pop, **kwargs)
+		return [self.objfunc(list(x), **kwargs) for x in pop]
+
+	def __call__(self, pop):
+		pop = list(pop)
+		fit = [None]*len(pop)
+		idx = list(range(len(pop)))
+		for r, stop in enumerate(self.stops + [None]):
+			res = self.evaluate([pop[i] for i in idx], stop)
+			self.nsim[r] += len(idx)
+			if stop is None:
+				for i, v in zip(idx, res):
+					fit[i] = v
+				break
+			# results may be 1-tuples, as for DEAP
+			vals = np.array([np.ravel(v)[0] for v in res], dtype=float)
+			vals[~np.isfinite(vals)] = np.inf
+			order = np.argsort(vals, kind='stable')
+			nkeep = max(1, int(np.ceil(len(idx)/self.eta)))
+			for j in order[nkeep:]:
+				fit[idx[j]] = res[j]
+			idx = [idx[j] for j in order[:nkeep]]
+		# dropped points rank no better than the worst full evaluation
+		full = set(idx)
+		worst = max(np.ravel(fit[i])[0] for i in idx)
+		for i, v in enumerate(fit):
+			if i not in full and np.ravel(v)[0] < worst:
+				fit[i] = (worst,) if isinstance(v, tuple) else worst
+		return fit
+
+	def map(self, func, pop):
+		if func is self.objfunc or getattr(func, 'func', None) is self.objfunc:
+			return self(pop)
+		return list(map(func, pop))
+
+	def report(self):
+		return 'Successive halving: %s simulations at horizons %s'%(
+			self.nsim, self.stops + ['full'])
+
+	def close(self):
+		if self.evaluator is not None:
+			self.evaluator.close()
+
+
+def st_pso(objfunc, par_b, maxiter, scale, offset, evaluator=None):
 	'''
 	pso optimisation
+
+	With a BatchEvaluator, the particles of each iteration are evaluated in
+	parallel by pyswarm's own process pool.
 	'''
 	try:
 		from pyswarm import pso
@@ -15,13 +169,21 @@ def st_pso(objfunc, par_b, maxiter, scale, offset):
 	swarmsize=5
 	lb = [v[0] for v in par_b]
 	ub = [v[1] for v in par_b]
-	res = pso(objfunc, lb, ub, maxiter=maxiter, swarmsize=swarmsize)
+	if evaluator is not None:
+		res = pso(evaluator.func, lb, ub, maxiter=maxiter, swarmsize=swarmsize,
+				processes=evaluator.nproc)
+	else:
+		res = pso(objfunc, lb, ub, maxiter=maxiter, swarmsize=swarmsize)
 	cand = [scale[i]*v + offset[i] for i, v in enumerate(res[0])]
 
 	return res[1], cand
 
 
-def st_cma(objfunc, par_b, par_0, maxiter, scale, offset):
+def st_cma(objfunc, par_b, par_0, maxiter, scale, offset, evaluator=None):
+	'''
+	cma-es optimisation, in ask/tell form so that each generation can be
+	evaluated at once by a BatchEvaluator
+	'''
 	try:
 		import cma
 	except ImportError:
@@ -32,20 +194,26 @@ def st_cma(objfunc, par_b, par_0, maxiter, scale, offset):
 	popsize = 5
 	lb = [v[0] for v in par_b]
 	ub = [v[1] for v in par_b]
-	res = cma.fmin(objfunc, par_0, sigma0,
-			restarts=0,
-			options={
-					'bounds': [lb, ub],
-					#'maxfevals': args.maxiter,
-					'maxiter': maxiter,
-					'popsize': popsize,
+	es = cma.CMAEvolutionStrategy(par_0, sigma0, {
+			'bounds': [lb, ub],
+			#'maxfevals': args.maxiter,
+			'maxiter': maxiter,
+			'popsize': popsize,
 			})
+	while not es.stop():
+		X = es.ask()
+		if evaluator is not None:
+			es.tell(X, evaluator(X))
+		else:
+			es.tell(X, [objfunc(x) for x in X])
+		es.disp()
+	res = es.result
 	cand = [scale[i]*v + offset[i] for i, v in enumerate(res[0])]
 
 	return res[1], cand
 
 
-def st_ga1(objfunc, par_b, par_n, scale, offset):
+def st_ga1(objfunc, par_b, par_n, scale, offset, evaluator=None):
 
 	import pylab as pl
 	try:
@@ -64,13 +232,16 @@ def st_ga1(objfunc, par_b, par_n, scale, offset):
 	cxpb = 0.98 # Crossover probability
 	mutpb = 0.01 # Mutation probability
 	freq_stats = 10 # Frequency of stats
-	paral_eval = False # To enable parallel evaluation. Only use it when the fitness function is slow!
+	paral_eval = evaluator is not None # To enable parallel evaluation. Only use it when the fitness function is slow!
 
 	pl.ion()
 
 	genome = G1DList.G1DList(ind_size) # Genome instance
 	genome.setParams(rangemin = lb[0], rangemax = ub[0]) # Set the range min and max of the 1D List
-	genome.evaluator.set(objfunc) # The evaluator function (fitness/objective function)	
+	if paral_eval:
+		genome.evaluator.set(evaluator.func) # Gives each process of pyevolve's pool its own simulation files
+	else:
+		genome.evaluator.set(objfunc) # The evaluator function (fitness/objective function)	
 	genome.initializator.set(Initializators.G1DListInitializatorReal) # Real initialization function of G1DList
 	genome.crossover.set(Crossovers.G1DListCrossoverUniform) # The G1DList Uniform Crossover
 	genome.mutator.set(Mutators.G1DListMutatorRealRange) # Simple real range mutator for G1DList
@@ -89,8 +260,8 @@ def st_ga1(objfunc, par_b, par_n, scale, offset):
 	ga.terminationCriteria.set(GSimpleGA.ConvergenceCriteria) # Terminate the evolution when the population have converged
 	pop = ga.getPopulation() # Return the internal population of GA Engine
 	pop.scaleMethod.set(Scaling.SigmaTruncScaling) # Sigma Truncation scaling scheme, allows negative scores
-	ga.evolve(freq_stats=freq_stats) # Run the optimisation and print the stats of the ga every n generation
 	ga.setMultiProcessing(flag=paral_eval, full_copy=False) # Set the flag to enable/disable the use of python multiprocessing module
+	ga.evolve(freq_stats=freq_stats) # Run the optimisation and print the stats of the ga every n generation
 
 	res = ga.bestIndividual() # Best individual in normalised form
 	cand = [scale[i]*v + offset[i] for i, v in enumerate(res.genomeList)] # Denormalised best individual
@@ -99,8 +270,7 @@ def st_ga1(objfunc, par_b, par_n, scale, offset):
 	return res.score, cand
 
 
-def st_ga2(objfunc, par_b, par_n, scale, offset):
-	import multiprocessing
+def st_ga2(objfunc, par_b, par_n, scale, offset, evaluator=None):
 	import random
 	try:
 		import deap
@@ -119,8 +289,7 @@ def st_ga2(objfunc, par_b, par_n, scale, offset):
 	cxpb_in = 0.5 # Probability of crossover within individual
 	mutpb = 0.02 # Mutation probability
 	mutpb_in = 0.01 # Probability of mutation within individual
-	paral_eval = False # To enable parallel evaluation. Only use it when the fitness function is slow!
-	n_cores = 4 # Number of cores for parallel evaluation of the fitness function
+	paral_eval = evaluator is not None # To enable parallel evaluation. Only use it when the fitness function is slow!
 
 	creator.create("FitnessMin", base.Fitness, weights=(-1.0,))
 
@@ -165,9 +334,7 @@ def st_ga2(objfunc, par_b, par_n, scale, offset):
 
 	# Parallel evaluation by running the computation multicore
 	if paral_eval:
-		pool = multiprocessing.Pool(processes=n_cores)
-		toolbox.register("map", pool.map) # Change the map functions everywhere to toolbox.map to make the algorithm use a multicored map
-		#toolbox.register("map", futures.map) # Change the map functions everywhere to toolbox.map to make the algorithm use a multicored map
+		toolbox.register("map", evaluator.map) # Change the map functions everywhere to toolbox.map to make the algorithm use a multicored map
 
 	pop = toolbox.population(n=pop_size) # Set the size of population (individuals)
 
@@ -186,7 +353,7 @@ def st_ga2(objfunc, par_b, par_n, scale, offset):
 		offspring = toolbox.select(pop, len(pop)) # Select the best individuals in the population
 
 		# Clone the selected individuals
-		offspring = list(toolbox.map(toolbox.clone, offspring)) #Create the offspring
+		offspring = [toolbox.clone(ind) for ind in offspring] #Create the offspring
 
 		# Apply crossover on the offspring
 		for child1, child2 in zip(offspring[::2], offspring[1::2]):
@@ -215,11 +382,6 @@ def st_ga2(objfunc, par_b, par_n, scale, offset):
 		print(tools.selBest(pop, 1)[0]) # Best individual in the current generation
 		print(tools.selBest(pop, 1)[0].fitness.values[0]) # Best fitness in the current generation
 
-	# For parallel evaluation using multiprocessing
-	#if paral_eval:
-		#pool.close()
-		#pool.join()
-
 	res = tools.selBest(pop, 1)[0] # Best individual in normalised form
 	cand = [scale[i]*v + offset[i] for i, v in enumerate(res)] # Denormalised best individual
 
@@ -248,10 +410,9 @@ def st_sciopt(objfunc, op_meth, par_b, par_0, maxiter, scale, offset):
 
 	return res.fun, cand 
 
-def st_nsga2(objfunc, obj_n, par_b, par_n, scale, offset, dm_method, decisionmaker):
+def st_nsga2(objfunc, obj_n, par_b, par_n, scale, offset, dm_method, decisionmaker, evaluator=None):
 	
 	import random
-	import multiprocessing
 	#import scoop
 	#from scoop import futures
 	t_start=time.time()
@@ -273,8 +434,7 @@ def st_nsga2(objfunc, obj_n, par_b, par_n, scale, offset, dm_method, decisionmak
 	#cxpb_in = 0.5 # Probability of crossover within individual
 	#mutpb = 0.02 # Mutation probability
 	#mutpb_in = 0.01 # Probability of mutation within individual
-	paral_eval = False # To enable parallel evaluation. Only use it when the fitness function is slow!
-	n_cores = 4 # Number of cores for parallel evaluation of the fitness function
+	paral_eval = evaluator is not None # To enable parallel evaluation. Only use it when the fitness function is slow!
 
 	creator.create("FitnessMulti", base.Fitness, weights=(-1.0, -1.0))
 	creator.create("Individual", list, fitness=creator.FitnessMulti)
@@ -314,10 +474,7 @@ def st_nsga2(objfunc, obj_n, par_b, par_n, scale, offset, dm_method, decisionmak
 
 	# Parallel evaluation by running the computation multicore
 	if paral_eval:
-		# removed scoop dependency...
-		pool = multiprocessing.Pool(processes=n_cores)
-		toolbox.register("map", pool.map) # Change the map functions everywhere to toolbox.map to make the algorithm use a multicored map
-		#toolbox.register("map", futures.map) # Change the map functions everywhere to toolbox.map to make the algorithm use a multicored map
+		toolbox.register("map", evaluator.map) # Change the map functions everywhere to toolbox.map to make the algorithm use a multicored map
 
 	stats = tools.Statistics(lambda ind: ind.fitness.values) # Set the optimisation statistics
 	stats.register("avg", np.mean, axis=0)
@@ -373,11 +530,6 @@ def st_nsga2(objfunc, obj_n, par_b, par_n, scale, offset, dm_method, decisionmak
 		logbook.record(gen=gen, evals=len(invalid_ind), **record)
 		#print(logbook.stream)
 
-	# For parallel evaluation using multiprocessing
-	#if paral_eval:
-		#pool.close()
-		#pool.join()
-
 	pop.sort(key=lambda x: x.fitness.values)
 
 	solutions = pop # Normalised non-dominated optimal individuals
@@ -397,6 +549,198 @@ def st_nsga2(objfunc, obj_n, par_b, par_n, scale, offset, dm_method, decisionmak
 	
 
 
-
-
+class GaussianProcess(object):
+	"""Gaussian process regression with a squared-exponential kernel.
+
+	The length scale of each input and a noise term are fitted by maximising
+	the marginal likelihood. Outputs are standardised before fitting.
+	"""
+	def __init__(self, restarts=3):
+		self.restarts = restarts
+		self.theta = None
+
+	def kernel(self, A, B, ls):
+		d = (A[:,np.newaxis,:] - B[np.newaxis,:,:])/ls
+		return np.exp(-0.5*(d**2).sum(axis=2))
+
+	def nll(self, theta, X, y):
+		"""Negative log marginal likelihood for log length scales and noise."""
+		from scipy import linalg
+		ls, noise = np.exp(theta[:-1]), np.exp(theta[-1])
+		K = self.kernel(X, X, ls) + (noise + 1e-10)*np.eye(len(X))
+		try:
+			L = linalg.cholesky(K, lower=True)
+		except linalg.LinAlgError:
+			return 1e10
+		alpha = linalg.cho_solve((L, True), y)
+		return 0.5*np.dot(y, alpha) + np.log(np.diag(L)).sum()
+
+	def fit(self, X, y, optimise=True):
+		from scipy import linalg, optimize
+		self.X = np.asarray(X, dtype=float)
+		y = np.asarray(y, dtype=float)
+		self.ym = y.mean()
+		self.ys = y.std() if y.std() > 0 else 1.
+		self.y = (y - self.ym)/self.ys
+		d = self.X.shape[1]
+		if optimise or self.theta is None:
+			bounds = [(np.log(1e-2), np.log(1e1))]*d + [(np.log(1e-8), np.log(1e-1))]
+			starts = [np.r_[np.log(0.3)*np.ones(d), np.log(1e-4)]]
+			if self.theta is not None:
+				starts.append(self.theta)
+			rng = np.random.RandomState(len(y))
+			for j in range(self.restarts - 1):
+				starts.append(np.array([rng.uniform(lo, hi) for lo, hi in bounds]))
+			best = None
+			for t0 in starts:
+				r = optimize.minimize(self.nll, t0, args=(self.X, self.y),
+					method='L-BFGS-B', bounds=bounds)
+				if best is None or r.fun < best.fun:
+					best = r
+			self.theta = best.x
+		ls, noise = np.exp(self.theta[:-1]), np.exp(self.theta[-1])
+		K = self.kernel(self.X, self.X, ls) + (noise + 1e-10)*np.eye(len(self.X))
+		self.L = linalg.cholesky(K, lower=True)
+		self.alpha = linalg.cho_solve((self.L, True), self.y)
+		return self
+
+	def predict(self, Xs):
+		"""Mean and standard deviation of the prediction at each row of Xs."""
+		from scipy import linalg
+		Xs = np.atleast_2d(Xs)
+		ks = self.kernel(Xs, self.X, np.exp(self.theta[:-1]))
+		mu = np.dot(ks, self.alpha)
+		v = linalg.solve_triangular(self.L, ks.T, lower=True)
+		var = np.clip(1. - (v**2).sum(axis=0), 1e-12, None)
+		return mu*self.ys + self.ym, np.sqrt(var)*self.ys
+
+
+def expected_improvement(mu, sigma, fbest):
+	"""Expected improvement (for minimisation) over the best value fbest."""
+	from scipy.stats import norm
+	z = (fbest - mu)/sigma
+	return (fbest - mu)*norm.cdf(z) + sigma*norm.pdf(z)
+
+
+def latin_hypercube(n, lb, ub, rng):
+	"""`n` points of a Latin hypercube sample between bounds `lb` and `ub`."""
+	d = len(lb)
+	u = (np.array([rng.permutation(n) for j in range(d)]).T + rng.uniform(size=(n, d)))/n
+	return lb + u*(ub - lb)
+
+
+def pareto_front(F):
+	"""Indices of the non-dominated rows of F (all objectives minimised)."""
+	F = np.asarray(F)
+	keep = []
+	for i in range(len(F)):
+		dominated = np.all(F <= F[i], axis=1) & np.any(F < F[i], axis=1)
+		if not dominated.any() and not any(np.array_equal(F[i], F[k]) for k in keep):
+			keep.append(i)
+	return keep
+
+
+def _propose(gp, fbest, lb, ub, rng, nsample=2000, npolish=3):
+	"""Point maximising expected improvement: best of a random sample, then
+	polished with L-BFGS-B."""
+	from scipy import optimize
+	Xc = latin_hypercube(nsample, lb, ub, rng)
+	ei = expected_improvement(*gp.predict(Xc), fbest=fbest)
+	best_x, best_ei = Xc[np.argmax(ei)], ei.max()
+	negei = lambda x: -expected_improvement(*gp.predict(x), fbest=fbest)[0]
+	for x0 in Xc[np.argsort(ei)[::-1][:npolish]]:
+		r = optimize.minimize(negei, x0, method='L-BFGS-B', bounds=list(zip(lb, ub)))
+		if -r.fun > best_ei:
+			best_x, best_ei = r.x, -r.fun
+	return best_x
+
+
+def st_surrogate(objfunc, par_b, par_0, maxiter, scale, offset, evaluator=None,
+		num_obj=1, decisionmaker=None, batch=None, ninit=None, seed=None):
+	'''
+	surrogate-assisted optimisation (efficient global optimisation)
+
+	A Gaussian process is fitted to the evaluated points, and new points are
+	chosen by maximising the expected improvement, `batch` at a time (by
+	default the number of processes of the evaluator, so that each batch
+	takes one simulation time). Points of a batch are spread by the
+	"kriging believer" heuristic: each chosen point is added to the fit with
+	its predicted value before choosing the next. With several objectives
+	(ParEGO), each point of a batch minimises a random weighting of the
+	normalised objectives instead.
+
+	`maxiter` is the total number of evaluations (simulations), including the
+	initial Latin hypercube sample of `ninit` points and `par_0`.
+
+	Returns the best value and candidate for a single objective, or the
+	candidates and objectives of the Pareto front and a decision maker for
+	several objectives, as st_nsga2 does.
+	'''
+	rng = np.random.RandomState(seed)
+	lb = np.array([v[0] for v in par_b], dtype=float)
+	ub = np.array([v[1] for v in par_b], dtype=float)
+	d = len(lb)
+	if batch is None:
+		batch = evaluator.nproc if evaluator is not None else 1
+	if ninit is None:
+		ninit = max(2*(d + 1), batch)
+	ninit = min(ninit, maxiter)
+
+	def evaluate(X):
+		if evaluator is not None:
+			res = evaluator([list(x) for x in X])
+		else:
+			res = [objfunc(list(x)) for x in X]
+		# a constraint violation appends penalties after the objectives
+		return [np.ravel(r)[:num_obj].astype(float) for r in res]
+
+	X = latin_hypercube(ninit - 1, lb, ub, rng) if ninit > 1 else np.empty((0, d))
+	X = np.vstack([np.clip(np.asarray(par_0, dtype=float), lb, ub), X])
+	F = np.array(evaluate(X))
+	gp = GaussianProcess()
+
+	it = 0
+	while len(X) < maxiter:
+		q = min(batch, maxiter - len(X))
+		valid = np.isfinite(F) & (np.abs(F) < PENALTY)
+		ok = np.all(valid, axis=1)
+		assert ok.any(), 'No successful evaluations to fit the surrogate to'
+		Fn = F[ok]
+		# normalised objectives, for ParEGO and for failed points
+		fmin, fmax = Fn.min(axis=0), Fn.max(axis=0)
+		Fs = (np.where(valid, F, fmax) - fmin)/np.where(fmax > fmin, fmax - fmin, 1.)
+		new = []
+		for j in range(q):
+			if num_obj == 1:
+				y = Fs[:,0]
+			else:
+				w = rng.dirichlet(np.ones(num_obj))
+				y = np.max(w*Fs, axis=1) + 0.05*np.dot(Fs, w)
+			Xb, yb = X, y
+			if num_obj == 1 and new:
+				# kriging believer: the points chosen so far take their predicted values
+				Xb = np.vstack([X] + new)
+				yb = np.r_[y, gp.predict(np.array(new))[0]]
+				gp.fit(Xb, yb, optimise=False)
+			else:
+				gp.fit(Xb, yb, optimise=(j == 0 or num_obj > 1))
+			new.append(_propose(gp, yb.min(), lb, ub, rng))
+		Xnew = np.array(new)
+		X = np.vstack([X, Xnew])
+		F = np.vstack([F, evaluate(Xnew)])
+		it += 1
+		print('Surrogate iteration %d: %d evaluations, best %s'%(it, len(X),
+			np.nanmin(F, axis=0)))
+
+	ok = np.all(np.isfinite(F) & (np.abs(F) < PENALTY), axis=1)
+	X, F = X[ok], F[ok]
+	cand = np.array([[scale[i]*v + offset[i] for i, v in enumerate(x)] for x in X])
+	if num_obj == 1:
+		i = np.argmin(F[:,0])
+		return F[i,0], cand[i].tolist()
+	front = pareto_front(F)
+	cands = cand[front]
+	fitness = F[front]
+	dm = decisionmaker(cands, [tuple(f) for f in fitness])
+	return cands, fitness, dm
 
@@ -1,7 +1,8 @@
 from __future__ import division, print_function,unicode_literals
 
 import solartherm.finances as fin
-import DyMat
+from solartherm.resparser import Matv4Mmap
+from solartherm import export
 import xml.etree.ElementTree as ET
 import re
 import numpy as np
@@ -17,9 +18,31 @@ class SimResult(object):
 		self.mat = None
 		self.units = None
 		self.load_res()
+
+	@classmethod
+	def from_reader(cls, mat, fn=None):
+		"""Results held by a reader with the interface of the mat-file readers
+		rather than in a file, e.g. an `export.ExportedResult` from an FMU run
+		(see `solartherm.fmu`)."""
+		res = cls.__new__(cls)
+		res.fn = fn
+		res.init_fn = None
+		res.mat = mat
+		res.units = dict((n, mat.units.get(n, '')) for n in mat.names())
+		return res
 	
 	def load_res(self):
-		self.mat = DyMat.DyMatFile(self.fn)
+		if export.get_format(self.fn) is not None:
+			# selected variables exported from a mat-file, see st_export
+			self.mat = export.ExportedResult(self.fn)
+			self.units = dict((n, self.mat.units.get(n, '')) for n in self.mat.names())
+			return
+		try:
+			self.mat = Matv4Mmap(self.fn)
+		except NotImplementedError:
+			# e.g. older Dymola files; fall back to loading the whole file
+			import DyMat
+			self.mat = DyMat.DyMatFile(self.fn)
 		self.load_units()
 
 	def load_units(self):
@@ -45,13 +68,18 @@ class SimResult(object):
 				pass
 
 		if et is not None:
-			root = et.getroot()
+			# index the units in a single pass, rather than searching the
+			# whole document for each variable
+			units = {}
+			for sv in et.getroot().iter('ScalarVariable'):
+				for node in sv:
+					if 'unit' in node.attrib:
+						units.setdefault(sv.get('name'), node.attrib['unit'])
 
 			self.units = {}
 			for n in self.mat.names():
 				ns = str(n)
-				node = root.find('*ScalarVariable[@name=\''+ns+'\']/*[@unit]')
-				self.units[ns] = '' if node is None else node.attrib['unit']
+				self.units[ns] = units.get(ns, '')
 	
 	def get_names(self):
 		return self.mat.names()
@@ -67,110 +95,102 @@ class SimResult(object):
 
 	def lower_ind(self, ab, t):
 		"""Get index for point just below or equal to the requested time.
+
+		`t` may be a scalar or an array of times. Where OpenModelica has
+		written several points at the same (event) time, the index of the
+		last of them is returned, so that the segment starting there is the
+		one after the event. The index is limited to len(ab)-2 so that
+		il + 1 is always valid.
 		"""
 		# Note that values are provided before and after events for quantities
-		assert ab[0] <= t <= ab[-1], "Time outside range"
+		assert np.all(ab[0] <= t) and np.all(t <= ab[-1]), "Time outside range"
 
-		il = int(len(ab)*t/(ab[-1] - ab[0]))
-		il = min(len(ab)-2, max(0, il))
+		il = np.searchsorted(ab, t, side='right') - 1
+		return np.clip(il, 0, len(ab) - 2)
 
-		# FIXME make use of 'import bisect' here to increase speed
-		while t < ab[il]:
-			il -= 1
-		while t > ab[il+1]:
-			il += 1
+	def values(self, names):
+		"""Time vector and array of values (one column per name) of the
+		variables in 'names', which must share the same time vector."""
+		if isinstance(names,str):
+			names = [names]
+		ab = self.mat.abscissa(names[0], valuesOnly=True)
+		val = np.empty((ab.shape[0],len(names)))
+		for i,name in enumerate(names):
+			val[:,i] = self.mat.data(name)
+		return ab, val
 
-		return il
-	
 	def closest(self, names, t):
 		"""Closest point in interval for a list of variables placed in 'names' list as strings.
+
+		If `t` is an array of times, a 2D array with one row per time is returned.
 		"""
-		if isinstance(names,str):
-			names = [names]
+		ab, val = self.values(names)
 
-		ab = self.mat.abscissa(names[0], valuesOnly=True)
+		il = self.lower_ind(ab, t)
+		iu = il + 1
 
+		i = np.where(t <= (ab[iu] + ab[il])/2, il, iu)
+		return val[i]
+
+	def interp_values(self, ab, val, t):
+		"""Linear interpolation of the rows of `val` at times `t`, also
+		returning the lower indices."""
 		il = self.lower_ind(ab, t)
 		iu = il + 1
 
-		if t <= ((ab[iu] + ab[il])/2):
-			return np.array([self.mat.data(name)[il] for name in names])
-		else:
-			return np.array([self.mat.data(name)[iu] for name in names])
+		dt = ab[iu] - ab[il]
+		# segments of zero width only occur at the end of the range
+		frac = np.where(dt > 0, (t - ab[il])/np.where(dt > 0, dt, 1), 0)
+		frac = np.asarray(frac)[...,np.newaxis]
+		return il, (val[iu] - val[il])*frac + val[il]
 
 	def interpolate(self, names, t):
 		"""Linear interpolation of point for a list of variables placed in 'names' list as strings.
-		"""
-		if isinstance(names,str):
-			names = [names]
 
-		ab = self.mat.abscissa(names[0], valuesOnly=True)
+		If `t` is an array of times, a 2D array with one row per time is returned.
+		"""
+		ab, val = self.values(names)
+		return self.interp_values(ab, val, t)[1]
 
-		il = self.lower_ind(ab, t)
-		iu = il + 1	
+	def cumulative(self, ab, val, t):
+		"""Integral of the linear interpolation of `val` from ab[0] to `t`."""
+		# cumulative trapezoidal sums; repeated event times add nothing
+		csum = np.zeros_like(val)
+		csum[1:] = np.cumsum(0.5*(val[1:] + val[:-1])*np.diff(ab)[:,np.newaxis], axis=0)
 
-		vl = np.array([self.mat.data(name)[il] for name in names])
-		vu = np.array([self.mat.data(name)[iu] for name in names])
-
-		if ab[il] == ab[iu]:
-			return vl
-		else:
-			return (vu - vl)*(t - ab[il])/(ab[iu] - ab[il]) + vl
+		il, vt = self.interp_values(ab, val, t)
+		return csum[il] + 0.5*(val[il] + vt)*np.asarray(t - ab[il])[...,np.newaxis]
 
 	def integrate(self, names, t0, t1):
 		"""Integration of linear interpolation (trapezoidal rule) over interval for a list of variables placed in 'names' list as strings.
-		"""
-		if isinstance(names,str):
-			names = [names]
-
-		ab = self.mat.abscissa(names[0], valuesOnly=True)
-
-		val = np.empty((ab.shape[0],len(names)))
-		for i,name in enumerate(names):
-			val[:,i] = self.mat.data(name)
 
-		il = self.lower_ind(ab, t0)
-		iu = self.lower_ind(ab, t1) + 1
-
-		vsum = np.zeros(len(names))
-		for i in range(il, iu):
-			vl = val[i,:]
-			vu = val[i+1,:]
-
-			tl = ab[i]
-			tu = ab[i+1]
-
-			if tl == tu:
-				continue
-
-			if tl < t0:
-				vl = (vu - vl)*(t0 - tl)/(tu - tl) + vl
-				tl = t0
-			if tu > t1:
-				vu = (vu - vl)*(t1 - tl)/(tu - tl) + vl
-				tu = t1
-
-			vsum += 0.5*(vu + vl)*(tu - tl)
+		`t0` and `t1` may be arrays of interval bounds, in which case a 2D
+		array with one row per interval is returned.
+		"""
+		ab, val = self.values(names)
 
-		return vsum
+		return self.cumulative(ab, val, t1) - self.cumulative(ab, val, t0)
 
 	def sample(self, names, step):
 		"""Sampling of a list of variables placed in 'names' list as strings,
 		with 'step' timestep instead of the timestep in the original _res.mat file.
+		Each sample is the mean value over its interval, reported at the
+		interval mid-point.
+
+		`step` may also be an array of interval edges, in which case there is
+		one sample per pair of consecutive edges.
 		"""
-		if isinstance(names,str):
-			names = [names]
+		ab, val = self.values(names)
 
-		ab = self.mat.abscissa(names[0], valuesOnly=True)
-		n = int((ab[-1] - ab[0])/step)
+		if np.ndim(step) == 0:
+			n = int((ab[-1] - ab[0])/step)
+			edges = ab[0] + step*np.arange(n + 1)
+		else:
+			edges = np.asarray(step, dtype=float)
 
-		t = np.empty(n)
-		v = np.empty((n,len(names)))
-		for i in range(n):
-			t0 = step*i + ab[0]
-			t1 = step*(i + 1) + ab[0]
-			t[i] = (t0 + t1)/2
-			v[i,:] = self.integrate(names, t0, t1)/step
+		cum = self.cumulative(ab, val, edges)
+		t = (edges[1:] + edges[:-1])/2
+		v = (cum[1:] - cum[:-1])/np.diff(edges)[:,np.newaxis]
 
 		return t, v
 
@@ -195,12 +215,16 @@ class SimResult(object):
 		return constr, distance
 
 class SimResultElec(SimResult):
-	def calc_perf(self, peaker=False):
+	def calc_perf(self, peaker=False, extrapolate=False):
 		"""Calculate the solar power plant performance.
 		Some of the metrics will be returned as none if simulation runtime is
 		not a multiple of a year.
 
 		peaker: bool, True: to calculate performance of a peaker plant
+		extrapolate: bool, True: for a runtime that is not a multiple of a
+			year, estimate all metrics by scaling the results to a year, as
+			for ranking candidates from short simulations; srev is then the
+			estimated revenue per year
 		"""
 		var_names = self.get_names()
 		assert('E_elec' in var_names), "For a levelised cost of electricity calculation, It is expected to see E_elec variable in the results file!"
@@ -225,13 +249,18 @@ class SimResultElec(SimResult):
 		srev = rev_v[-1] # spot market revenue [$]
 		lcoe = None # Levelised cost of electricity
 		capf = None # Capacity factor
+		scaled = extrapolate and not close_to_year
+		if scaled:
+			srev = srev/years # estimated spot market revenue per year [$/year]
+			close_to_year = True
 		if close_to_year: 
 			if peaker:
 				tod_v=self.mat.data('TOD_W')
 				tod_factor=tod_v[-1]/eng_v[-1]
 				lcoe = fin.lcoe_p(cap_v[0], om_y_v[0] + om_p_v[0]*epy, disc_v[0],
 						int(life_v[0]), int(cons_v[0]), epy, tod_factor)
-				capf = fin.capacity_factor(name_v[0], tod_v[-1])
+				tod = fin.energy_per_year(dur, tod_v[-1]) if scaled else tod_v[-1]
+				capf = fin.capacity_factor(name_v[0], tod)
 
 			else:
 				lcoe = fin.lcoe_r(cap_v[0], om_y_v[0] + om_p_v[0]*epy, disc_v[0],
@@ -247,6 +276,50 @@ class SimResultElec(SimResult):
 		return [epy, lcoe, capf, srev,]
 
 
+	@classmethod
+	def calc_perf_days(cls, results, windows, weights, peaker=False):
+		"""Estimate the yearly performance from simulations of representative
+		days (see `solartherm.repdays`).
+
+		results: SimResultElec of the simulation of each day
+		windows: (start, t0, t1) of each simulation, the day being [t0, t1]
+		weights: number of days each day stands for (summing to a year)
+		"""
+		E = 0. # Electricity generated over the weighted days [J]
+		R = 0. # Revenue over the weighted days [$]
+		T = 0. # Time-of-day weighted electricity [J]
+		dur = 0. # Total weighted duration [s]
+		for res, (start, t0, t1), w in zip(results, windows, weights):
+			names = ['E_elec', 'R_spot'] + (['TOD_W'] if peaker else [])
+			v = res.interpolate(names, np.array([t0, t1]))
+			E += w*(v[1,0] - v[0,0])
+			R += w*(v[1,1] - v[0,1])
+			if peaker:
+				T += w*(v[1,2] - v[0,2])
+			dur += w*(t1 - t0)
+
+		mat = results[0].mat
+		cap = mat.data('C_cap')[0] # Capital costs [$]
+		om_y = mat.data('C_year')[0] # O&M costs per year [$/year]
+		om_p = mat.data('C_prod')[0] # O&M costs per production per year [$/J/year]
+		disc = mat.data('r_disc')[0] # Discount rate [-]
+		life = mat.data('t_life')[0] # Plant lifetime [year]
+		cons = mat.data('t_cons')[0] # Construction time [year]
+		name = mat.data('P_name')[0] # Generator nameplate [W]
+
+		years = dur/31536000
+		epy = fin.energy_per_year(dur, E) # Energy expected in a year [J]
+		srev = R/years # Spot market revenue per year [$/year]
+		if peaker:
+			lcoe = fin.lcoe_p(cap, om_y + om_p*epy, disc, int(life), int(cons),
+					epy, T/E)
+			capf = fin.capacity_factor(name, fin.energy_per_year(dur, T))
+		else:
+			lcoe = fin.lcoe_r(cap, om_y + om_p*epy, disc, int(life), int(cons), epy)
+			capf = fin.capacity_factor(name, epy)
+
+		return [epy/(1e6*3600), lcoe*1e6*3600, 100*capf, srev]
+
 	def cost_breakdown(self):
 		"""Calculate costs breakdown for the solar power plant"""
 		eng_t = self.mat.abscissa('E_elec', valuesOnly=True) # Time [s]
@@ -290,13 +363,24 @@ class SimResultElec(SimResult):
 
 	perf_n = ['epy', 'lcoe', 'capf', 'srev']
 	perf_u = ['MWh/year', '$/MWh', '%', '$']
+	# variables used by calc_perf
+	perf_vars = ['E_elec', 'C_cap', 'C_year', 'C_prod', 'r_disc', 't_life',
+			't_cons', 'P_name', 'R_spot']
+	peaker_vars = ['TOD_W']
+	# cumulative variables, see stitch_results
+	cumulative_vars = ['E_elec', 'R_spot', 'TOD_W']
 
 
 class SimResultFuel(SimResult):
-	def calc_perf(self):
+	def calc_perf(self, peaker=False, extrapolate=False):
 		"""Calculate solar fuels plant performance.
 		Some of the metrics will be returned as none if simulation runtime is
 		not a multiple of a year.
+
+		peaker: bool, unused, for the same signature as SimResultElec
+		extrapolate: bool, True: for a runtime that is not a multiple of a
+			year, estimate all metrics by scaling the results to a year; srev
+			is then the estimated revenue per year
 		"""
 		var_names = self.get_names()
 
@@ -333,6 +417,9 @@ class SimResultFuel(SimResult):
 		srev = rev_v[-1] # Spot market revenue [$/year]
 		lcof = None # Levelised cost of fuel
 		capf = None # Capacity factor
+		if extrapolate and not close_to_year:
+			srev = srev/years # estimated spot market revenue per year [$/year]
+			close_to_year = True
 		if close_to_year: 
 			lcof = fin.lcof_r(C_cap_v[0], C_year, disc_v[0], int(life_v[0]), int(cons_v[0]), fpy)
 			capf = fin.capacity_factor_f(name_v[0], fpy)
@@ -393,6 +480,91 @@ class SimResultFuel(SimResult):
 
 	perf_n = ['fpy', 'lcof', 'capf', 'srev']
 	perf_u = ['L/year', '$/L', '%', '$']
+	# variables used by calc_perf
+	perf_vars = ['V_fuel', 'C_cap', 'C_labor', 'C_catalyst', 'C_om', 'C_water',
+			'C_algae', 'C_H2', 'C_CO2', 'C_O2', 'C_elec', 'r_disc', 'r_i', 't_life',
+			't_cons', 'v_flow_fuel_des', 'R_spot']
+	cumulative_vars = ['V_fuel', 'R_spot']
+
+def stitch_results(results, bounds, cumulative=[], names=None):
+	"""Join the results of a simulation split into consecutive chunks.
+
+	results: SimResult of each chunk, chunk j covering [bounds[j], bounds[j+1]]
+		after a warm-up that starts earlier
+	cumulative: names of cumulative variables (e.g. E_elec), which are offset
+		so that each chunk continues from the end of the previous one
+	names: variables to keep (default: all variables of the first chunk)
+
+	The warm-up of each chunk (before bounds[j]) is discarded. Returns
+	(time, traj, params, units, seams), in the form of `export.extract`, with
+	`seams` mapping each non-cumulative trajectory to its largest jump at the
+	joins between chunks, relative to its range over the whole simulation:
+	an estimate of the error due to the chunks starting from a state that is
+	not quite settled.
+	"""
+	res = results[0]
+	if names is None:
+		names = [str(n) for n in res.mat.names() if n != 'time']
+	params = {}
+	traj_n = []
+	for n in names:
+		if res.mat.block(n) == 1:
+			params[n] = float(res.get_values(n)[0])
+		else:
+			traj_n.append(n)
+	cum = np.array([n in cumulative for n in traj_n])
+
+	ts = []
+	vals = []
+	jumps = []
+	for j, res in enumerate(results):
+		t = np.asarray(res.mat.abscissa(2, valuesOnly=True), dtype=float)
+		v = np.column_stack([res.get_values(n) for n in traj_n]) if traj_n else np.empty((len(t), 0))
+		if j > 0:
+			b = bounds[j]
+			v0 = res.interpolate(traj_n, b) if traj_n else np.empty(0)
+			end = vals[-1][-1]
+			jumps.append(np.where(cum, 0., np.abs(v0 - end)))
+			v = v + np.where(cum, end - v0, 0.)
+			keep = t > b
+			t, v = t[keep], v[keep]
+		ts.append(t)
+		vals.append(v)
+	t = np.concatenate(ts)
+	v = np.concatenate(vals)
+	traj = dict((n, v[:,i]) for i, n in enumerate(traj_n))
+
+	seams = {}
+	if jumps:
+		jumps = np.max(jumps, axis=0)
+		scale = np.ptp(v, axis=0)
+		for i, n in enumerate(traj_n):
+			if not cum[i]:
+				seams[n] = jumps[i]/scale[i] if scale[i] > 0 else jumps[i]
+
+	units = {}
+	for n in names:
+		units[n] = res.units.get(n, '') if res.units else ''
+	return t, traj, params, units, seams
+
+def compare_results(res, ref, names=None):
+	"""Largest difference between the trajectories of two results over the
+	time points of `ref`, relative to the range of each variable in `ref`
+	(or absolute for constant trajectories), by variable name. By default
+	all trajectories of `res` that are also in `ref` are compared."""
+	if names is None:
+		avail = set(ref.mat.names(2))
+		names = [n for n in res.mat.names(2) if n != 'time' and n in avail]
+	t = np.asarray(ref.mat.abscissa(2, valuesOnly=True), dtype=float)
+	tr = res.mat.abscissa(2, valuesOnly=True)
+	t = np.clip(t, tr[0], tr[-1])
+	err = {}
+	for n in names:
+		r = np.asarray(ref.get_values(n), dtype=float)
+		d = np.max(np.abs(res.interpolate(n, t)[:,0] - r))
+		scale = np.ptp(r)
+		err[n] = d/scale if scale > 0 else d
+	return err
 
 class DecisionMaker(object):
 	"""
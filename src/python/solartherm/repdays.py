@@ -0,0 +1,180 @@
+"""
+Representative days, for quick estimates of annual performance.
+
+The days of a year of weather (DNI and dry-bulb temperature) and, optionally,
+price or time-of-day tables are clustered into `k` groups of similar days
+with k-medoids, so that each group is represented by one of its own days,
+weighted by the number of days in the group. Each representative day is then
+simulated on its own, starting `warmup` seconds earlier so that storage and
+other slow states are settled, and the increments of the cumulative outputs
+(`E_elec`, `R_spot`, ...) over the day are weighted and summed to annual
+totals by `SimResultElec.calc_perf_days`.
+
+The days are simulated at their own dates rather than one after another in
+a synthetic year, as the models compute the position of the sun from the
+simulation time. `RepresentativeDays.write_table` writes the rows of a table
+that cover the simulated windows, as a compact version of the input files.
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import json
+import numpy as np
+
+from solartherm import motab
+
+DAY = 86400.
+
+# columns of a weather table, as read by WeatherSource
+WEA_DNI = 2
+WEA_DRY = 3
+
+
+def read_motab(fn):
+	"""Read the first table of a motab file (text or binary, see
+	`solartherm.motab`).
+
+	Returns (name, labels, data), where labels are the column labels given by
+	a #TABLELABELS line (or None) and data is a 2D array.
+	"""
+	name, meta, data = motab.read(fn)
+	labels = None
+	for m in meta:
+		if m.startswith('TABLELABELS'):
+			labels = m.strip().split(',')[1:]
+	return name, labels, np.array(data)
+
+
+def write_motab(fn, name, data, labels=None, units=None):
+	data = np.asarray(data, dtype=float)
+	with open(fn, 'w') as f:
+		f.write('#1\n')
+		f.write('double %s(%d,%d)\n'%(name, data.shape[0], data.shape[1]))
+		if labels is not None:
+			f.write('#TABLELABELS,%s\n'%(','.join(labels),))
+		if units is not None:
+			f.write('#TABLEUNITS,%s\n'%(','.join(units),))
+		for row in data:
+			f.write(','.join('%.10g'%(v,) for v in row) + '\n')
+
+
+def daily_profiles(t, v, ndays=365, nstep=24):
+	"""Values of the series (t, v) at `nstep` evenly spaced times of each of
+	`ndays` days, as an (ndays, nstep) array."""
+	ts = (np.arange(ndays)[:,np.newaxis] + (np.arange(nstep) + 0.5)/nstep)*DAY
+	return np.interp(ts.ravel(), t, v).reshape(ndays, nstep)
+
+
+def kmedoids(X, k, seed=None, maxiter=100):
+	"""Cluster the rows of X around `k` medoids (rows of X).
+
+	Starts from a k-means++ choice of medoids, then alternates between
+	assigning rows to the nearest medoid and moving each medoid to the row
+	of its cluster with the least total distance. Returns (medoids, labels).
+	"""
+	rng = np.random.RandomState(seed)
+	n = len(X)
+	assert 1 <= k <= n, 'Need 1 <= k <= %d'%(n,)
+	D = np.sqrt(((X[:,np.newaxis,:] - X[np.newaxis,:,:])**2).sum(axis=2))
+	med = [rng.randint(n)]
+	for j in range(1, k):
+		d2 = D[:,med].min(axis=1)**2
+		med.append(rng.choice(n, p=d2/d2.sum()) if d2.sum() > 0 else rng.randint(n))
+	med = np.array(med)
+	for it in range(maxiter):
+		labels = np.argmin(D[:,med], axis=1)
+		new = med.copy()
+		for j in range(k):
+			members = np.where(labels == j)[0]
+			if len(members):
+				new[j] = members[np.argmin(D[np.ix_(members, members)].sum(axis=1))]
+		if np.array_equal(new, med):
+			break
+		med = new
+	return med, np.argmin(D[:,med], axis=1)
+
+
+class RepresentativeDays(object):
+	"""Representative days (day of the year, counting from 0) and weights
+	(number of days each one stands for)."""
+	def __init__(self, days, weights, labels=None):
+		order = np.argsort(days)
+		self.days = [int(days[j]) for j in order]
+		self.weights = [float(weights[j]) for j in order]
+		self.labels = None if labels is None else [int(v) for v in labels]
+
+	@classmethod
+	def cluster(cls, series, k, ndays=365, seed=0):
+		"""Cluster days by the daily profiles of `series`, a list of (t, v)
+		time series (e.g. DNI, temperature, price). Each series is scaled by
+		its standard deviation so that they all count alike. There may be
+		fewer than `k` days if the series repeat."""
+		feats = []
+		for t, v in series:
+			p = daily_profiles(np.asarray(t, dtype=float), np.asarray(v, dtype=float), ndays)
+			s = p.std()
+			feats.append(p/(s if s > 0 else 1.))
+		med, labels = kmedoids(np.hstack(feats), k, seed)
+		# medoids with no days (with fewer than k distinct days) are dropped
+		used = np.unique(labels)
+		med, labels = med[used], np.searchsorted(used, labels)
+		weights = np.bincount(labels)
+		# labels refer to positions in the list of days, which is sorted
+		order = np.argsort(med)
+		rank = np.empty(len(med), dtype=int)
+		rank[order] = np.arange(len(med))
+		return cls(med, weights, rank[labels])
+
+	@classmethod
+	def from_motab(cls, wea_fn, k, tables=[], ndays=365, seed=0):
+		"""Cluster on DNI and dry-bulb temperature of the weather file
+		`wea_fn` and the second column of each of `tables` (e.g. prices)."""
+		name, labels, w = read_motab(wea_fn)
+		series = [(w[:,0], w[:,WEA_DNI]), (w[:,0], w[:,WEA_DRY])]
+		for fn in tables:
+			name, labels, d = read_motab(fn)
+			series.append((d[:,0], d[:,1]))
+		return cls.cluster(series, k, ndays, seed)
+
+	def windows(self, warmup=DAY):
+		"""(start, t0, t1) of the simulation of each day: the day is [t0, t1]
+		and the simulation starts at `start`, `warmup` seconds earlier (but
+		not before time 0)."""
+		return [(max(0., d*DAY - warmup), d*DAY, (d + 1)*DAY) for d in self.days]
+
+	def write_table(self, fn_in, fn_out, warmup=DAY):
+		"""Write the rows of the motab `fn_in` that cover the windows."""
+		name, labels, data = read_motab(fn_in)
+		keep = np.zeros(len(data), dtype=bool)
+		t = data[:,0]
+		for start, t0, t1 in self.windows(warmup):
+			# one row either side, for interpolation at the ends
+			i0 = max(np.searchsorted(t, start, side='right') - 1, 0)
+			i1 = min(np.searchsorted(t, t1, side='left') + 1, len(t))
+			keep[i0:i1] = True
+		write_motab(fn_out, name, data[keep], labels)
+
+	def save(self, fn):
+		with open(fn, 'w') as f:
+			json.dump({'days': self.days, 'weights': self.weights,
+				'labels': self.labels}, f, indent=1)
+
+	@classmethod
+	def load(cls, fn):
+		with open(fn) as f:
+			d = json.load(f)
+		return cls(d['days'], d['weights'], d.get('labels'))
+
+
+def day_worker(fn, step, tolerance, solver, nls, lv, par_n, par_v, i, window):
+	"""Simulate representative day `i` over `window` (see
+	`RepresentativeDays.windows`) and return the name of its results file.
+	Used with the executors of `solartherm.executor`."""
+	from solartherm import simulation
+	sim = simulation.Simulator(fn, suffix='day%d'%(i,))
+	sim.load_init()
+	sim.update_pars(par_n, par_v)
+	sim.simulate(start=str(window[0]), stop=str(window[2]), step=step, tolerance=tolerance,
+		solver=solver, nls=nls, lv=lv)
+	return os.path.abspath(sim.res_fn)
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -1,4 +1,7 @@
 from __future__ import division, print_function,unicode_literals
+import os
+import struct
+import numpy as np
 import scipy.io
 
 class Matv4(object):
@@ -28,6 +31,151 @@ class Matv4(object):
 
 		return labels, data
 
+class Matv4Mmap(object):
+	"""
+	Lazy reader for OM mat-file (level 4) results, with the same interface as
+	DyMat.DyMatFile (`names`, `data`, `abscissa`, `description`, ...).
+
+	Only the small header matrices ('Aclass', 'name', 'description' and
+	'dataInfo') are read when the file is opened. The data matrices are
+	memory-mapped, and `data` returns views into them without copying, so
+	only the pages of the trajectories that are actually used get read.
+	Long, finely sampled results can therefore be processed without
+	loading the whole file into memory.
+
+	See Matv4Manual for notes on the file format. Both the transposed
+	('binTrans', written by OM) and normal ('binNormal') layouts are handled.
+	"""
+
+	dtypes = ['f8', 'f4', 'i4', 'i2', 'u2', 'u1']
+
+	def __init__(self, fn):
+		self.fn = fn
+		self.mats = {}
+		self._vars = {}
+		self._blocks = []
+		self._absc = ('time', '')
+		self._arrays = {}
+		self.read_headers()
+		self.parse_vars()
+
+	def read_headers(self):
+		"""Record the type, shape and data offset of every matrix in the file."""
+		size = os.path.getsize(self.fn)
+		with open(self.fn, 'rb') as f:
+			pos = 0
+			while pos + 20 <= size:
+				f.seek(pos)
+				tp, nr, nc, im, ln = struct.unpack('<5i', f.read(20))
+				m = tp//1000
+				p = (tp%100)//10
+				t = tp%10
+				if m != 0 or tp < 0 or p > 5 or t > 1:
+					raise NotImplementedError("Unsupported matrix type %d in '%s'"%(tp, self.fn))
+				name = f.read(ln).rstrip(b'\0').decode()
+				offset = pos + 20 + ln
+				nbytes = nr*nc*np.dtype(self.dtypes[p]).itemsize*(1 + im)
+				self.mats[name] = (p, t, nr, nc, offset)
+				pos = offset + nbytes
+
+	def read_matrix(self, name):
+		"""Read a whole (small) matrix into memory, in file (column-major) order."""
+		p, t, nr, nc, offset = self.mats[name]
+		with open(self.fn, 'rb') as f:
+			f.seek(offset)
+			a = np.fromfile(f, dtype='<' + self.dtypes[p], count=nr*nc)
+		return a.reshape(nc, nr)
+
+	def read_strings(self, name, trans):
+		a = self.read_matrix(name).astype(np.uint8)
+		if not trans:
+			a = a.T
+		return [r.tobytes().rstrip(b'\0').decode('latin-1').rstrip() for r in a]
+
+	def parse_vars(self):
+		if 'Aclass' not in self.mats:
+			raise NotImplementedError("File structure of '%s' not supported"%(self.fn,))
+		aclass = self.read_strings('Aclass', trans=False)
+		if aclass[1] != '1.1' or aclass[3] not in ('binTrans', 'binNormal'):
+			raise NotImplementedError("File structure of '%s' not supported"%(self.fn,))
+		self.trans = aclass[3] == 'binTrans'
+		names = self.read_strings('name', self.trans)
+		descr = self.read_strings('description', self.trans)
+		info = self.read_matrix('dataInfo')
+		if not self.trans:
+			info = info.T
+		for i, n in enumerate(names):
+			d = int(info[i][0])
+			x = int(info[i][1])
+			c = abs(x) - 1
+			s = 1 if x >= 0 else -1
+			if c:
+				self._vars[n] = (descr[i], d, c, s)
+				if d not in self._blocks:
+					self._blocks.append(d)
+			else:
+				self._absc = (n, descr[i])
+
+	def array(self, block):
+		"""Memory-mapped data matrix for `block`, indexed as [variable, time]."""
+		a = self._arrays.get(block)
+		if a is None:
+			p, t, nr, nc, offset = self.mats['data_%d' % (block,)]
+			if nr*nc == 0:
+				a = np.empty((nc, nr))
+			else:
+				a = np.memmap(self.fn, dtype='<' + self.dtypes[p], mode='r',
+					offset=offset, shape=(nc, nr))
+			# binTrans data is stored one time point after another; the
+			# transpose is a view, not a copy
+			a = a.T if self.trans else a
+			self._arrays[block] = a
+		return a
+
+	def close(self):
+		"""Drop the memory maps (views returned by `data` stay valid)."""
+		self._arrays = {}
+
+	def blocks(self):
+		return self._blocks
+
+	def names(self, block=None):
+		if block is None:
+			return self._vars.keys()
+		return [k for (k, v) in self._vars.items() if v[1] == block]
+
+	def data(self, varName):
+		"""Values of a variable, as a (read-only) view where possible."""
+		tmp, d, c, s = self._vars[varName]
+		dd = self.array(d)[c]
+		if s < 0:
+			dd = -dd
+		return dd
+
+	__getitem__ = data
+
+	def block(self, varName):
+		return self._vars[varName][1]
+
+	def description(self, varName):
+		return self._vars[varName][0]
+
+	def size(self, blockOrName):
+		try:
+			b = int(blockOrName)
+		except ValueError:
+			b = self._vars[blockOrName][1]
+		return self.array(b).shape[1]
+
+	def abscissa(self, blockOrName, valuesOnly=False):
+		try:
+			b = int(blockOrName)
+		except ValueError:
+			b = self._vars[blockOrName][1]
+		if valuesOnly:
+			return self.array(b)[0]
+		return self.array(b)[0], self._absc[0], self._absc[1]
+
 class Matv4Manual(object):
 	"""
 	Class for loading OM mat-file results.
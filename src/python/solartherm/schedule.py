@@ -0,0 +1,208 @@
+"""
+Ordering of the design points of a sweep.
+
+Executors (see `solartherm.executor`) take the next point to run from a
+task list with `pop` and report it finished with `done`. `TaskList` hands
+points out in the order given. `Scheduler` hands out the point with the
+longest expected run time first, so that expensive points do not end up at
+the tail of a sweep with most workers idle. Run times are estimated from the
+points already finished (and, optionally, from earlier runs of the sweep) by
+`CostModel`, and the estimates are refreshed as the sweep progresses.
+`Scheduler` also prints progress and worker utilisation at regular
+intervals.
+"""
+from __future__ import division, print_function, unicode_literals
+import time
+import numpy as np
+
+
+def as_tasks(tasks):
+	"""Wrap a plain sequence of (i, val) as a `TaskList`."""
+	if hasattr(tasks, 'pop') and hasattr(tasks, 'done'):
+		return tasks
+	return TaskList(tasks)
+
+
+class TaskList(object):
+	"""Points handed out in the order given."""
+	def __init__(self, tasks):
+		self.tasks = list(tasks)
+
+	def __len__(self):
+		return len(self.tasks)
+
+	def start(self, nworkers):
+		pass
+
+	def pop(self, queued=False):
+		return self.tasks.pop(0)
+
+	def claimed(self, i, nworkers=None):
+		pass
+
+	def done(self, i, walltime=None):
+		pass
+
+
+def features(val):
+	"""Parameter vector of a point as floats (non-numeric values as 0)."""
+	x = []
+	for v in val:
+		try:
+			x.append(float(v))
+		except (TypeError, ValueError):
+			x.append(0.)
+	return x
+
+
+class CostModel(object):
+	"""Estimate of the run time of a point from its parameter values.
+
+	`method` is 'knn' (inverse-distance weighted mean of the log run time of
+	the `k` nearest finished points) or 'linear' (least-squares fit of the
+	log run time to the parameters, used once there are enough points, with
+	'knn' before that). Parameters are scaled by `scale`, normally the range
+	of each parameter over the sweep.
+	"""
+	def __init__(self, scale, method='knn', k=5):
+		self.scale = np.where(np.asarray(scale, dtype=float) > 0, scale, 1.)
+		self.method = method
+		self.k = k
+		self.x = []
+		self.y = []
+
+	def __len__(self):
+		return len(self.y)
+
+	def add(self, x, walltime):
+		self.x.append(np.asarray(x, dtype=float)/self.scale)
+		self.y.append(np.log(max(walltime, 1e-3)))
+
+	def predict(self, X):
+		"""Expected run time (s) of each row of `X`, or None with no data."""
+		if not self.y:
+			return None
+		X = np.asarray(X, dtype=float)/self.scale
+		xo = np.array(self.x)
+		yo = np.array(self.y)
+		if self.method == 'linear' and len(yo) >= 2*(xo.shape[1] + 1):
+			A = np.hstack([xo, np.ones((len(yo), 1))])
+			coef = np.linalg.lstsq(A, yo, rcond=None)[0]
+			return np.exp(np.dot(X, coef[:-1]) + coef[-1])
+		k = min(self.k, len(yo))
+		out = np.empty(len(X))
+		for j in range(0, len(X), 1000): # in chunks, to bound memory
+			d = np.sqrt(((X[j:j+1000,np.newaxis,:] - xo[np.newaxis,:,:])**2).sum(axis=2))
+			nn = np.argsort(d, axis=1)[:,:k]
+			dn = np.take_along_axis(d, nn, axis=1)
+			w = 1./(dn + 1e-9)
+			out[j:j+1000] = np.exp((w*yo[nn]).sum(axis=1)/w.sum(axis=1))
+		return out
+
+
+class Scheduler(object):
+	"""Hand out the pending point with the longest expected run time first.
+
+	tasks: list of (i, val), val being the parameter values of point i
+	history: optional list of (val, walltime) from earlier runs
+	method: see `CostModel`
+	interval: seconds between progress reports (None for no reports)
+
+	Run times are measured from `pop` to `done`, so executors should keep
+	no more points in flight than they have workers. Executors that queue
+	points ahead of their workers pop them with `queued`, report each one
+	as it starts with `claimed`, and give `done` the run time measured by
+	the worker.
+	"""
+	def __init__(self, tasks, history=[], method='knn', interval=60.):
+		self.tasks = list(tasks)
+		self.total = len(self.tasks)
+		X = [features(v) for i, v in self.tasks] + [features(v) for v, t in history]
+		npar = len(X[0]) if X else 0
+		X = np.array(X, dtype=float).reshape(len(X), npar)
+		scale = np.ptp(X, axis=0) if len(X) else np.ones(npar)
+		self.model = CostModel(scale, method=method)
+		for v, t in history:
+			if t is not None:
+				self.model.add(features(v), t)
+		self.X = X[:len(self.tasks)]
+		self.vals = dict(self.tasks)
+		self.cost = None
+		self.fitted = -1
+		self.started = {}
+		self.queued = set()
+		self.busy = 0.
+		self.ndone = 0
+		self.nworkers = 1
+		self.t0 = time.time()
+		self.interval = interval
+		self.last_report = self.t0
+
+	def __len__(self):
+		return len(self.tasks)
+
+	def start(self, nworkers):
+		self.nworkers = max(1, nworkers)
+		self.t0 = self.last_report = time.time()
+
+	def refit(self):
+		"""Re-estimate pending costs if enough new run times have come in."""
+		n = len(self.model)
+		if n == self.fitted or n < 1.1*self.fitted:
+			return
+		self.fitted = n
+		self.cost = self.model.predict(self.X)
+
+	def pop(self, queued=False):
+		self.refit()
+		if self.cost is None:
+			j = 0
+		else:
+			j = int(np.argmax(self.cost))
+			self.cost = np.delete(self.cost, j)
+		self.X = np.delete(self.X, j, axis=0)
+		i, val = self.tasks.pop(j)
+		if queued:
+			self.queued.add(i)
+		else:
+			self.started[i] = time.time()
+		return i, val
+
+	def claimed(self, i, nworkers=None):
+		"""Point `i`, popped with `queued`, has started; `nworkers` updates
+		the number of workers, for those that can join during the sweep."""
+		if i in self.queued:
+			self.queued.discard(i)
+			self.started[i] = time.time()
+		if nworkers is not None:
+			self.nworkers = max(1, nworkers)
+
+	def done(self, i, walltime=None):
+		t = time.time()
+		self.queued.discard(i)
+		start = self.started.pop(i, t)
+		dt = t - start if walltime is None else walltime
+		self.busy += dt
+		self.ndone += 1
+		self.model.add(features(self.vals[i]), dt)
+		if self.interval is not None and (t - self.last_report >= self.interval
+				or self.ndone == self.total):
+			self.last_report = t
+			print(self.report())
+
+	def utilisation(self):
+		"""Fraction of worker time spent running points since `start`."""
+		t = time.time()
+		busy = self.busy + sum(t - s for s in self.started.values())
+		return busy/max(self.nworkers*(t - self.t0), 1e-9)
+
+	def report(self):
+		t = time.time() - self.t0
+		msg = 'Progress: %d/%d points done, %d running, %.0fs elapsed, utilisation %.0f%%'%(
+			self.ndone, self.total, len(self.started), t, 100*self.utilisation())
+		if self.cost is not None and len(self.cost):
+			# rough, as if the remaining work were perfectly balanced
+			msg += ', ~%.0fs of work left'%(self.cost.sum()/self.nworkers)
+		return msg
+
+# vim: ts=4:sw=4:noet:tw=80
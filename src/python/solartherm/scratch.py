@@ -0,0 +1,114 @@
+"""
+Scratch directories for running simulations on a fast local file system.
+
+A simulation executable writes its results file, logs and other temporary
+files to its working directory. Running each simulation in a private
+scratch directory on tmpfs (or a fast local disk) keeps the working
+directory of a sweep clean and takes the write load of the simulations off
+shared or slow file systems, without the overhead of a FUSE mount (see
+`Simulator(fusemount=...)`).
+
+`Scratch.create` makes a directory with links to the files a simulation
+reads (executable, init XML, data tables): hard links where the scratch is
+on the same file system, symbolic links otherwise. The caller moves back the
+files it wants to keep and removes the directory with `Scratch.remove`.
+Directories are named after the host and the process that created them:
+those left behind by a process that was killed are removed by the next
+`Scratch` created on the same node, and those of a process that exits
+without removing them are removed at exit.
+"""
+from __future__ import division, print_function, unicode_literals
+import os
+import errno
+import atexit
+import shutil
+import socket
+import tempfile
+
+# tmpfs on most Linux systems
+SHM = '/dev/shm'
+
+
+def default_root():
+	"""$ST_SCRATCH if set, else /dev/shm if writable, else the temporary
+	directory of the system."""
+	root = os.environ.get('ST_SCRATCH')
+	if root:
+		return root
+	if os.path.isdir(SHM) and os.access(SHM, os.W_OK):
+		return SHM
+	return tempfile.gettempdir()
+
+
+def pid_alive(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		return e.errno == errno.EPERM
+	return True
+
+
+def link(src, dst):
+	"""Hard link `src` to `dst`, or symbolic link across file systems, or
+	copy where links are not supported."""
+	try:
+		os.link(src, dst)
+		return
+	except OSError:
+		pass
+	try:
+		os.symlink(os.path.abspath(src), dst)
+	except (OSError, NotImplementedError):
+		shutil.copy2(src, dst)
+
+
+_created = set() # directories of this process, removed at exit
+
+def _cleanup():
+	for d in list(_created):
+		shutil.rmtree(d, ignore_errors=True)
+	_created.clear()
+
+atexit.register(_cleanup)
+
+
+class Scratch(object):
+	"""Per-run scratch directories under `root` (see `default_root`)."""
+	def __init__(self, root=None):
+		if root is None:
+			root = default_root()
+		self.root = os.path.abspath(root)
+		try:
+			user = os.getlogin()
+		except OSError:
+			user = str(os.getuid()) if hasattr(os, 'getuid') else 'user'
+		self.base = os.path.join(self.root, 'solartherm-scratch-' + user)
+		if not os.path.isdir(self.base):
+			os.makedirs(self.base, exist_ok=True)
+		self.host = socket.gethostname()
+		self.sweep()
+
+	def sweep(self):
+		"""Remove the directories of dead processes on this host."""
+		for n in os.listdir(self.base):
+			try:
+				host, pid, rest = n.rsplit('-', 2)
+				pid = int(pid)
+			except ValueError:
+				continue
+			if host == self.host and not pid_alive(pid):
+				shutil.rmtree(os.path.join(self.base, n), ignore_errors=True)
+
+	def create(self, files=[]):
+		"""New directory with links to `files` (under their base names)."""
+		d = tempfile.mkdtemp(prefix='%s-%d-'%(self.host, os.getpid()), dir=self.base)
+		_created.add(d)
+		for f in files:
+			link(f, os.path.join(d, os.path.basename(f)))
+		return d
+
+	def remove(self, d):
+		shutil.rmtree(d, ignore_errors=True)
+		_created.discard(d)
+
+# vim: ts=4:sw=4:noet:tw=80
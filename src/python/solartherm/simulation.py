@@ -1,5 +1,7 @@
 from __future__ import division, print_function, unicode_literals
 import os
+import sys
+import copy
 import shutil
 import warnings
 from pipes import quote as sh_quote
@@ -9,6 +11,17 @@ import multiprocessing as mp
 import re
 import tempfile
 import sysconfig
+import time
+import threading
+import traceback
+import collections
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+from solartherm.cache import ModelCache
+from solartherm.scratch import Scratch
+from solartherm import export
 
 if os.environ.get('ST_DEBUG'):
 	import colorama
@@ -149,13 +162,109 @@ def parse_var_val(vstr, unit):
 		raise ValueError('Can\'t convert from unit ' + unit_old + ' to ' + unit)
 
 
+# kinds of simulation failure, see SimulationError
+FAILURES = ('timeout', 'stalled', 'assertion', 'solver', 'no-output', 'error')
+
+# messages of the OpenModelica runtime that tell the kind of a failure
+failure_res = [
+	('assertion', re.compile(r'^\s*assert\s*\||LOG_ASSERT', re.M)),
+	('solver', re.compile(r'integrator failed|solver failed|(non)?linear system'
+		r'|failed to (solve|converge)|(dassl|ida|kinsol|cvode)\b.*fail', re.I)),
+	]
+
+
+class SimulationError(RuntimeError):
+	"""Failed simulation. `kind` is one of FAILURES and `output` holds the
+	last lines written by the simulation."""
+	def __init__(self, kind, message, output=''):
+		RuntimeError.__init__(self, '%s: %s'%(kind, message))
+		self.kind = kind
+		self.output = output
+
+
+def classify_failure(output):
+	"""Kind of failure ('assertion', 'solver' or 'error') of a simulation
+	that ended with an error, from its output."""
+	for kind, r in failure_res:
+		if r.search(output):
+			return kind
+	return 'error'
+
+
+def run_watched(call, timeout=None, stall=None, progress_fn=None, poll=1., cwd=None):
+	"""Run `call`, passing its output on, and kill it after `timeout`
+	seconds, or after `stall` seconds without progress: growth of the file
+	`progress_fn`, or output of the process. For a simulation this is the
+	results file, to which a row is written every output step of simulated
+	time, so a stalled solver stops it growing.
+
+	The stall clock only starts once `progress_fn` has grown for the first
+	time, so that a long initialisation is left to `timeout`. The file is
+	written through a buffer, in blocks of several kB, so with few recorded
+	variables it grows only every many output steps: `stall` has to cover
+	several such blocks of a slow but healthy run.
+
+	Raises a SimulationError if the process is killed or fails.
+	"""
+	if os.environ.get('ST_DEBUG'):
+		print(bright(" ".join(call)))
+	proc = sp.Popen(call, stdout=sp.PIPE, stderr=sp.STDOUT, cwd=cwd)
+	tail = collections.deque(maxlen=200)
+	output = {'last': None} # time of the last line of output
+	def pump():
+		for line in iter(proc.stdout.readline, b''):
+			output['last'] = time.time()
+			line = line.decode('utf-8', 'replace')
+			tail.append(line)
+			sys.stdout.write(line)
+	th = threading.Thread(target=pump)
+	th.daemon = True
+	th.start()
+
+	t0 = time.time()
+	# time of the last progress, None until the progress file has grown
+	last = t0 if progress_fn is None else None
+	size = None
+	kind = None
+	while kind is None:
+		try:
+			proc.wait(timeout=poll)
+			break
+		except sp.TimeoutExpired:
+			pass
+		t = time.time()
+		if progress_fn is not None:
+			try:
+				sz = os.path.getsize(progress_fn)
+			except OSError:
+				sz = None
+			if sz and sz != size:
+				size, last = sz, t
+		if last is not None and output['last'] is not None:
+			last = max(last, output['last'])
+		if timeout is not None and t - t0 > timeout:
+			kind, msg = 'timeout', 'killed after %.0fs'%(t - t0,)
+		elif stall is not None and last is not None and t - last > stall:
+			kind, msg = 'stalled', 'killed after %.0fs without progress'%(t - last,)
+	if kind is not None:
+		proc.kill()
+		proc.wait()
+	th.join()
+	output = ''.join(tail)
+	if kind is not None:
+		raise SimulationError(kind, msg, output)
+	if proc.returncode != 0:
+		raise SimulationError(classify_failure(output),
+			'exited with code %d'%(proc.returncode,), output)
+
+
 UNIONFS = "/usr/bin/unionfs-fuse"
 FUSERMOUNT = "/bin/fusermount"
 
 
 class Simulator(object):
 	"""Compilation and simulation of a modelica model."""
-	def __init__(self, fn, model=None, suffix=None, fusemount=False, reuse=False):
+	def __init__(self, fn, model=None, suffix=None, fusemount=False, reuse=False, cache=None, override=False, timeout=None, stall=None, scratch=None):
 		"""Constructor. `fn` is a .mo filename, `suffix` is a init file suffix,
 		`tempdir` is FIXME the location where temporary files should be stored,
 		`True` if a machine-generated temporary location should be generated and
@@ -176,6 +285,30 @@ class Simulator(object):
 		During cleanup, Simulator will keep the init_out_fn and res_fn (if they
 		exist) which are assumed to be the only two important output files from
 		the calculation.
+
+		`cache` enables re-use of previously compiled models: it can be a
+		`solartherm.cache.ModelCache`, a cache directory, `True` to use the
+		default directory, or `False` to disable caching. If `None`, caching is
+		enabled only when the ST_MODEL_CACHE environment variable is set.
+
+		`override` makes `update_pars` pass parameter values to the simulation
+		via an `-overrideFile` instead of writing a new init XML file.
+
+		After `load_fmu`, the model is simulated in this process from its FMU
+		export instead (see `solartherm.fmu`), and `result` gives the results.
+
+		`timeout` and `stall` are the default limits in seconds of wall time on
+		each `simulate` (see `run_watched`), None for no limit.
+
+		`scratch` runs each simulation in its own scratch directory, on tmpfs
+		by default (see `solartherm.scratch`), from which only the results
+		file is kept. It can be a `solartherm.scratch.Scratch`, the directory
+		to create scratch directories in, `True` for the default, or `False`.
+		If `None`, scratch directories are used only when the ST_SCRATCH
+		environment variable is set. The scratch directory holds links to
+		the compiled model and the init files, and to `scratch_files`, a list
+		to which data files that the model reads by relative file name have
+		to be added.
 		"""
 		self.fn = os.path.abspath(fn)
 		if not os.path.exists(fn):
@@ -199,6 +332,34 @@ class Simulator(object):
 		self.enter_fuse(reuse)
 		self.suffix = suffix
 		self.init_et = None
+		self.start_index = None
+		self.unit_index = None
+		self.override = override
+		self.override_pars = None
+		self.timeout = timeout
+		self.stall = stall
+
+		if scratch is None:
+			scratch = bool(os.environ.get('ST_SCRATCH'))
+		if scratch is True:
+			scratch = Scratch()
+		elif scratch and not isinstance(scratch, Scratch):
+			scratch = Scratch(scratch)
+		self.scratch = scratch or None
+		self.scratch_files = []
+		assert not (self.scratch and self.fusemount), 'Scratch directories and fuse mounts cannot be combined'
+
+		if cache is None:
+			cache = bool(os.environ.get('ST_MODEL_CACHE'))
+		if cache is True:
+			cache = ModelCache()
+		elif cache and not isinstance(cache, ModelCache):
+			cache = ModelCache(cache)
+		self.cache = cache or None
+		self.cache_key = None
+		self.cache_hit = False
+		self.fmu = None
+		self.fmu_result = None
 
 	def __del__(self):
 		if hasattr(self,'fusemount') and self.fusemount:
@@ -287,8 +448,38 @@ class Simulator(object):
 		else:
 			return fn
 
+	@property
+	def exe_fn(self):
+		if sysconfig.get_platform()=='mingw' or os.name == 'nt':
+			return self.model + '.exe'
+		return self.model
+
+	@property
+	def fmu_fn(self):
+		return self.model + '.fmu'
+
+	def compiled_files(self):
+		"""Files making up a compiled model, as stored in the model cache."""
+		if self.fmu is not None:
+			return [self.fmu.fn]
+		d = os.path.dirname(self.init_in_fn)
+		fns = [self.exe_fn, os.path.basename(self.init_in_fn), self.model + '_info.json']
+		return [os.path.join(d, fn) for fn in fns if os.path.exists(os.path.join(d, fn))]
+
 	def compile_model(self, n_proc=0, libs=['Modelica', 'SolarTherm'], args=['-d=nonewInst']):
-		"""Compile modelica model in .mo file."""
+		"""Compile modelica model in .mo file.
+
+		If a model cache is in use and already holds this model compiled with
+		the same libraries, omc version and `args`, the executable and init
+		file are copied from the cache instead, and `compile_sim` does nothing.
+		"""
+		self.cache_hit = False
+		if self.cache is not None:
+			self.cache_key = self.cache.key(self.fn, self.model, libs, args)
+			if self.cache.fetch(self.cache_key, os.path.dirname(self.init_in_fn) or '.'):
+				self.cache_hit = True
+				return
+
 		call = ['omc', '-s', '-q', '-n='+str(n_proc)] + args + ['-i='+self.model, self.fn] + libs
 		sp_run(call)
 			
@@ -314,12 +505,77 @@ class Simulator(object):
 
 	def compile_sim(self, n_jobs=(1 + mp.cpu_count()//2), args=[]):
 		"""Compile model source code into a simulation executable."""
+		if self.cache_hit:
+			return
 		call = ['make', '-j', str(n_jobs), '-f', self.makefile_fn] + args
 		sp_run(call)
+		if self.cache is not None and self.cache_key is not None:
+			self.cache.publish(self.cache_key, self.compiled_files())
+
+	def compile_fmu(self, libs=['Modelica', 'SolarTherm'], args=['-d=nonewInst'], fmi_type='me', version='2.0'):
+		"""Export the model as an FMU (`fmu_fn`) of type `fmi_type` ('me' for
+		model exchange, 'cs' for co-simulation), for `load_fmu`.
+
+		The model cache is used as by `compile_model`.
+		"""
+		key = None
+		if self.cache is not None:
+			key = self.cache.key(self.fn, self.model, libs, args + ['--fmu=%s:%s'%(version, fmi_type)])
+			if self.cache.fetch(key, '.'):
+				return
+		mos_fn = self.model + '_fmu.mos'
+		with open(mos_fn, 'w') as f:
+			for lib in libs:
+				f.write('loadModel(%s); getErrorString();\n'%(lib,))
+			f.write('loadFile("%s"); getErrorString();\n'%(self.fn.replace('\\', '/'),))
+			f.write('buildModelFMU(%s, version="%s", fmuType="%s"); getErrorString();\n'%(
+				self.model, version, fmi_type))
+		sp_run(['omc'] + args + [mos_fn])
+		assert os.access(self.fmu_fn, os.R_OK), "FMU export of '%s' failed"%(self.model,)
+		if key is not None:
+			self.cache.publish(key, [self.fmu_fn])
+
+	def load_fmu(self, outputs=None, solver='CVode'):
+		"""Simulate from now on in this process, with the FMU `fmu_fn`.
+
+		Only the variables `outputs` (default: all) are recorded. Parameters
+		are set through the FMI API, so `update_pars` no longer writes init
+		files, and the results of `simulate` are kept in memory (see `result`)
+		instead of being written to `res_fn`.
+		"""
+		from solartherm.fmu import FMURunner
+		self.fmu = FMURunner(self.fmu_fn, outputs, solver)
+		self.load_init()
+
+	def result(self, resultclass):
+		"""Results of the last `simulate`, as a `resultclass` (e.g.
+		`postproc.SimResultElec`)."""
+		if self.fmu is not None:
+			return resultclass.from_reader(self.fmu_result)
+		return resultclass(self.res_fn)
 
 	def load_init(self):
-		"""Load in init XML."""
-		self.init_et = ET.parse(self.init_in_fn)
+		"""Load in init XML, and index its variables by name.
+
+		With an FMU, its model description is used instead, which has the
+		same layout.
+		"""
+		self.init_et = ET.parse(self.init_in_fn if self.fmu is None else self.fmu.description_fn)
+		self.index_init()
+
+	def index_init(self):
+		"""Build name->element maps for the start values and units of all
+		variables in the init XML, so that parameter updates do not need to
+		search the whole document."""
+		self.start_index = {}
+		self.unit_index = {}
+		for sv in self.init_et.getroot().iter('ScalarVariable'):
+			n = sv.get('name')
+			for node in sv:
+				if n not in self.start_index and 'start' in node.attrib:
+					self.start_index[n] = node
+				if n not in self.unit_index and 'unit' in node.attrib:
+					self.unit_index[n] = node.attrib['unit']
 
 	def write_init(self):
 		"""Write new init XML with optional suffix."""
@@ -328,6 +584,14 @@ class Simulator(object):
 	def clear_init(self):
 		"""Clear init XML."""
 		self.init_et = None
+		self.start_index = None
+		self.unit_index = None
+
+	def start_node(self, n):
+		try:
+			return self.start_index[n]
+		except KeyError:
+			raise KeyError("Parameter '%s' has no start value in '%s'"%(n,self.init_in_fn))
 
 	def update_et_pars(self, par_n, par_v):
 		"""Update parameter values in internal XML.
@@ -336,49 +600,101 @@ class Simulator(object):
 		are final (protected).  This can happen indirectly if a final parameter
 		derives its value from a non-final changed parameter.
 		"""
-		root = self.init_et.getroot()
 		for i, n in enumerate(par_n):
-			root.find('*ScalarVariable[@name=\''+n+'\']/*[@start]').attrib['start'] = par_v[i]
+			self.start_node(n).attrib['start'] = par_v[i]
 
-	def update_pars(self, par_n, par_v):
-		"""Update parameters values in XML and write results to file."""
+	def get_et_pars(self, par_n):
+		"""Get the current start values of parameters in internal XML."""
+		return [self.start_node(n).attrib['start'] for n in par_n]
+
+	@property
+	def override_fn(self):
+		if self.suffix is None:
+			return self.model + '_override.txt'
+		else:
+			return self.model + '_override_' + self.suffix + '.txt'
+
+	def update_pars(self, par_n, par_v, override=None):
+		"""Update parameters values in XML and write results to file.
+
+		If `override` (default: the `override` attribute of this Simulator)
+		is true, the init XML is not rewritten. Instead the values are kept
+		and passed to the next `simulate` call through an `-overrideFile`,
+		which is much cheaper for large models. With an FMU (see `load_fmu`),
+		the values are always kept for the next `simulate` in the same way.
+		"""
+		if override is None:
+			override = self.override
+		if override or self.fmu is not None:
+			if self.init_et is not None:
+				for n in par_n:
+					self.start_node(n)
+			self.override_pars = [(n, str(par_v[i])) for i, n in enumerate(par_n)]
+			return
+		self.override_pars = None
 		if self.init_et is None:
 			self.load_init()
 		self.update_et_pars(par_n, par_v)
 		self.write_init()
 	
 	def get_unit(self, var_n):
-		root = self.init_et.getroot()
+		return self.unit_index.get(var_n, '')
 
-		node = root.find('*ScalarVariable[@name=\''+var_n+'\']/*[@unit]')
-		return '' if node is None else node.attrib['unit']
-
-	def simulate(self, start='0', stop='86400', step='60', tolerance = '1e-04', initStep=None, maxStep=None, integOrder=None, solver='rungekutta', nls='newton', lv='-LOG_SUCCESS,-stdout', args=[]):
+	def simulate(self, start='0', stop='86400', step='60', tolerance = '1e-04', initStep=None, maxStep=None, integOrder=None, solver='rungekutta', nls='newton', lv='-LOG_SUCCESS,-stdout', args=[], variables=None, events=True, timeout=None, stall=None):
 		"""Run simulation.
 
 		If running an optimisation then 'optimization' needs to be used as
 		solver type.
+
+		`variables` limits the variables written to the results file to a
+		list of names, which may contain shell-style wildcards (see
+		`variable_filter`); by default all variables are written. Without
+		`events`, only the points every `step` are written, and none at
+		events.
+
+		The simulation is killed after `timeout` seconds, or `stall` seconds
+		without progress once it has started writing results (defaults: the
+		attributes of the same names, see `run_watched`). Any
+		failure raises a `SimulationError`, classified by its cause.
 		"""
 		start = str(parse_var_val(start, 's'))
 		stop = str(parse_var_val(stop, 's'))
 		step = str(parse_var_val(step, 's'))
 		tolerance = str(tolerance)
 		
+		if self.fmu is not None:
+			self.fmu_result = self.fmu.simulate(dict(self.override_pars or []),
+				start, stop, step, tolerance)
+			return
+
 		if initStep!=None:
 			initStep = str(parse_var_val(initStep, 's'))
 		if maxStep!=None:
 			maxStep = str(parse_var_val(maxStep, 's'))
 
-		sim_args = [
-			'-override',
-			'startTime='+start+',stopTime='+stop+',stepSize='+step+',tolerance='+tolerance,
+		settings = [('startTime',start), ('stopTime',stop), ('stepSize',step), ('tolerance',tolerance)]
+		if variables is not None:
+			settings.append(('variableFilter', variable_filter(variables)))
+		if self.override_pars is not None:
+			# OM does not combine -override with -overrideFile, so the
+			# simulation settings go into the file as well
+			with open(self.override_fn, 'w') as f:
+				for n, v in self.override_pars + settings:
+					f.write('%s=%s\n'%(n,v))
+			override = ['-overrideFile='+self.override_fn]
+			init_fn = self.init_in_fn
+		else:
+			override = ['-override', ','.join('%s=%s'%nv for nv in settings)]
+			init_fn = self.init_out_fn
+
+		sim_args = override + [
 			'-s', solver,
 			'-nls', nls, #Nonlinear solver
 			'-initialStepSize', initStep,
 			'-maxStepSize', maxStep,
 			'-maxIntegrationOrder', integOrder,
 			'-lv', lv, # Specifies which logging levels to enable
-			'-f', self.init_out_fn,
+			'-f', init_fn,
 			'-r', self.res_fn,
 			]
 
@@ -391,10 +707,428 @@ class Simulator(object):
 		if lv==None:
 			sim_args = [e for e in sim_args if e not in ('-lv', lv)]
 
+		if not events:
+			sim_args.append('-noEventEmit')
+
+		# a results file left by an earlier run must not pass for this one's
+		if os.path.exists(self.res_fn):
+			os.remove(self.res_fn)
 		call = ['./'+self.model] + sim_args + args
-		sp_run(call)
-		#sp.call(['./'+self.model] + sim_args + args)
-		# assert also that there must be a result file
-		assert os.access(self.res_fn,os.R_OK)
+		wdir = None
+		if self.scratch is not None:
+			files = self.compiled_files() + [init_fn] + self.scratch_files
+			if self.override_pars is not None:
+				files.append(self.override_fn)
+			wdir = self.scratch.create(dict((os.path.basename(f), f) for f in files).values())
+		try:
+			run_watched(call, self.timeout if timeout is None else timeout,
+				self.stall if stall is None else stall,
+				self.res_fn if wdir is None else os.path.join(wdir, self.res_fn), cwd=wdir)
+			if wdir is not None:
+				move_overwrite(os.path.join(wdir, self.res_fn), self.res_fn)
+		finally:
+			if wdir is not None:
+				self.scratch.remove(wdir)
+		# there must also be a result file
+		if not os.access(self.res_fn,os.R_OK):
+			raise SimulationError('no-output', "no results file '%s'"%(self.res_fn,))
+
+	def simulate_retry(self, retry=[], **kwargs):
+		"""`simulate` with arguments `kwargs`, and after a failure again with
+		each of the alternative settings in `retry` in turn: dicts of
+		arguments replacing some of `kwargs`, e.g. {'solver': 'ida',
+		'tolerance': '1e-06'}. Returns the settings that worked ({} for the
+		first attempt), or raises the SimulationError of the last attempt.
+		"""
+		for j, alt in enumerate([{}] + list(retry)):
+			try:
+				self.simulate(**dict(kwargs, **alt))
+				return alt
+			except SimulationError as e:
+				if j == len(retry):
+					raise
+				print('Simulation failed (%s), retrying with %s'%(e, format_settings(retry[j])))
+
+	def simulate_chunks(self, nchunks, warmup='1d', start='0', stop='86400', nproc=None,
+			names=None, cumulative=[], fmt='npz', keep=False, **kwargs):
+		"""Run the simulation as `nchunks` consecutive chunks in parallel.
+
+		[start, stop] is split into equal chunks, each of which is simulated
+		from `warmup` earlier (but not before `start`), with `nproc` chunks
+		running at a time (default: all). The warm-up parts are discarded and
+		the chunks are joined by `postproc.stitch_results`, which offsets the
+		`cumulative` variables (e.g. `SimResultElec.cumulative_vars`) so that
+		they carry on across the joins. The joined variables (`names`, default
+		all) are written to an export file of format `fmt`, named after
+		`res_fn`, which can be read with `SimResult`. The results files of the
+		chunks are removed unless `keep`. Other keyword arguments are passed on
+		to `simulate`.
+
+		Returns (file name, seams), where seams gives the largest jump of each
+		trajectory at the joins relative to its range (see `stitch_results`).
+		Since a chunk starts from the initial state of the model, the warm-up
+		should be long enough for the slowest states (e.g. storage) to settle.
+		"""
+		from multiprocessing.pool import ThreadPool
+		from solartherm import postproc
+		assert not self.fusemount, 'Chunked simulation does not support fuse mounts'
+		start = parse_var_val(start, 's')
+		stop = parse_var_val(stop, 's')
+		warmup = parse_var_val(warmup, 's')
+		bounds = [start + (stop - start)*j/nchunks for j in range(nchunks + 1)]
+
+		base = self.suffix
+		init_fn = self.init_out_fn if os.path.exists(self.init_out_fn) else self.init_in_fn
+		chunks = []
+		for j in range(nchunks):
+			c = copy.copy(self)
+			c.suffix = ('' if base is None else base + '_') + 'chunk%d'%(j,)
+			if self.override_pars is None:
+				shutil.copy(init_fn, c.init_out_fn)
+			chunks.append(c)
+
+		def run(j):
+			# the simulations are separate processes, so threads are enough
+			chunks[j].simulate(start=str(max(start, bounds[j] - warmup)),
+				stop=str(bounds[j + 1]), **kwargs)
+		pool = ThreadPool(nproc or nchunks)
+		try:
+			pool.map(run, range(nchunks))
+		finally:
+			pool.close()
+
+		results = [postproc.SimResult(c.res_fn) for c in chunks]
+		t, traj, params, units, seams = postproc.stitch_results(results, bounds,
+			cumulative, names)
+		out_fn = export.export_fn(self.res_fn, fmt)
+		export.write(out_fn, t, traj, params, units, fmt)
+		if not keep:
+			for c, res in zip(chunks, results):
+				close = getattr(res.mat, 'close', None)
+				if close is not None:
+					close()
+				for fn in (c.res_fn, c.init_out_fn, c.override_fn):
+					if os.path.exists(fn):
+						os.remove(fn)
+		return out_fn, seams
+
+
+def parse_settings(s):
+	"""`simulate` arguments from a string such as 'solver=ida,tolerance=1e-6'."""
+	return dict(kv.split('=', 1) for kv in s.split(',') if kv)
+
+def format_settings(d):
+	return ','.join('%s=%s'%(k, d[k]) for k in sorted(d))
+
+def variable_filter(patterns):
+	"""OpenModelica variable filter (a regular expression) for variable names
+	or shell-style wildcard patterns, e.g. ['E_elec', 'wea.*']."""
+	res = []
+	for p in patterns:
+		res.append(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in p))
+	return '|'.join(res)
+
+def sweep_worker(fn, start, stop, step, tolerance, initStep, maxStep, integOrder, solver, nls, lv, args, par_n, resultclass, reuse, peaker, override, exp, stv, variables, events, watch, scratch, i, par_v):
+	"""Simulate design point `i` of a parameter sweep (see st_simulate).
+
+	This is the function run by the executors of st_simulate, so it must be
+	importable by remote workers.
+
+	`watch` is None, or a dict with the 'timeout' and 'stall' limits of each
+	simulation and the alternative settings to 'retry' after a failure (see
+	`Simulator.simulate_retry`). `scratch` is None, or the scratch setting of
+	the Simulator (see `Simulator`) and the list of its `scratch_files`.
+
+	Returns (perf, status, message, walltime, traj), where status is 'ok',
+	the kind of a `SimulationError` (see FAILURES) or 'failed' for any other
+	error (with the error in message), and traj holds the trajectories
+	selected by `stv` for the sweep store, if any. The message of a point
+	that only succeeded on a retry gives the settings used.
+	"""
+	t0 = time.time()
+	message = None
+	try:
+		if watch is None:
+			watch = {'timeout': None, 'stall': None, 'retry': []}
+		sim = Simulator(fn, suffix=str(i), override=override, timeout=watch['timeout'],
+			stall=watch['stall'], scratch=None if scratch is None else scratch[0])
+		if scratch is not None:
+			sim.scratch_files = scratch[1]
+
+		if not override:
+			sim.load_init()
+
+		sim.update_pars(par_n, par_v)
+
+		alt = sim.simulate_retry(watch['retry'], start=start, stop=stop, step=step,
+			tolerance=tolerance, initStep=initStep, maxStep=maxStep, integOrder=integOrder,
+			solver=solver, nls=nls, lv=lv, args=args, variables=variables, events=events)
+		if alt:
+			message = 'retried with ' + format_settings(alt)
+		res = resultclass(sim.res_fn)
+		perf = res.calc_perf(peaker)
+		traj = None
+		if stv is not None:
+			names = export.select_vars(res.mat, stv['names'])
+			t, traj, pars, units = export.extract(res, names, stv['step'])
+			traj['time'] = t
+		if exp is not None:
+			export.export_result(res, exp['names'], fmt=exp['format'], step=exp['step'],
+				remove=exp['remove'], peaker=peaker)
+	except SimulationError as e:
+		return None, e.kind, str(e), time.time() - t0, None
+	except Exception as e:
+		return None, 'failed', '%s: %s'%(type(e).__name__, e), time.time() - t0, None
+	return perf, 'ok', message, time.time() - t0, traj
+
+
+def _pool_worker(wdir, files, fn, model, sim_kw, resultclass, peaker, outdir, override, tasks, results, wid):
+	"""Main loop of a SimulationPool worker process.
+
+	The worker stages the compiled model into its own directory `wdir` and
+	parses the init XML once, then runs one simulation per task taken from
+	its own queue `tasks` until it receives `None`. Messages on `results`
+	are `(wid, k, result)` for task number `k`, or `(wid, None, error)` if
+	the worker could not start.
+	"""
+	try:
+		os.chdir(wdir)
+		for f in files:
+			shutil.copy2(f, wdir)
+		sim = Simulator(fn, model=model, cache=False, override=override)
+		sim.load_init()
+	except Exception:
+		results.put((wid, None, traceback.format_exc()))
+		return
+	while True:
+		task = tasks.get()
+		if task is None:
+			break
+		k, i, par_n, par_v = task
+		t = time.time()
+		try:
+			sim.suffix = str(i)
+			par_0 = sim.get_et_pars(par_n)
+			sim.update_pars(par_n, par_v)
+			sim.update_et_pars(par_n, par_0)
+			sim.simulate(**sim_kw)
+			perf = None
+			if resultclass is not None:
+				perf = resultclass(sim.res_fn).calc_perf(peaker)
+			res_fn = os.path.abspath(sim.res_fn)
+			if outdir is not None:
+				move_overwrite(sim.res_fn, outdir)
+				move_overwrite(sim.init_out_fn, outdir)
+				move_overwrite(sim.override_fn, outdir)
+				res_fn = os.path.join(outdir, sim.res_fn)
+			results.put((wid, k, (i, res_fn, perf, None, time.time() - t)))
+		except Exception:
+			results.put((wid, k, (i, None, None, traceback.format_exc(), time.time() - t)))
+
+
+class SimulationPool(object):
+	"""Pool of long-running workers for evaluating many design points.
+
+	Each of the `nproc` workers owns a private directory holding a copy of the
+	compiled model of `sim` (which must already have been compiled), and keeps
+	the parsed init XML in memory between runs, so that per-point cost is
+	limited to writing the init file and running the executable.
+
+	`sim_kw` are the keyword arguments for `Simulator.simulate`. If
+	`resultclass` is given (e.g. `postproc.SimResultElec`), the performance
+	vector from its `calc_perf` is returned with each result. Result and init
+	files are moved to `outdir` if given, otherwise they stay in the worker
+	directories, which are deleted by `close`. `override` is passed on to
+	the Simulator of each worker.
+
+	Points are handed to the workers one at a time, so the pool always knows
+	which point each worker is running. A worker that dies (killed for lack
+	of memory, or crashed in a native library) is replaced, and its point is
+	returned with an error; the workers are checked every `poll` seconds.
+	Workers that cannot start (e.g. a broken init XML) are not replaced, and
+	once there are no workers left, or after `max_restarts` deaths in a row
+	without a result, all remaining points are returned with the error.
+
+	>>> pool = SimulationPool(sim, nproc=4, sim_kw={'stop':'1d'})
+	>>> for i, v in enumerate(par_vs):
+	...     pool.submit(i, ['SM'], v)
+	>>> for i, res_fn, perf, err, dt in pool.results():
+	...     print(i, res_fn)
+	>>> pool.close()
+	"""
+	def __init__(self, sim, nproc=mp.cpu_count(), sim_kw={}, resultclass=None, peaker=False, outdir=None, override=False, workdir=None, poll=1., max_restarts=None):
+		files = [os.path.abspath(f) for f in sim.compiled_files()]
+		assert len(files), "Model '%s' has not been compiled"%(sim.model,)
+		if outdir is not None:
+			outdir = os.path.abspath(outdir)
+		self.basedir = tempfile.mkdtemp(prefix='solartherm-pool-', dir=workdir)
+		self.resq = mp.Queue()
+		self.poll = poll
+		self.pending = {} # task number -> point, for the points not returned yet
+		self.backlog = collections.deque() # tasks not handed to a worker yet
+		self.running = {} # task number -> task, for the tasks handed out
+		self.ntasks = 0
+		nproc = max(1, nproc)
+		self.max_restarts = 2*nproc if max_restarts is None else max_restarts
+		self.deaths = 0 # in a row, without a result in between
+		self.error = None # why the last worker that could not start failed
+		self.last_check = time.time()
+		self.worker_args = (files, sim.fn, sim.model, sim_kw, resultclass, peaker,
+			outdir, override)
+		self.nwid = 0
+		# for each worker slot: process (None once retired), id, task queue,
+		# and the number of the task it is running (None if idle)
+		self.workers = [None]*nproc
+		self.ids = [None]*nproc
+		self.queues = [None]*nproc
+		self.busy = [None]*nproc
+		for j in range(nproc):
+			self.start_worker(j)
+
+	def start_worker(self, j):
+		wdir = os.path.join(self.basedir, 'worker%d'%(j,))
+		if not os.path.isdir(wdir):
+			os.mkdir(wdir)
+		# a new queue, in case the dead worker left a task in its own
+		self.queues[j] = mp.Queue()
+		self.ids[j] = self.nwid
+		self.nwid += 1
+		p = mp.Process(target=_pool_worker, args=(wdir,) + self.worker_args
+			+ (self.queues[j], self.resq, self.ids[j]))
+		p.daemon = True
+		p.start()
+		self.workers[j] = p
+		self.busy[j] = None
+
+	def retire_worker(self, j):
+		self.workers[j].join()
+		self.workers[j] = None
+		self.busy[j] = None
+
+	def dispatch(self):
+		"""Hand tasks to the idle workers."""
+		for j, p in enumerate(self.workers):
+			if not self.backlog:
+				return
+			if p is not None and self.busy[j] is None:
+				k, task = self.backlog.popleft()
+				self.queues[j].put(task)
+				self.busy[j] = k
+				self.running[k] = task
+
+	def lost(self, k, msg):
+		i = self.pending.pop(k)
+		self.running.pop(k, None)
+		return (i, None, None, msg, None)
+
+	def fail_all(self):
+		"""Error results for all the remaining points, once no workers are left."""
+		msg = 'No workers left in the pool'
+		if self.error is not None:
+			msg += ', a worker could not start:\n' + self.error
+		out = [self.lost(k, msg) for k, task in self.backlog]
+		self.backlog.clear()
+		return out
+
+	def check_workers(self):
+		"""Replace the workers that have died, returning error results for the
+		points they were running."""
+		self.last_check = time.time()
+		lost = []
+		for j, p in enumerate(self.workers):
+			if p is None or p.is_alive():
+				continue
+			k = self.busy[j]
+			if k in self.pending:
+				lost.append(self.lost(k, 'Worker process died (exit code %s) while'
+					' simulating point %s'%(p.exitcode, self.pending[k])))
+			self.deaths += 1
+			if self.deaths > self.max_restarts:
+				self.retire_worker(j)
+			else:
+				self.start_worker(j)
+		if all(p is None for p in self.workers):
+			lost += self.fail_all()
+		return lost
+
+	def handle(self, wid, k, res):
+		"""Results from the message `(wid, k, res)` of a worker."""
+		try:
+			j = self.ids.index(wid)
+		except ValueError:
+			j = None # a worker that has been replaced
+		if k is None:
+			# could not start: replacing the worker would fail the same way
+			self.error = res
+			if j is not None and self.workers[j] is not None:
+				k = self.busy[j]
+				if k in self.running:
+					# not run: give it to another worker
+					self.backlog.appendleft((k, self.running.pop(k)))
+				self.retire_worker(j)
+			if all(p is None for p in self.workers):
+				return self.fail_all()
+			return []
+		self.deaths = 0
+		if j is not None and self.busy[j] == k:
+			self.busy[j] = None
+		self.running.pop(k, None)
+		if k in self.pending: # else already reported lost
+			del self.pending[k]
+			return [res]
+		return []
+
+	def submit(self, i, par_n, par_v):
+		"""Queue design point `i`, setting parameters `par_n` to `par_v`."""
+		k = self.ntasks
+		self.ntasks += 1
+		self.pending[k] = i
+		self.backlog.append((k, (k, i, list(par_n), [str(v) for v in par_v])))
+		self.dispatch()
+
+	def results(self):
+		"""Yield `(i, res_fn, perf, error, walltime)` as simulations finish.
+
+		`error` is None on success, otherwise the formatted traceback from the
+		worker, in which case `res_fn` and `perf` are None.
+		"""
+		while self.pending:
+			self.dispatch()
+			out = []
+			try:
+				out = self.handle(*self.resq.get(timeout=self.poll))
+			except queue.Empty:
+				pass
+			if time.time() - self.last_check >= self.poll:
+				out += self.check_workers()
+			for res in out:
+				yield res
+
+	def map(self, par_n, par_vs):
+		"""Evaluate all of `par_vs`, returning results in submission order."""
+		for i, v in enumerate(par_vs):
+			self.submit(i, par_n, v)
+		out = [None]*len(par_vs)
+		for res in self.results():
+			out[res[0]] = res
+		return out
+
+	def close(self, keep=False):
+		"""Stop the workers, and remove their directories unless `keep`."""
+		for j, p in enumerate(self.workers):
+			if p is not None:
+				self.queues[j].put(None)
+		for p in self.workers:
+			if p is not None:
+				p.join()
+		self.workers = []
+		if not keep:
+			shutil.rmtree(self.basedir, ignore_errors=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
 
 # vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,194 @@
+"""
+Consolidated store for the results of a parameter sweep.
+
+`SweepStore` keeps one row per design point of a sweep in an SQLite file:
+the parameter vector, the performance vector returned by `calc_perf`, the
+simulation wall time, the run status ('ok', or for a failure its kind, e.g.
+'timeout' or 'solver', see `simulation.FAILURES`, with an error message) and
+optionally some selected trajectories. Parameter and
+performance vectors are stored as JSON lists in the order given by the
+'par_n' and 'perf_n' entries of the meta table, so they can also be queried
+directly with SQLite's json_extract().
+
+The store is meant to have a single writer (e.g. the main process of
+st_simulate, fed by the pool callbacks). Rows are buffered and committed in
+batches, either every `batch` rows or every `interval` seconds, whichever
+comes first.
+"""
+from __future__ import division, print_function, unicode_literals
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+	key TEXT PRIMARY KEY,
+	value TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+	idx INTEGER PRIMARY KEY,
+	params TEXT,
+	perf TEXT,
+	status TEXT,
+	message TEXT,
+	walltime REAL,
+	finished REAL);
+CREATE TABLE IF NOT EXISTS traj (
+	idx INTEGER,
+	name TEXT,
+	data BLOB,
+	PRIMARY KEY (idx, name));
+"""
+
+def _num(v):
+	"""Parameter value as a float where possible."""
+	try:
+		return float(v)
+	except (TypeError, ValueError):
+		return v
+
+
+class SweepStore(object):
+	def __init__(self, fn, batch=100, interval=10.):
+		"""
+		fn: SQLite file, created if needed
+		batch: number of rows buffered before a commit
+		interval: maximum time in seconds between commits
+		"""
+		self.fn = fn
+		self.batch = batch
+		self.interval = interval
+		self.lock = threading.Lock()
+		# callbacks of a multiprocessing pool run in a separate thread
+		self.con = sqlite3.connect(fn, check_same_thread=False)
+		self.con.execute('PRAGMA journal_mode=WAL')
+		self.con.execute('PRAGMA synchronous=NORMAL')
+		self.con.executescript(SCHEMA)
+		self.con.commit()
+		self.pending = []
+		self.pending_traj = []
+		self.last_commit = time.time()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def set_meta(self, **kwargs):
+		"""Set meta data entries (any JSON-serialisable values)."""
+		with self.lock:
+			self.con.executemany('INSERT OR REPLACE INTO meta VALUES (?,?)',
+				[(k, json.dumps(v)) for k, v in kwargs.items()])
+			self.con.commit()
+
+	def get_meta(self, key, default=None):
+		row = self.con.execute('SELECT value FROM meta WHERE key=?', (key,)).fetchone()
+		if row is None:
+			return default
+		return json.loads(row[0])
+
+	def add(self, i, par_v, perf=None, status='ok', message=None, walltime=None, traj=None):
+		"""Record the outcome of design point `i`.
+
+		traj: optional dict of name -> array of selected trajectories (usually
+		including 'time')
+		"""
+		row = (int(i), json.dumps([_num(v) for v in par_v]),
+			None if perf is None else json.dumps([_num(v) for v in perf]),
+			status, message, walltime, time.time())
+		with self.lock:
+			self.pending.append(row)
+			if traj is not None:
+				for n, v in traj.items():
+					self.pending_traj.append((int(i), n,
+						np.ascontiguousarray(v, dtype='<f8').tobytes()))
+			if len(self.pending) >= self.batch or time.time() - self.last_commit >= self.interval:
+				self._commit()
+
+	def _commit(self):
+		if self.pending:
+			self.con.executemany('INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?)',
+				self.pending)
+		if self.pending_traj:
+			self.con.executemany('INSERT OR REPLACE INTO traj VALUES (?,?,?)',
+				self.pending_traj)
+		self.con.commit()
+		self.pending = []
+		self.pending_traj = []
+		self.last_commit = time.time()
+
+	def commit(self):
+		"""Write all buffered rows."""
+		with self.lock:
+			self._commit()
+
+	def close(self):
+		if self.con is None:
+			return
+		self.commit()
+		self.con.close()
+		self.con = None
+
+	def completed(self, status='ok'):
+		"""Set of the indices recorded with `status` (any status if None)."""
+		self.commit()
+		if status is None:
+			rows = self.con.execute('SELECT idx FROM runs')
+		else:
+			rows = self.con.execute('SELECT idx FROM runs WHERE status=?', (status,))
+		return set(r[0] for r in rows)
+
+	def runs(self, status=None, index=None):
+		"""Iterate over the recorded runs, as dicts, in index order."""
+		self.commit()
+		sql = 'SELECT idx, params, perf, status, message, walltime, finished FROM runs'
+		cond, args = [], []
+		if status is not None:
+			cond.append('status=?')
+			args.append(status)
+		if index is not None:
+			cond.append('idx=?')
+			args.append(int(index))
+		if cond:
+			sql += ' WHERE ' + ' AND '.join(cond)
+		for r in self.con.execute(sql + ' ORDER BY idx', args):
+			yield {'index': r[0], 'params': json.loads(r[1]),
+				'perf': None if r[2] is None else json.loads(r[2]),
+				'status': r[3], 'message': r[4], 'walltime': r[5], 'finished': r[6]}
+
+	def get(self, i):
+		"""Run `i` as a dict, or None if it has not been recorded."""
+		for r in self.runs(index=i):
+			return r
+		return None
+
+	def arrays(self, status='ok'):
+		"""Indices, parameter and performance values of the recorded runs as
+		numpy arrays (with NaN for missing or non-numeric values)."""
+		def row(vs, n):
+			out = np.full(n, np.nan)
+			for j, v in enumerate(vs or []):
+				if isinstance(v, (int, float)):
+					out[j] = v
+			return out
+		npar = len(self.get_meta('par_n', []))
+		nperf = len(self.get_meta('perf_n', []))
+		idx, par, perf = [], [], []
+		for r in self.runs(status):
+			idx.append(r['index'])
+			par.append(row(r['params'], npar))
+			perf.append(row(r['perf'], nperf))
+		return (np.array(idx, dtype=int), np.array(par).reshape(-1, npar),
+			np.array(perf).reshape(-1, nperf))
+
+	def trajectory(self, i, name):
+		"""Stored trajectory `name` of run `i`."""
+		row = self.con.execute('SELECT data FROM traj WHERE idx=? AND name=?',
+			(int(i), name)).fetchone()
+		if row is None:
+			raise KeyError("No trajectory '%s' stored for run %d" % (name, i))
+		return np.frombuffer(row[0], dtype='<f8')
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,42 @@
+"""
+Writer for small OpenModelica-style (MAT v4, 'binTrans') result files, so
+that the result-processing code can be tested without running a simulation.
+"""
+import struct
+import numpy as np
+
+def _matrix(f, name, arr, tp):
+	"""Write 2D array `arr` as a MAT v4 matrix, in column-major order."""
+	nr, nc = arr.shape
+	n = name.encode() + b'\0'
+	f.write(struct.pack('<5i', tp, nr, nc, 0, len(n)))
+	f.write(n)
+	f.write(np.asfortranarray(arr).tobytes(order='F'))
+
+def _text(strs, trans=True):
+	ln = max(len(s) for s in strs) + 1
+	a = np.zeros((len(strs), ln), dtype=np.uint8)
+	for i, s in enumerate(strs):
+		a[i,:len(s)] = bytearray(s.encode())
+	return a.T if trans else a
+
+def write_mat(fn, time, traj={}, params={}, descr={}):
+	"""Write a result file with time vector `time`, trajectories `traj`
+	(name -> array of the same length as `time`) and constant parameters
+	`params` (name -> value)."""
+	names = ['time'] + list(params) + list(traj)
+	info = [[0, 1, 0, -1]]
+	info += [[1, 2 + i, 0, 0] for i in range(len(params))]
+	info += [[2, 2 + i, 0, -1] for i in range(len(traj))]
+	time = np.asarray(time, dtype='f8')
+	data_1 = np.array([[time[0], time[-1]]] + [[v, v] for v in params.values()])
+	data_2 = np.array([time] + [np.asarray(v, dtype='f8') for v in traj.values()])
+	with open(fn, 'wb') as f:
+		aclass = ['Atrajectory', '1.1', '', 'binTrans']
+		_matrix(f, 'Aclass', _text([s.ljust(11) for s in aclass], trans=False), 51)
+		_matrix(f, 'name', _text(names), 51)
+		_matrix(f, 'description', _text([descr.get(n, '') for n in names]), 51)
+		_matrix(f, 'dataInfo', np.array(info, dtype='<i4').T, 20)
+		_matrix(f, 'data_1', data_1.astype('<f8'), 0)
+		_matrix(f, 'data_2', data_2.astype('<f8'), 0)
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,66 @@
+#! /bin/env python
+from __future__ import division
+import os, sys, platform
+import numpy as np
+import pytest
+
+from solartherm import simulation
+from solartherm import postproc
+
+# stand-in for a compiled model: a first-order lag x towards a daily square
+# wave, starting from x=0 at the start time given by '-override', and its
+# integral E_elec, written as a result file.
+FAKE_EXE = """#!%s
+import sys
+sys.path.insert(0, %r)
+import numpy as np
+import fakemat
+a = sys.argv
+ov = dict(kv.split('=') for kv in a[a.index('-override') + 1].split(','))
+t0, t1 = float(ov['startTime']), float(ov['stopTime'])
+t = np.linspace(t0, t1, int(round((t1 - t0)/600.)) + 1)
+u = (np.sin(2*np.pi*t/86400.) > 0).astype(float)
+x = np.zeros(len(t))
+for i in range(1, len(t)):
+	x[i] = x[i-1] + (u[i] - x[i-1])*(1 - np.exp(-(t[i] - t[i-1])/7200.))
+E = np.concatenate([[0.], np.cumsum(0.5*(x[1:] + x[:-1])*np.diff(t))])
+fakemat.write_mat(a[a.index('-r') + 1], t, {'x':x, 'E_elec':E}, {'p':1.})
+"""
+
+def make_toy():
+	with open('Toy.mo', 'w') as f:
+		f.write('model Toy parameter Real p = 1; end Toy;')
+	with open('Toy', 'w') as f:
+		f.write(FAKE_EXE % (sys.executable, os.path.dirname(os.path.abspath(__file__))))
+	os.chmod('Toy', 0o755)
+	with open('Toy_init.xml', 'w') as f:
+		f.write('<fmiModelDescription><ModelVariables>'
+			'<ScalarVariable name="p"><Real start="1"/></ScalarVariable>'
+			'</ModelVariables></fmiModelDescription>')
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_chunks(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	sim = simulation.Simulator('Toy.mo', cache=False)
+	sim.simulate(stop='9d', step='600')
+	ref = postproc.SimResult(sim.res_fn)
+
+	fn, seams = sim.simulate_chunks(4, warmup='1d', stop='9d', nproc=2,
+		cumulative=['E_elec'], step='600')
+	assert fn == 'Toy_res.npz'
+	assert sorted(os.listdir('.')) == ['Toy', 'Toy.mo', 'Toy_init.xml', 'Toy_res.mat', 'Toy_res.npz']
+	res = postproc.SimResult(fn)
+	t = res.mat.abscissa(2, valuesOnly=True)
+	assert t[0] == 0. and t[-1] == 9*86400. and np.all(np.diff(t) > 0)
+	assert res.get_values('p')[0] == 1.
+	assert seams['x'] < 1e-3
+	assert 'E_elec' not in seams
+	err = postproc.compare_results(res, ref)
+	assert err['x'] < 1e-3
+	assert err['E_elec'] < 1e-3
+
+	# without warm-up, each chunk starts from x=0 rather than about 1
+	fn, seams = sim.simulate_chunks(4, warmup=0, stop='9d', cumulative=['E_elec'], step='600')
+	assert seams['x'] > 0.1
+	assert postproc.compare_results(postproc.SimResult(fn), ref)['x'] > 0.1
@@ -0,0 +1,152 @@
+#! /bin/env python
+from __future__ import division
+import os, sys, platform, json, socket, subprocess
+import pytest
+
+from solartherm import dakota
+from solartherm import postproc
+
+pytestmark = pytest.mark.skipif(platform.system()=="Windows", reason="needs Unix sockets and a shebang")
+
+# stand-in for a compiled model: writes a year of results with electricity
+# output proportional to the parameter p from the '-overrideFile'; fails for p < 0
+FAKE_EXE = """#!%s
+import sys
+sys.path.insert(0, %r)
+import numpy as np
+import fakemat
+a = sys.argv
+ov = [o.split('=', 1)[1] for o in a if o.startswith('-overrideFile=')][0]
+p = float(dict(l.strip().split('=', 1) for l in open(ov))['p'])
+if p < 0:
+	sys.exit(3)
+t = np.linspace(0, 31536000, 8761)
+fakemat.write_mat(a[a.index('-r') + 1], t, {'E_elec':t*p, 'R_spot':t*1e-3},
+	{'C_cap':1e8, 'C_year':1e6, 'C_prod':0., 'r_disc':0.07, 't_life':25, 't_cons':1, 'P_name':1e8})
+"""
+
+class Params(dict):
+	"""Stand-in for dakota.interfacing Parameters."""
+	def __init__(self, var, perf_i, sign):
+		dict.__init__(self, var)
+		state = dict(fn=os.path.abspath('Toy.mo'), system='ELECTRICITY', start='0',
+			stop='1y', step='1h', initStep='None', maxStep='None', integOrder='5',
+			solver='dassl', nls='newton', lv='-LOG_SUCCESS,-stdout', runsolstice='False',
+			peaker='False', num_perf=str(len(perf_i)))
+		for i, (p, s) in enumerate(zip(perf_i, sign)):
+			state['index%d'%i] = str(p)
+			state['sign%d'%i] = str(s)
+		self.update(state)
+		self.descriptors = list(var) + list(state)
+
+def make_toy():
+	with open('Toy.mo', 'w') as f:
+		f.write('model Toy parameter Real p = 1; end Toy;')
+	with open('Toy', 'w') as f:
+		f.write(FAKE_EXE % (sys.executable, os.path.dirname(os.path.abspath(__file__))))
+	os.chmod('Toy', 0o755)
+	with open('Toy_init.xml', 'w') as f:
+		f.write('<fmiModelDescription><ModelVariables>'
+			'<ScalarVariable name="p"><Real start="1"/></ScalarVariable>'
+			'</ModelVariables></fmiModelDescription>')
+
+def test_evaluator(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.delenv('ST_RESULT_CACHE', raising=False)
+	make_toy()
+	ev = dakota.Evaluator()
+	epy = postproc.SimResultElec.perf_n.index('epy')
+	r1 = ev.evaluate(Params({'p': '1e8'}, [epy], [-1]), '1')
+	r2 = ev.evaluate(Params({'p': '2e8'}, [epy], [-1]), '2')
+	assert r1[0] < 0 and abs(r2[0]/r1[0] - 2.) < 1e-9
+	assert list(ev.sims) == [os.path.abspath('Toy.mo')]
+	assert sorted(os.listdir('.')) == ['Toy', 'Toy.lock', 'Toy.mo', 'Toy_init.xml']
+
+	# failed simulations get the worst value
+	assert ev.evaluate(Params({'p': '-1'}, [epy, epy], [-1, 1]), '3') == [0, 99999]
+
+def test_gen_dakota_in(tmp_path):
+	dakota.gen_dakota_in('r', 'm', 'v', str(tmp_path))
+	sample = (tmp_path/'sample.in').read_text()
+	assert 'evaluation_concurrency' not in sample and 'work_directory' not in sample
+	dakota.gen_dakota_in('r', 'm', 'v', str(tmp_path), concurrency=48,
+		work_directory='evals', link_files=[str(tmp_path/'Toy')])
+	sample = (tmp_path/'sample.in').read_text()
+	assert '\tfork\n\tasynchronous evaluation_concurrency = 48\n' in sample
+	assert 'work_directory named "evals/eval"\n\t\tdirectory_tag\n\t\tlink_files "%s"\n'%(tmp_path/'Toy') in sample
+
+class Recorder(object):
+	def __init__(self):
+		self.calls = []
+
+	def run(self, params_fn, results_fn):
+		self.calls.append((params_fn, results_fn))
+		with open(results_fn, 'w') as f:
+			f.write(open(params_fn).read())
+
+def test_daemon(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.delenv(dakota.SOCKET_ENV, raising=False)
+	dakota.gen_interface_bb(str(tmp_path))
+	with open('params.in.1', 'w') as f:
+		f.write('x')
+	rec = Recorder()
+	with dakota.EvaluationDaemon(evaluator=rec) as d:
+		assert os.environ[dakota.SOCKET_ENV] == d.socket_fn
+		subprocess.check_call([sys.executable, 'interface_bb.py', 'params.in.1', 'results.out.1'])
+		assert rec.calls == [(str(tmp_path/'params.in.1'), str(tmp_path/'results.out.1'))]
+		assert open('results.out.1').read() == 'x'
+
+		# from a dakota work directory
+		os.makedirs('evals/eval.2')
+		with open('evals/eval.2/params.in.2', 'w') as f:
+			f.write('y')
+		subprocess.check_call([sys.executable, '../../interface_bb.py', 'params.in.2', 'results.out.2'],
+			cwd='evals/eval.2')
+		assert open('evals/eval.2/results.out.2').read() == 'y'
+		assert len(rec.calls) == 2
+
+		# evaluations from another directory are left to the driver
+		s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		s.connect(d.socket_fn)
+		s.sendall((json.dumps({'params': 'p', 'results': 'r', 'cwd': '/'}) + '\n').encode())
+		assert json.loads(s.makefile('rb').readline().decode()) == {'ok': False, 'local': True}
+		s.close()
+	assert dakota.SOCKET_ENV not in os.environ
+	assert not os.path.exists(d.socket_fn)
+
+def test_ingest(tmp_path, monkeypatch):
+	from solartherm import dakotadata
+	from solartherm.store import SweepStore
+	from solartherm.cache import ResultCache
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	epy = postproc.SimResultElec.perf_n.index('epy')
+	lcoe = postproc.SimResultElec.perf_n.index('lcoe')
+	u = dakota.UncertaintyDakotaIn(os.path.abspath('Toy.mo'), '0', '1y', '1h', 'None', 'None',
+		'5', 'dassl', 'newton', '-LOG_SUCCESS,-stdout', 'ELECTRICITY', perf_num=1, perf_i=[epy])
+	u.uniform(['p', 'q'], [0., 0.], [1., 1.])
+	dakota.gen_dakota_in(u.response(), u.method('lhs', 4), u.variables, str(tmp_path))
+	study = dakotadata.Study('sample.in')
+	assert study.par_n == ['p', 'q'] and study.index == [epy]
+	with open('sample.dat', 'w') as f:
+		f.write('%eval_id interface p q response_fn_1\n'
+			'1 NO_ID 0.5 0.25 12.5\n'
+			'2 NO_ID 0.5000000000001 0.25 12.5\n'
+			'3 NO_ID 0.75 0.25 99999\n'
+			'4 NO_ID 0.1 0.2\n')
+
+	rcache = ResultCache(str(tmp_path/'rcache'))
+	store = SweepStore(str(tmp_path/'uq.db'))
+	counts = dakotadata.ingest(study, 'sample.dat', store=store, rcache=rcache)
+	assert counts == dict(read=3, duplicate=1, failed=1, stored=2, cached=1)
+	assert [(r['index'], r['status']) for r in store.runs()] == [(0, 'ok'), (1, 'failed')]
+	assert store.get(0)['perf'][epy] == 12.5
+	# again: nothing new
+	assert dakotadata.ingest(study, 'sample.dat', store=store, rcache=rcache)['stored'] == 0
+	store.close()
+
+	# a later study takes epy from the cache, but has to simulate for lcoe
+	ev = dakota.Evaluator(rcache)
+	assert ev.evaluate(Params({'p': '0.5', 'q': '0.25'}, [epy], [1]), '1') == [12.5]
+	assert ev.evaluate(Params({'p': '0.5', 'q': '0.25'}, [epy, lcoe], [1, 1]), '2')[0] != 12.5
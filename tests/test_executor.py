@@ -0,0 +1,101 @@
+#! /bin/env python
+from __future__ import division
+import os, platform, tempfile
+import pytest
+
+from solartherm import executor
+from solartherm import schedule
+
+def square(i, val):
+	with open('out_%d.txt'%i, 'w') as f:
+		f.write(str(val*val))
+	return val*val
+
+def run(ex):
+	out = {}
+	def callback(i, ret):
+		out[i] = ret
+	ex.run(square, [(i, i + 1) for i in range(5)], callback, files=['model'])
+	ex.close()
+	return out
+
+def test_serial_pool(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	assert run(executor.get_executor('pool', np=0)) == {0:1, 1:4, 2:9, 3:16, 4:25}
+	assert run(executor.get_executor('pool', np=2)) == {0:1, 1:4, 2:9, 3:16, 4:25}
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="queue workers are forked")
+def test_queue_stage(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+	with open('model', 'w') as f:
+		f.write('compiled model')
+	ex = executor.get_executor('queue', np=2, queue=str(tmp_path/'queue'), stage=True)
+	assert run(ex) == {0:1, 1:4, 2:9, 3:16, 4:25}
+	# files written in the node-local stage are moved back
+	for i in range(5):
+		assert (tmp_path/('out_%d.txt'%i)).exists()
+	assert not os.listdir(str(tmp_path/'queue'/'tasks'))
+
+def die_once(i, val):
+	# the worker of the first point dies, once
+	if i == 0 and not os.path.exists('died'):
+		open('died', 'w').close()
+		os._exit(1)
+	return square(i, val)
+
+def die(i, val):
+	if i == 0:
+		os._exit(1)
+	return square(i, val)
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="queue workers are forked")
+def test_queue_workers_gone(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	qdir = str(tmp_path/'queue')
+	out = {}
+	def callback(i, ret):
+		out[i] = ret
+	ex = executor.QueueExecutor(qdir, nlocal=2, poll=0.05)
+	ex.run(die_once, [(i, i + 1) for i in range(5)], callback)
+	assert out == {0:1, 1:4, 2:9, 3:16, 4:25}
+
+	out.clear()
+	ex = executor.QueueExecutor(qdir, nlocal=2, poll=0.05, attempts=1)
+	ex.run(die, [(i, i + 1) for i in range(5)], callback)
+	assert out == {0:None, 1:4, 2:9, 3:16, 4:25}
+	assert not os.listdir(os.path.join(qdir, 'claimed'))
+
+def square_first(i, val):
+	return square(i, val[0])
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="queue workers are forked")
+def test_queue_scheduler(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	tasks = schedule.Scheduler([(i, [i + 1]) for i in range(5)], interval=None)
+	out = {}
+	def callback(i, ret):
+		out[i] = ret
+	ex = executor.QueueExecutor(str(tmp_path/'queue'), nlocal=2, poll=0.05)
+	ex.run(square_first, tasks, callback)
+	assert out == {0:1, 1:4, 2:9, 3:16, 4:25}
+	# run times come from the workers
+	assert tasks.ndone == 5 and len(tasks.model) == 5
+	assert not tasks.started and not tasks.queued
+	assert 0 < tasks.busy < 5
+	assert 'Progress: 5/5 points done, 0 running' in tasks.report()
+
+def test_queue_dir(tmp_path):
+	(tmp_path/'results.txt').write_text('precious')
+	ex = executor.QueueExecutor(str(tmp_path))
+	with pytest.raises(ValueError):
+		ex.prepare()
+	assert (tmp_path/'results.txt').exists()
+	# an earlier queue is cleared
+	ex = executor.QueueExecutor(str(tmp_path/'queue'))
+	ex.prepare()
+	(tmp_path/'queue'/'tasks'/'old.pkl').write_text('')
+	ex.prepare()
+	assert not os.listdir(str(tmp_path/'queue'/'tasks'))
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,67 @@
+#! /bin/env python
+from __future__ import division
+import os
+import numpy as np
+import pytest
+
+import fakemat
+from solartherm import export
+from solartherm import postproc
+
+def make_res(tmp_path):
+	t = np.linspace(0, 31536000, 8761)
+	traj = {'E_elec':t*1e3, 'R_spot':t*1e-3, 'T':np.sin(t)}
+	params = {'C_cap':1e8, 'C_year':1e6, 'C_prod':0., 'r_disc':0.07,
+		't_life':25, 't_cons':1, 'P_name':1e8}
+	fn = str(tmp_path/'Toy_res_0.mat')
+	fakemat.write_mat(fn, t, traj, params)
+	return fn
+
+def test_recorded_vars(tmp_path):
+	perf = export.perf_vars(postproc.SimResultElec)
+	names = export.recorded_vars(['wea.*'], postproc.SimResultElec)
+	assert names == ['wea.*'] + perf
+	assert export.recorded_vars(['perf', 'E_elec', 'T'], postproc.SimResultElec,
+		keep=['T', 'Q']) == ['E_elec', 'T'] + [n for n in perf if n != 'E_elec'] + ['Q']
+
+	# results recorded with a filter without 'perf' still give the performance
+	fn = make_res(tmp_path)
+	full = postproc.SimResultElec(fn)
+	kept = dict((n, full.get_values(n)) for n in names if n in full.mat.names() and n != 'time')
+	t = full.get_time('E_elec')
+	traj = dict((n, v) for n, v in kept.items() if len(v) == len(t))
+	params = dict((n, v[0]) for n, v in kept.items() if len(v) != len(t))
+	filtered = str(tmp_path/'Toy_res_1.mat')
+	fakemat.write_mat(filtered, t, traj, params)
+	res = postproc.SimResultElec(filtered)
+	assert 'T' not in res.mat.names()
+	assert np.allclose(res.calc_perf(), full.calc_perf())
+
+@pytest.mark.parametrize('fmt', ['npz', 'parquet', 'arrow', 'hdf5'])
+def test_export_perf(tmp_path, fmt):
+	if fmt in ('parquet', 'arrow'):
+		pytest.importorskip('pyarrow')
+	elif fmt == 'hdf5':
+		pytest.importorskip('h5py')
+	fn = make_res(tmp_path)
+	res = postproc.SimResultElec(fn)
+	perf = res.calc_perf()
+	out_fn = export.export_result(res, fmt=fmt, remove=True)
+	assert not os.path.exists(fn)
+	assert export.get_format(out_fn) == fmt
+	exp = postproc.SimResultElec(out_fn)
+	assert sorted(exp.get_names()) == sorted(postproc.SimResultElec.perf_vars)
+	assert np.allclose(exp.calc_perf(), perf)
+
+def test_export_select(tmp_path):
+	res = postproc.SimResultElec(make_res(tmp_path))
+	out_fn = export.export_result(res, ['T', 'C_*'], fmt='npz', step=86400)
+	t, traj, params, units = export.read(out_fn)
+	assert sorted(traj) == ['T']
+	assert sorted(params) == ['C_cap', 'C_prod', 'C_year']
+	assert len(t) == 366 and t[-1] == 31536000
+	assert np.allclose(traj['T'], res.interpolate('T', t)[:,0])
+	with pytest.raises(KeyError):
+		export.export_result(res, ['nonexistent'], fmt='npz')
+
+# vim: ts=4:sw=4:noet:tw=80
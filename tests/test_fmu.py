@@ -0,0 +1,42 @@
+#! /bin/env python
+from __future__ import division
+import shutil
+import numpy as np
+import pytest
+
+from solartherm import export
+from solartherm import postproc
+from solartherm import simulation
+
+def test_from_reader():
+	t = np.linspace(0, 31536000., 101)
+	mat = export.ExportedResult.from_arrays(t, {'E_elec':t*1e8*0.3, 'R_spot':t*1e-3},
+		{'C_cap':1e8, 'C_year':1e6, 'C_prod':0., 'r_disc':0.07, 't_life':25,
+		't_cons':1, 'P_name':1e8}, {'E_elec':'J'})
+	res = postproc.SimResultElec.from_reader(mat)
+	assert res.get_unit('E_elec') == 'J'
+	assert res.get_unit('C_cap') == ''
+	assert np.allclose(res.interpolate('E_elec', 15768000.), [15768000.*1e8*0.3])
+	perf = res.calc_perf()
+	assert np.allclose(perf[2], 30.)
+
+@pytest.mark.skipif(shutil.which('omc') is None, reason="needs OpenModelica")
+def test_fmu(tmp_path, monkeypatch):
+	pytest.importorskip('fmpy')
+	monkeypatch.chdir(tmp_path)
+	with open('Lag.mo', 'w') as f:
+		f.write('model Lag parameter Real p = 1; Real x(start=0, fixed=true);'
+			' equation der(x) = p - x; end Lag;')
+	sim = simulation.Simulator('Lag.mo', cache=False)
+	sim.compile_fmu(libs=['Modelica'])
+	sim.load_fmu(['x', 'p', 'nothere'])
+	assert sim.compiled_files() == [str(tmp_path/'Lag.fmu')]
+	for p in [2., 3.]:
+		sim.update_pars(['p'], [str(p)])
+		sim.simulate(start='0', stop='10', step='0.1')
+		res = sim.result(postproc.SimResult)
+		assert res.get_values('p')[0] == p
+		assert np.allclose(res.interpolate('x', 10.), [p*(1 - np.exp(-10.))], rtol=1e-3)
+	assert not (tmp_path/'Lag_init.xml').exists()
+	with pytest.raises(KeyError):
+		sim.update_pars(['q'], ['1'])
@@ -0,0 +1,58 @@
+#! /bin/env python
+from __future__ import division
+import os, time
+
+from solartherm.cache import ModelCache
+
+def make_model(d, text):
+	fn = os.path.join(str(d), 'Toy.mo')
+	with open(fn, 'w') as f:
+		f.write(text)
+	return fn
+
+def make_build(d, size=100):
+	exe = os.path.join(str(d), 'Toy')
+	with open(exe, 'wb') as f:
+		f.write(b'\0'*size)
+	os.chmod(exe, 0o755)
+	xml = os.path.join(str(d), 'Toy_init.xml')
+	with open(xml, 'w') as f:
+		f.write('<fmiModelDescription/>')
+	return [exe, xml]
+
+def test_key(tmp_path):
+	cache = ModelCache(str(tmp_path/'cache'))
+	fn = make_model(tmp_path, 'model Toy end Toy;')
+	k1 = cache.key(fn, 'Toy', [], ['-d=nonewInst'])
+	assert k1 == cache.key(fn, 'Toy', [], ['-d=nonewInst'])
+	assert k1 != cache.key(fn, 'Toy', [], [])
+	make_model(tmp_path, 'model Toy Real x; end Toy;')
+	assert k1 != cache.key(fn, 'Toy', [], ['-d=nonewInst'])
+
+def test_fetch_publish(tmp_path):
+	cache = ModelCache(str(tmp_path/'cache'))
+	fn = make_model(tmp_path, 'model Toy end Toy;')
+	key = cache.key(fn, 'Toy')
+	work = tmp_path/'work'
+	work.mkdir()
+	assert not cache.fetch(key, str(work))
+	cache.publish(key, make_build(tmp_path))
+	assert cache.fetch(key, str(work))
+	assert os.access(str(work/'Toy'), os.X_OK)
+	assert (work/'Toy_init.xml').read_text() == '<fmiModelDescription/>'
+	assert not (work/'.used').exists()
+
+def test_evict(tmp_path):
+	cache = ModelCache(str(tmp_path/'cache'), maxsize=5000)
+	keys = ['a', 'b', 'c']
+	for k in keys:
+		cache.publish(k, make_build(tmp_path, size=1000))
+		time.sleep(0.01)
+	# 'a' was used most recently, so 'b' is the one to go
+	assert cache.fetch('a', str(tmp_path))
+	cache.evict(maxsize=2100)
+	assert sorted(e[2] for e in cache.entries()) == ['a', 'c']
+	cache.clear()
+	assert cache.entries() == []
+
+# vim: ts=4:sw=4:noet:tw=80
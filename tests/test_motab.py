@@ -30,6 +30,12 @@ def test_daggett():
 def test_wrap():
 	run_ctest('wrap')
 
+def test_irregular():
+	run_ctest('irregular')
+
+def test_binary():
+	run_ctest('binary')
+
 def test_modelica():
 	"""
 	Run the modelica test of STMotab.
@@ -44,6 +50,8 @@ def test_modelica():
 	assert res.data("t1")[0] == 31500000.
 	assert res.data("dnival")[0] == 976.
 	assert res.data("dnicol")[0] == 2.
+	assert res.data("vals[1]")[0] == 976.
+	assert res.data("vals[2]")[0] == 31500000.
 	
 	cleantest.clean('TestSTMotab')
 
@@ -0,0 +1,36 @@
+#! /bin/env python
+from __future__ import division
+import numpy as np
+import pytest
+
+from solartherm import motab
+from solartherm import repdays
+
+MILDURA = '../SolarTherm/Data/Weather/Mildura_Real2010_Created20130430.motab'
+
+def test_to_binary(tmp_path):
+	fn = motab.to_binary(MILDURA, str(tmp_path/'m.motab.bin'))
+	assert motab.is_binary(fn) and not motab.is_binary(MILDURA)
+	name, meta, data = motab.read_text(MILDURA)
+	assert name == 'weather' and data.shape == (8760, 9)
+	assert meta[2] == 'TABLELABELS,time,ghi,dni,dry,dew,rhum,p,wdir,wspd'
+	b_name, b_meta, b_data = motab.read(fn)
+	assert (b_name, b_meta) == (name, meta)
+	assert np.array_equal(b_data, data)
+
+	# layout read by the C loader: aligned values, row by row
+	with open(fn, 'rb') as f:
+		head = motab.HEADER.unpack(f.read(motab.HEADER.size))
+	offset = head[-1]
+	assert offset%8 == 0
+	raw = np.fromfile(fn, dtype='<f8', offset=offset)
+	assert np.array_equal(raw[:9], data[0])
+
+	name, labels, d = repdays.read_motab(fn)
+	assert labels[2] == 'dni'
+	assert np.array_equal(d, data)
+
+	with open(fn, 'r+b') as f:
+		f.truncate(offset + 100)
+	with pytest.raises(AssertionError):
+		motab.read_binary(fn)
@@ -0,0 +1,84 @@
+#! /bin/env python
+from __future__ import division
+import os
+import functools
+import numpy as np
+
+from solartherm.optimisation import BatchEvaluator, IsolatedObjective, SuccessiveHalving, st_surrogate, pareto_front
+
+class FakeSim(object):
+	suffix = None
+
+def objective(sim, x):
+	# the result file a real simulation would write
+	return sum(v**2 for v in x), sim.suffix, os.getpid()
+
+def test_isolated():
+	sim = FakeSim()
+	func = IsolatedObjective(functools.partial(objective, sim), sim)
+	f, suffix, pid = func([1., 2.])
+	assert f == 5.
+	assert suffix == 'w%d' % os.getpid()
+
+def test_batch():
+	sim = FakeSim()
+	objfunc = functools.partial(objective, sim)
+	pop = [[float(i), 1.] for i in range(20)]
+	with BatchEvaluator(objfunc, sim, nproc=3) as ev:
+		res = ev(pop)
+		assert [r[0] for r in res] == [i**2 + 1. for i in range(20)]
+		for f, suffix, pid in res:
+			assert suffix == 'w%d' % pid
+		assert sim.suffix is None
+		# as a DEAP toolbox map
+		assert [r[0] for r in ev.map(functools.partial(objfunc), pop[:2])] == [1., 2.]
+		assert ev.map(len, pop[:2]) == [2, 2]
+
+def branin(x):
+	x1 = 15*x[0] - 5
+	x2 = 15*x[1]
+	return (x2 - 5.1/(4*np.pi**2)*x1**2 + 5/np.pi*x1 - 6)**2 + 10*(1 - 1/(8*np.pi))*np.cos(x1) + 10
+
+def test_surrogate():
+	calls = []
+	def objfunc(x):
+		calls.append(x)
+		return branin(x)
+	f, cand = st_surrogate(objfunc, [[0, 1], [0, 1]], [0.5, 0.5], 30,
+		[15, 15], [-5, 0], batch=3, seed=1)
+	assert len(calls) == 30
+	assert f < 0.5 # global minimum 0.3979
+	assert np.isclose(branin([(cand[0] + 5)/15, cand[1]/15]), f)
+
+class Decision(object):
+	def __init__(self, cand, fitness):
+		self.cand = cand
+		self.fitness = fitness
+
+def test_surrogate_multi():
+	def objfunc(x):
+		return [x[0], 1 + x[1] - np.sqrt(x[0])]
+	cands, front, dm = st_surrogate(objfunc, [[0, 1], [0, 1]], [0.5, 0.5], 20,
+		[1, 1], [0, 0], num_obj=2, decisionmaker=Decision, seed=1)
+	assert len(front) == len(cands) == len(dm.cand)
+	assert pareto_front(front) == list(range(len(front)))
+	assert pareto_front([[1, 2], [2, 1], [2, 2], [1, 2]]) == [0, 1]
+
+def test_halving():
+	calls = []
+	def objfunc(x, stop=None):
+		calls.append((x[0], stop))
+		# short runs overestimate, but rank the points correctly
+		return x[0] + (1. if stop is not None else 0.),
+	sh = SuccessiveHalving(objfunc, ['7d', '28d'], eta=3)
+	pop = [[float(v)] for v in [5, 3, 8, 1, 7, 2, 6, 4, 0]]
+	fit = sh.map(objfunc, pop)
+	assert sh.nsim == [9, 3, 1]
+	assert [c for c in calls if c[1] is None] == [(0., None)]
+	assert fit[8] == (0.,)
+	# dropped points rank behind the fully simulated one, in estimate order
+	assert fit[3] == (2.,) and fit[5] == (3.,) and fit[0] == (6.,)
+	assert all(f[0] > 0. for i, f in enumerate(fit) if i != 8)
+	assert sh.map(len, pop[:2]) == [1, 1]
+
+# vim: ts=4:sw=4:noet:tw=80
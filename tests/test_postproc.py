@@ -0,0 +1,82 @@
+#! /bin/env python
+from __future__ import division
+import numpy as np
+
+import fakemat
+from solartherm import postproc
+
+def make_res(tmp_path):
+	# ramp with a step at t=4, written twice as OpenModelica does for events
+	t = np.array([0., 1., 2., 3., 4., 4., 5., 6., 7., 8.])
+	x = np.array([0., 1., 2., 3., 4., 0., 1., 2., 3., 4.])
+	fn = str(tmp_path/'Toy_res.mat')
+	fakemat.write_mat(fn, t, {'x':x, 'y':2*x})
+	return postproc.SimResult(fn)
+
+def test_interpolate(tmp_path):
+	res = make_res(tmp_path)
+	assert np.allclose(res.interpolate('x', 2.5), [2.5])
+	assert np.allclose(res.interpolate(['x', 'y'], 2.5), [2.5, 5.])
+	assert np.allclose(res.interpolate('x', 4.), [0.]) # value after the event
+	assert np.allclose(res.interpolate('x', 8.), [4.])
+	v = res.interpolate(['x', 'y'], np.array([0., 3.5, 4.5, 8.]))
+	assert v.shape == (4, 2)
+	assert np.allclose(v[:,0], [0., 3.5, 0.5, 4.])
+	assert np.allclose(res.closest('x', np.array([0.4, 0.6, 3.9])), [[0.], [1.], [4.]])
+
+def test_integrate(tmp_path):
+	res = make_res(tmp_path)
+	assert np.allclose(res.integrate('x', 0., 8.), [16.])
+	assert np.allclose(res.integrate(['x', 'y'], 3.5, 4.5), [2., 4.])
+	v = res.integrate('x', np.array([0., 2., 4.]), np.array([4., 6., 8.]))
+	assert np.allclose(v[:,0], [8., 8., 8.])
+
+def test_sample(tmp_path):
+	res = make_res(tmp_path)
+	t, v = res.sample(['x', 'y'], 2.)
+	assert np.allclose(t, [1., 3., 5., 7.])
+	assert np.allclose(v[:,0], [1., 3., 1., 3.])
+	assert np.allclose(v[:,1], 2*v[:,0])
+	t, v = res.sample('x', np.array([0., 4., 8.]))
+	assert np.allclose(t, [2., 6.])
+	assert np.allclose(v[:,0], [2., 2.])
+
+def test_calc_perf_extrapolate(tmp_path):
+	year = 31536000.
+	def perf(stop, extrapolate):
+		t = np.linspace(0, stop, 101)
+		fn = str(tmp_path/'Elec_res.mat')
+		fakemat.write_mat(fn, t, {'E_elec':t*1e8*0.3, 'R_spot':t*1e-3},
+			{'C_cap':1e8, 'C_year':1e6, 'C_prod':0., 'r_disc':0.07, 't_life':25,
+			't_cons':1, 'P_name':1e8})
+		return postproc.SimResultElec(fn).calc_perf(extrapolate=extrapolate)
+	full = perf(year, False)
+	assert perf(year/12, False)[1:3] == [None, None]
+	# a constant output scales to the same yearly metrics
+	part = perf(year/12, True)
+	assert np.allclose(part, full)
+	assert np.allclose(full[2], 30.)
+	assert perf(year, True) == full
+
+def test_calc_perf_fuel_extrapolate(tmp_path):
+	year = 31536000.
+	def perf(stop, extrapolate):
+		t = np.linspace(0, stop, 101)
+		fn = str(tmp_path/'Fuel_res.mat')
+		zero = np.zeros_like(t)
+		fakemat.write_mat(fn, t, {'V_fuel':t*1e-3*0.3, 'R_spot':t*1e-3,
+			'C_water':zero, 'C_algae':zero, 'C_H2':zero, 'C_CO2':zero,
+			'C_O2':zero, 'C_elec':zero},
+			{'C_cap':1e8, 'C_labor':1e5, 'C_catalyst':1e5, 'C_om':1e6,
+			'r_disc':0.07, 'r_i':0.025, 't_life':25, 't_cons':1,
+			'v_flow_fuel_des':1e-3})
+		# same call as for electricity plants, peaker is ignored
+		return postproc.SimResultFuel(fn).calc_perf(True, extrapolate=extrapolate)
+	full = perf(year, False)
+	assert perf(year/12, False)[1:3] == [None, None]
+	part = perf(year/12, True)
+	assert np.allclose(part, full)
+	assert np.allclose(full[2], 30.)
+	assert np.allclose(full[3], year*1e-3)
+
+# vim: ts=4:sw=4:noet:tw=80
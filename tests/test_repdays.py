@@ -0,0 +1,74 @@
+#! /bin/env python
+from __future__ import division
+import numpy as np
+
+import fakemat
+from solartherm import postproc
+from solartherm import repdays
+
+DAY = repdays.DAY
+
+def make_weather(fn, ndays=20):
+	# alternating sunny and cloudy days, hourly
+	t = np.arange(0, ndays*24 + 1)*3600.
+	hour = (t/3600.)%24
+	sun = np.maximum(np.sin(np.pi*(hour - 6)/12), 0)
+	cloudy = ((t//DAY)%2).astype(bool)
+	dni = np.where(cloudy, 100., 900.)*sun
+	dry = 20. + 5*sun
+	data = np.column_stack([t, 0.5*dni, dni, dry])
+	repdays.write_motab(fn, 'weather', data, ['time', 'ghi', 'dni', 'dry'])
+	return data
+
+def test_motab(tmp_path):
+	fn = str(tmp_path/'wea.motab')
+	data = make_weather(fn, 3)
+	name, labels, d = repdays.read_motab(fn)
+	assert name == 'weather'
+	assert labels == ['time', 'ghi', 'dni', 'dry']
+	assert np.allclose(d, data)
+
+def test_cluster(tmp_path):
+	fn = str(tmp_path/'wea.motab')
+	make_weather(fn, 20)
+	days = repdays.RepresentativeDays.from_motab(fn, 2, ndays=20)
+	assert sum(days.weights) == 20
+	assert days.weights == [10., 10.]
+	# one sunny (even) and one cloudy (odd) day
+	assert sorted(d%2 for d in days.days) == [0, 1]
+	assert days.days == sorted(days.days)
+	assert all(days.days[l]%2 == j%2 for j, l in enumerate(days.labels))
+
+	days.save(str(tmp_path/'days.json'))
+	d2 = repdays.RepresentativeDays.load(str(tmp_path/'days.json'))
+	assert (d2.days, d2.weights, d2.labels) == (days.days, days.weights, days.labels)
+
+def test_windows(tmp_path):
+	days = repdays.RepresentativeDays([5, 0], [300, 65])
+	assert days.days == [0, 5]
+	assert days.weights == [65., 300.]
+	assert days.windows(DAY/2) == [(0., 0., DAY), (4.5*DAY, 5*DAY, 6*DAY)]
+
+	fn = str(tmp_path/'wea.motab')
+	make_weather(fn, 10)
+	days.write_table(fn, str(tmp_path/'small.motab'), DAY/2)
+	name, labels, d = repdays.read_motab(str(tmp_path/'small.motab'))
+	assert d[0,0] == 0. and d[-1,0] == 6*DAY
+	assert np.all((d[:,0] <= DAY) | (d[:,0] >= 4.5*DAY))
+
+def test_calc_perf_days(tmp_path):
+	params = {'C_cap':1e8, 'C_year':1e6, 'C_prod':0., 'r_disc':0.07,
+		't_life':25, 't_cons':1, 'P_name':1e8}
+	days = repdays.RepresentativeDays([10, 200], [180, 185])
+	results = []
+	for i, (start, t0, t1) in enumerate(days.windows()):
+		t = np.linspace(start, t1, 49)
+		# cumulative outputs do not start from 0 at the start of the day
+		fn = str(tmp_path/('Elec_res_day%d.mat'%i))
+		fakemat.write_mat(fn, t, {'E_elec':1e3 + (i + 1)*t*1e7, 'R_spot':t*1e-3}, params)
+		results.append(postproc.SimResultElec(fn))
+	perf = postproc.SimResultElec.calc_perf_days(results, days.windows(), days.weights)
+	E = (180*1e7 + 185*2e7)*DAY
+	assert np.allclose(perf[0], E/(1e6*3600))
+	assert np.allclose(perf[2], 100*E/(365*DAY*1e8))
+	assert np.allclose(perf[3], 365*DAY*1e-3)
@@ -0,0 +1,36 @@
+#! /bin/env python
+from __future__ import division
+import numpy as np
+import DyMat
+
+import fakemat
+from solartherm.resparser import Matv4Mmap
+from solartherm import postproc
+
+def test_mmap_matches_dymat(tmp_path):
+	fn = str(tmp_path/'Toy_res.mat')
+	t = np.linspace(0, 3600, 61)
+	fakemat.write_mat(fn, t, {'E_elec':t*2, 'T':np.sin(t)}, {'P_name':1e8},
+		descr={'E_elec':'Cumulative electricity'})
+	ref = DyMat.DyMatFile(fn)
+	mat = Matv4Mmap(fn)
+	assert sorted(mat.names()) == sorted(ref.names())
+	for n in ref.names():
+		assert np.array_equal(mat.data(n), ref.data(n))
+		assert np.array_equal(mat.abscissa(n, valuesOnly=True), ref.abscissa(n, valuesOnly=True))
+		assert mat.description(n) == ref.description(n)
+		assert mat.size(n) == ref.size(n)
+	# trajectories are views of the mapped file, not copies
+	assert not mat.data('E_elec').flags.owndata
+
+def test_simresult(tmp_path):
+	fn = str(tmp_path/'Toy_res.mat')
+	t = np.linspace(0, 10, 11)
+	fakemat.write_mat(fn, t, {'x':t**2})
+	res = postproc.SimResult(fn)
+	assert isinstance(res.mat, Matv4Mmap)
+	assert list(res.get_names()) == ['x']
+	assert np.array_equal(res.get_time('x'), t)
+	assert np.array_equal(res.get_values('x'), t**2)
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,61 @@
+#! /bin/env python
+from __future__ import division
+import os
+import numpy as np
+
+from solartherm.cache import ResultCache, model_digest, sim_settings
+
+def test_key(tmp_path):
+	cache = ResultCache(str(tmp_path/'cache'))
+	s = sim_settings('0', '1y', '5m', solver='dassl')
+	k = cache.key('m', ['a', 'b'], ['1', '2e3'], s)
+	# order of parameters and the form of numbers do not matter
+	assert k == cache.key('m', ['b', 'a'], ['2000.0', '1.0000000000001'], s)
+	assert k != cache.key('m', ['a', 'b'], ['1.001', '2e3'], s)
+	assert k != cache.key('m2', ['a', 'b'], ['1', '2e3'], s)
+	assert k != cache.key('m', ['a', 'b'], ['1', '2e3'], sim_settings('0', '1y', '5m', solver='euler'))
+
+def test_get_put(tmp_path):
+	cache = ResultCache(str(tmp_path/'cache'))
+	assert cache.get('k') is None
+	t = np.linspace(0, 1, 5)
+	cache.put('k', [1., None, 3.], extra={'constrained': [False, 0.]}, traj={'time': t})
+	res = cache.get('k')
+	assert res['perf'] == [1., None, 3.]
+	assert res['extra'] == {'constrained': [False, 0.]}
+	assert np.allclose(res['traj']['time'], t)
+	st = cache.stats()
+	assert (st['hits'], st['misses'], st['entries']) == (1, 1, 1)
+	# a second instance shares the entries and counters
+	other = ResultCache(str(tmp_path/'cache'))
+	assert other.get('k')['perf'] == [1., None, 3.]
+	assert cache.stats()['hits'] == 2
+	assert 'hit rate' in cache.report()
+
+def test_evict(tmp_path):
+	cache = ResultCache(str(tmp_path/'cache'), maxsize=10**6)
+	for k in ['a', 'b', 'c']:
+		cache.put(k, [1.], traj={'x': np.random.rand(10000)})
+	cache.get('a')
+	# 'b' is now the least recently used
+	size = cache.size()[1]
+	cache.evict(maxsize=size - 1)
+	assert cache.get('b') is None
+	assert cache.get('a') is not None and cache.get('c') is not None
+	cache.clear()
+	assert cache.size() == (0, 0)
+
+def test_model_digest(tmp_path):
+	fns = []
+	for n in ['Toy', 'Toy_init.xml']:
+		fns.append(str(tmp_path/n))
+		with open(fns[-1], 'w') as f:
+			f.write(n)
+	d = model_digest(fns)
+	assert d == model_digest(fns[::-1])
+	with open(fns[1], 'w') as f:
+		f.write('<fmiModelDescription/>')
+	os.utime(fns[1], (0, 0))
+	assert d != model_digest(fns)
+
+# vim: ts=4:sw=4:noet:tw=80
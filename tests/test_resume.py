@@ -0,0 +1,75 @@
+#! /bin/env python
+from __future__ import division
+import os
+import importlib.machinery, importlib.util
+import pytest
+
+from solartherm import postproc
+from solartherm.store import SweepStore
+
+def load_script(name):
+	fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'python', 'scripts', name)
+	loader = importlib.machinery.SourceFileLoader(name.replace('.', '_'), fn)
+	mod = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+	loader.exec_module(mod)
+	return mod
+
+st_simulate = load_script('st_simulate')
+
+# values as given on the command line, and as read back from the store
+VALS = [['1', '0.1'], ['2', '0.2'], ['3', '0.30000000000000004'], ['4', '0.4']]
+
+def test_completed_store(tmp_path):
+	logger = st_simulate.LoggerPerf(postproc.SimResultElec)
+	with SweepStore(str(tmp_path/'sweep.db')) as st:
+		st.set_meta(par_n=['p', 'q'], perf_n=['epy', 'lcoe'])
+		st.add(0, VALS[0], [10., 1.])
+		st.add(1, VALS[1], status='failed', message='solver: exited with code 2')
+		st.add(2, ['3', '0.3'], [30., 3.])
+		# failed points are run again
+		assert st_simulate.completed_points(st, logger, VALS) == {0:[10., 1.], 2:[30., 3.]}
+		st.add(1, VALS[1], [20., 2.])
+		assert sorted(st_simulate.completed_points(st, logger, VALS)) == [0, 1, 2]
+
+		# a point with other values is another sweep
+		other = [list(v) for v in VALS]
+		other[2][1] = '0.31'
+		with pytest.raises(ValueError):
+			st_simulate.completed_points(st, logger, other)
+		with pytest.raises(ValueError):
+			st_simulate.completed_points(st, logger, VALS[:2])
+
+def test_completed_results(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	logger = st_simulate.LoggerPerf(postproc.SimResultElec)
+	assert st_simulate.completed_points(None, logger, VALS) == {}
+	logger.header()
+	perf = [float(j) for j in range(len(logger.perf_names))]
+	logger.entry('0', perf)
+	logger.failure('1', 'solver: exited with code 2')
+	logger.entry('3', perf)
+	with open('results.txt', 'a') as f:
+		f.write('2,1.0,2.') # cut short when the sweep died
+	assert st_simulate.completed_points(None, logger, VALS) == {0:perf, 3:perf}
+	# the header is not written again
+	logger.header(resume=True)
+	with open('results.txt') as f:
+		assert sum(line.startswith('index') for line in f) == 1
+
+def test_check_init_log(tmp_path):
+	fn = str(tmp_path/'init.log')
+	with open(fn, 'w') as f:
+		f.write('index,p,q\n')
+		for i, v in enumerate(VALS):
+			f.write(','.join([str(i)] + v) + '\n')
+	st_simulate.check_init_log(fn, ['p', 'q'], VALS)
+	with pytest.raises(ValueError):
+		st_simulate.check_init_log(fn, ['p', 'r'], VALS)
+	with pytest.raises(ValueError):
+		st_simulate.check_init_log(fn, ['p', 'q'], VALS + [['5', '0.5']])
+	changed = [list(v) for v in VALS]
+	changed[1][0] = '2.5'
+	with pytest.raises(ValueError):
+		st_simulate.check_init_log(fn, ['p', 'q'], changed)
+
+# vim: ts=4:sw=4:noet:tw=80
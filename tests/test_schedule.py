@@ -0,0 +1,38 @@
+#! /bin/env python
+from __future__ import division
+
+from solartherm.schedule import CostModel, Scheduler
+from solartherm import executor
+
+def test_costmodel():
+	for method in ('knn', 'linear'):
+		m = CostModel([10.], method=method)
+		assert m.predict([[1.]]) is None
+		for x in range(0, 11, 2):
+			m.add([x], 10.*(1 + x))
+		c = m.predict([[1.], [9.]])
+		assert c[0] < c[1]
+
+def test_longest_first():
+	tasks = [(i, (str(p), 'a')) for i, p in enumerate([1, 5, 3, 4, 2])]
+	history = [(('1', 'a'), 1.), (('5', 'a'), 50.)]
+	s = Scheduler(tasks, history, interval=None)
+	popped = [s.pop() for j in range(len(s))]
+	assert [int(val[0]) for i, val in popped] == [5, 4, 3, 2, 1]
+	for i, val in popped:
+		s.done(i)
+	assert s.ndone == 5 and len(s.model) == 7
+
+def double(i, val):
+	return 2*val[0]
+
+def test_scheduled_pool():
+	out = {}
+	def callback(i, ret):
+		out[i] = ret
+	s = Scheduler([(i, [i]) for i in range(6)], interval=None)
+	executor.PoolExecutor(2).run(double, s, callback)
+	assert out == dict((i, 2*i) for i in range(6))
+	assert 0 < s.utilisation() <= 1.
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,67 @@
+#! /bin/env python
+from __future__ import division
+import os, sys, platform
+import pytest
+
+from solartherm import simulation
+from solartherm import scratch
+
+def test_scratch(tmp_path):
+	src = tmp_path/'data.txt'
+	src.write_text(u'data')
+	sc = scratch.Scratch(str(tmp_path/'root'))
+	d = sc.create([str(src)])
+	assert os.path.dirname(d) == sc.base
+	with open(os.path.join(d, 'data.txt')) as f:
+		assert f.read() == 'data'
+	sc.remove(d)
+	assert not os.path.exists(d)
+
+	# left behind by a dead process
+	dead = os.path.join(sc.base, '%s-%d-abc'%(sc.host, 2**22 + 12345))
+	os.mkdir(dead)
+	other = os.path.join(sc.base, 'otherhost-%d-abc'%(2**22 + 12345,))
+	os.mkdir(other)
+	mine = sc.create()
+	scratch.Scratch(str(tmp_path/'root'))
+	assert not os.path.exists(dead)
+	assert os.path.exists(other) and os.path.exists(mine)
+	scratch._cleanup()
+	assert not os.path.exists(mine)
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_simulate_scratch(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	with open('Toy.mo', 'w') as f:
+		f.write('model Toy parameter Real p = 1; end Toy;')
+	with open('Toy_init.xml', 'w') as f:
+		f.write('<fmiModelDescription><ModelVariables>'
+			'<ScalarVariable name="p"><Real start="1"/></ScalarVariable>'
+			'</ModelVariables></fmiModelDescription>')
+	with open('table.txt', 'w') as f:
+		f.write('table')
+	# writes a log next to its results, and needs a table in its directory
+	with open('Toy', 'w') as f:
+		f.write('#!%s\nimport sys, os\na = sys.argv\n'
+			'open("Toy.log", "w").write(os.getcwd())\n'
+			'open(a[a.index("-r") + 1], "w").write(open("table.txt").read() + open(a[a.index("-f") + 1]).read())\n'
+			% (sys.executable,))
+	os.chmod('Toy', 0o755)
+
+	sim = simulation.Simulator('Toy.mo', suffix='0', cache=False, scratch=str(tmp_path/'scratch'))
+	sim.scratch_files = ['table.txt']
+	sim.update_pars(['p'], ['3'])
+	sim.simulate(stop='1')
+	with open(sim.res_fn) as f:
+		assert f.read().startswith('table<fmiModelDescription>')
+	assert sorted(os.listdir('.')) == ['Toy', 'Toy.mo', 'Toy_init.xml', 'Toy_init_0.xml',
+		'Toy_res_0.mat', 'scratch', 'table.txt']
+	assert os.listdir(sim.scratch.base) == []
+
+	sim.update_pars(['p'], ['4'], override=True)
+	sim.simulate(stop='1')
+	assert os.path.exists(sim.res_fn) and os.path.exists(sim.override_fn)
+
+	monkeypatch.setenv('ST_SCRATCH', str(tmp_path/'env'))
+	assert simulation.Simulator('Toy.mo', cache=False).scratch.root == str(tmp_path/'env')
+	assert simulation.Simulator('Toy.mo', cache=False, scratch=False).scratch is None
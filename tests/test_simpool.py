@@ -0,0 +1,128 @@
+#! /bin/env python
+from __future__ import division
+import os, sys, platform
+import pytest
+
+from solartherm import simulation
+
+# stand-in for a compiled model: copies the init file given by '-f' (and the
+# '-overrideFile', if any) to the result file given by '-r', so that tests can
+# check the parameters used.
+FAKE_EXE = """#!%s
+import sys
+a = sys.argv
+with open(a[a.index('-r') + 1], 'w') as r:
+	r.write(open(a[a.index('-f') + 1]).read())
+	for o in a:
+		if o.startswith('-overrideFile='):
+			r.write(open(o.split('=', 1)[1]).read())
+"""
+
+def make_toy():
+	with open('Toy.mo', 'w') as f:
+		f.write('model Toy parameter Real p = 1; end Toy;')
+	with open('Toy', 'w') as f:
+		f.write(FAKE_EXE % (sys.executable,))
+	os.chmod('Toy', 0o755)
+	with open('Toy_init.xml', 'w') as f:
+		f.write('<fmiModelDescription><ModelVariables>'
+			'<ScalarVariable name="p"><Real start="1" unit="W"/></ScalarVariable>'
+			'<ScalarVariable name="q"><Real start="2"/></ScalarVariable>'
+			'</ModelVariables></fmiModelDescription>')
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_override(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	sim = simulation.Simulator('Toy.mo', suffix='0', cache=False, override=True)
+	sim.load_init()
+	assert sim.get_unit('p') == 'W'
+	assert sim.get_unit('q') == ''
+	with pytest.raises(KeyError):
+		sim.update_pars(['r'], ['1'])
+	sim.update_pars(['p', 'q'], [3, 4])
+	sim.simulate(stop='1')
+	assert not os.path.exists(sim.init_out_fn)
+	with open(sim.res_fn) as f:
+		res = f.read()
+	assert 'p=3\nq=4\nstartTime=0.0\nstopTime=1.0\n' in res
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_pool(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	sim = simulation.Simulator('Toy.mo', cache=False)
+	os.mkdir('out')
+	with simulation.SimulationPool(sim, nproc=2, sim_kw={'stop':'1'}, outdir='out') as pool:
+		res = pool.map(['p'], [[3], [4], [5]])
+		pool.submit(3, ['q'], [7])
+		res += list(pool.results())
+	for i, v in enumerate([3, 4, 5]):
+		j, res_fn, perf, err, dt = res[i]
+		assert err is None and j == i
+		assert os.path.dirname(res_fn) == str(tmp_path/'out')
+		with open(res_fn) as f:
+			xml = f.read()
+		assert '<Real start="%d" unit="W"' % v in xml
+	# parameters set for one point do not leak into the next
+	with open(res[3][1]) as f:
+		xml = f.read()
+	assert '<Real start="1" unit="W"' in xml and '<Real start="7"' in xml
+	assert not os.path.exists(pool.basedir)
+
+# kills the worker running it (its parent) when q is 7
+KILLER_EXE = FAKE_EXE + """
+import os, signal
+if 'q=7' in open(a[a.index('-r') + 1]).read():
+	os.kill(os.getppid(), signal.SIGKILL)
+"""
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_pool_worker_dies(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	with open('Toy', 'w') as f:
+		f.write(KILLER_EXE % (sys.executable,))
+	sim = simulation.Simulator('Toy.mo', cache=False)
+	with simulation.SimulationPool(sim, nproc=2, sim_kw={'stop':'1'}, override=True, poll=0.1) as pool:
+		res = pool.map(['q'], [[3], [7], [5]])
+		assert [r[3] is None for r in res] == [True, False, True]
+		assert 'Worker process died' in res[1][3]
+		# the worker was replaced
+		assert all(p.is_alive() for p in pool.workers)
+		assert pool.map(['q'], [[4], [6]])[1][3] is None
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_pool_broken_init(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	with open('Toy_init.xml', 'w') as f:
+		f.write('<fmiModelDescription><ModelVariables>')
+	sim = simulation.Simulator('Toy.mo', cache=False)
+	with simulation.SimulationPool(sim, nproc=2, sim_kw={'stop':'1'}, poll=0.1) as pool:
+		res = pool.map(['p'], [[3], [4], [5]])
+		assert [r[0] for r in res] == [0, 1, 2]
+		for r in res:
+			assert r[1] is None and 'could not start' in r[3] and 'ParseError' in r[3]
+		assert pool.workers == [None, None]
+
+def test_variable_filter():
+	import re
+	filt = re.compile('^(%s)$' % simulation.variable_filter(['E_elec', 'wea.*', 'x[?]']))
+	for n in ['E_elec', 'wea.dni', 'wea.', 'x[1]']:
+		assert filt.match(n)
+	for n in ['E_elecx', 'weax', 'R_spot', 'x[10]']:
+		assert not filt.match(n)
+
+@pytest.mark.skipif(platform.system()=="Windows", reason="fake executable needs a shebang")
+def test_simulate_filter(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	make_toy()
+	sim = simulation.Simulator('Toy.mo', suffix='0', cache=False, override=True)
+	sim.update_pars(['p'], [3])
+	sim.simulate(stop='1', variables=['E_elec', 'wea.*'], events=False)
+	with open(sim.res_fn) as f:
+		res = f.read()
+	assert 'variableFilter=E_elec|wea\\..*\n' in res
+
+# vim: ts=4:sw=4:noet:tw=80
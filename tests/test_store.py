@@ -0,0 +1,31 @@
+#! /bin/env python
+from __future__ import division
+import numpy as np
+
+from solartherm.store import SweepStore
+
+def test_store(tmp_path):
+	fn = str(tmp_path/'sweep.db')
+	with SweepStore(fn, batch=2, interval=1e9) as st:
+		st.set_meta(par_n=['p', 'q'], perf_n=['epy', 'lcoe'])
+		st.add(0, ['1', '2'], [10., None], walltime=1.5,
+			traj={'time':np.arange(3.), 'x':np.ones(3)})
+		# not committed yet
+		other = SweepStore(fn)
+		assert other.completed() == set()
+		st.add(2, ['1', '3'], status='failed', message='CalledProcessError')
+		assert other.completed() == set([0])
+		st.add(1, ['2', '2'], [20., 5.])
+	with SweepStore(fn) as st:
+		assert st.completed() == set([0, 1])
+		assert st.completed(None) == set([0, 1, 2])
+		assert st.get(2)['status'] == 'failed'
+		assert st.get(3) is None
+		assert [r['index'] for r in st.runs()] == [0, 1, 2]
+		idx, par, perf = st.arrays()
+		assert list(idx) == [0, 1]
+		assert np.array_equal(par, [[1., 2.], [2., 2.]])
+		assert perf[0,0] == 10. and np.isnan(perf[0,1])
+		assert np.array_equal(st.trajectory(0, 'x'), np.ones(3))
+
+# vim: ts=4:sw=4:noet:tw=80
@@ -0,0 +1,85 @@
+#! /bin/env python
+from __future__ import division
+import os, sys, platform, time
+import pytest
+
+from solartherm import simulation
+
+pytestmark = pytest.mark.skipif(platform.system()=="Windows", reason="fake executables need a shebang")
+
+def script(fn, body):
+	with open(fn, 'w') as f:
+		f.write('#!%s\nimport sys, time\n%s\n' % (sys.executable, body))
+	os.chmod(fn, 0o755)
+	return './' + fn
+
+def test_run_watched(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	simulation.run_watched([script('ok', 'print("hello")')])
+
+	t = time.time()
+	with pytest.raises(simulation.SimulationError) as e:
+		simulation.run_watched([script('slow', 'time.sleep(30)')], timeout=1, poll=0.1)
+	assert e.value.kind == 'timeout'
+	assert time.time() - t < 10
+
+	# keeps writing, then stops
+	stall = script('stall', 'f = open("out", "w")\n'
+		'for i in range(10):\n\tf.write("x"); f.flush(); time.sleep(0.2)\n'
+		'time.sleep(30)')
+	with pytest.raises(simulation.SimulationError) as e:
+		simulation.run_watched([stall], stall=1, progress_fn='out', poll=0.1)
+	assert e.value.kind == 'stalled'
+	assert os.path.getsize('out') == 10
+
+	# long initialisation before any results, then output without growth
+	slow_start = script('slow_start', 'time.sleep(1.5)\n'
+		'f = open("out2", "w"); f.write("x"); f.flush()\n'
+		'for i in range(10):\n\tprint(i); sys.stdout.flush(); time.sleep(0.2)')
+	simulation.run_watched([slow_start], stall=1, progress_fn='out2', poll=0.1)
+
+	failing = 'print("%s"); sys.exit(1)'
+	for kind, msg in [
+			('assertion', 'assert            | error   | T > 0 failed'),
+			('solver', 'Integrator failed at time 12.5'),
+			('error', 'something else')]:
+		with pytest.raises(simulation.SimulationError) as e:
+			simulation.run_watched([script('fail', failing % msg)])
+		assert e.value.kind == kind
+		assert msg in e.value.output
+
+def test_retry(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	with open('Toy.mo', 'w') as f:
+		f.write('model Toy parameter Real p = 1; end Toy;')
+	with open('Toy_init.xml', 'w') as f:
+		f.write('<fmiModelDescription><ModelVariables></ModelVariables></fmiModelDescription>')
+	# only runs with the ida solver, and only writes results with a tolerance
+	script('Toy', 'a = sys.argv\n'
+		'if a[a.index("-s") + 1] != "ida":\n\tprint("Integrator failed"); sys.exit(2)\n'
+		'if "tolerance=1e-06" in a[a.index("-override") + 1]:\n'
+		'\topen(a[a.index("-r") + 1], "w").close()')
+	sim = simulation.Simulator('Toy.mo', cache=False)
+	with pytest.raises(simulation.SimulationError) as e:
+		sim.simulate(stop='1')
+	assert e.value.kind == 'solver'
+	with pytest.raises(simulation.SimulationError) as e:
+		sim.simulate(stop='1', solver='ida')
+	assert e.value.kind == 'no-output'
+
+	retry = [simulation.parse_settings('solver=ida'),
+		simulation.parse_settings('solver=ida,tolerance=1e-06')]
+	assert sim.simulate_retry(retry, stop='1') == {'solver': 'ida', 'tolerance': '1e-06'}
+	with pytest.raises(simulation.SimulationError) as e:
+		sim.simulate_retry(retry[:1], stop='1')
+	assert e.value.kind == 'no-output'
+
+	ret = simulation.sweep_worker(os.path.abspath('Toy.mo'), '0', '1', '1', '1e-04',
+		None, None, None, 'dassl', 'newton', None, [], [], None, None, False, False,
+		None, None, None, True, {'timeout': 10, 'stall': None, 'retry': retry}, None, 0, [])
+	perf, status, message, walltime, traj = ret
+	assert status == 'failed' # the toy results cannot be read
+	ret = simulation.sweep_worker(os.path.abspath('Toy.mo'), '0', '1', '1', '1e-04',
+		None, None, None, 'dassl', 'newton', None, [], [], None, None, False, False,
+		None, None, None, True, None, None, 1, [])
+	assert ret[1:3] == ('solver', 'solver: exited with code 2')
@@ -9,6 +9,7 @@
 #include <stdlib.h>
 #include <string.h>
 #include <math.h>
+#include <unistd.h>
 
 #define TESTMOTAB_DEBUG
 #ifdef TESTMOTAB_DEBUG
@@ -215,6 +216,123 @@ int test_wrap(){
 	return 0;
 }
 
+int test_irregular(){
+	/* hourly, with a gap and a step in dni at t = 10 */
+	double t[] = {0, 1, 2, 5, 10, 10, 11, 12};
+	double dni[] = {0, 100, 200, 500, 1000, 0, 0, 50};
+	int n = sizeof(t)/sizeof(double);
+	MotabData *wd = motab_new(n,3,"weather","time,dni,bb","s,W/m2,kg");
+	for(int i=0;i<n;++i){
+		MOTAB_VAL(wd,i,0) = t[i];
+		MOTAB_VAL(wd,i,1) = dni[i];
+		MOTAB_VAL(wd,i,2) = 2*dni[i];
+	}
+	double step;
+	assert(motab_check_timestep(wd,&step) == 4);
+	assert(motab_check_time(wd) == 0);
+	assert(wd->timestep == 0);
+
+	MSG("Testing forward lookups...");
+	assert(motab_get_value(wd,0,1) == 0.);
+	assert(motab_get_value(wd,0.5,1) == 50.);
+	assert(motab_get_value(wd,2,1) == 200.);
+	assert(motab_get_value(wd,3.5,1) == 350.);
+	assert(motab_get_value(wd,7.5,1) == 750.);
+	assert(motab_get_value(wd,10,1) == 0.);
+	assert(motab_get_value(wd,11.5,1) == 25.);
+	assert(motab_get_value(wd,12,1) == 50.);
+	assert(motab_get_value(wd,12.5,1) == MOTAB_NO_REAL);
+	assert(motab_get_value(wd,-0.5,1) == MOTAB_NO_REAL);
+	assert(motab_get_value(wd,1,3) == MOTAB_NO_REAL);
+
+	MSG("Testing backward lookups...");
+	assert(motab_get_value(wd,6.25,1) == 625.);
+	assert(motab_get_value(wd,1.5,1) == 150.);
+	assert(motab_get_value(wd,0.25,1) == 25.);
+
+	MSG("Testing several columns...");
+	int cols[] = {2, 1, 0};
+	double vals[3];
+	assert(0 == motab_get_values(wd,4,cols,3,vals));
+	assert(vals[0] == 800. && vals[1] == 400. && vals[2] == 4.);
+	cols[2] = 5;
+	assert(0 != motab_get_values(wd,4,cols,3,vals));
+	assert(vals[0] == MOTAB_NO_REAL);
+
+	MSG("Testing wraparound...");
+	/* the period is 13 s, the last row followed after 1 s by the first */
+	assert(motab_get_value_wraparound(wd,12.5,1) == 25.);
+	assert(motab_get_value_wraparound(wd,13,1) == 0.);
+	assert(motab_get_value_wraparound(wd,16.5,1) == 350.);
+	assert(motab_get_value_wraparound(wd,-12.5,1) == 50.);
+	motab_free(wd);
+
+	/* decreasing times are rejected */
+	wd = motab_new(3,2,"weather","time,dni","s,W/m2");
+	MOTAB_VAL(wd,0,0) = 0; MOTAB_VAL(wd,1,0) = 2; MOTAB_VAL(wd,2,0) = 1;
+	assert(motab_check_time(wd) == 4);
+	assert(motab_get_value(wd,0.5,1) == MOTAB_NO_REAL);
+	motab_free(wd);
+	return 0;
+}
+
+
+int test_binary(){
+	const char *filepath = "../SolarTherm/Data/Weather/Mildura_Real2010_Created20130430.motab";
+	const char *binpath = "testmotab_binary.motab.bin";
+	MotabData *tab = motab_load(filepath);
+	assert(tab);
+	assert(!motab_is_binary(filepath));
+
+	MSG("Writing binary copy...");
+	assert(0 == motab_write_binary(tab,binpath));
+	assert(motab_is_binary(binpath));
+
+	MotabData *bin = motab_load(binpath);
+	assert(bin);
+	assert(bin->map != NULL);
+	assert(strcmp(bin->name,tab->name) == 0);
+	assert(bin->nrows == tab->nrows && bin->ncols == tab->ncols);
+	for(unsigned r = 0; r < tab->nrows; ++r){
+		for(unsigned c = 0; c < tab->ncols; ++c){
+			assert(MOTAB_VAL(bin,r,c) == MOTAB_VAL(tab,r,c));
+		}
+	}
+
+	MSG("Testing metadata...");
+	MotabMetaData *M, *N;
+	for(M = tab->meta, N = bin->meta; M && N; M = M->next, N = N->next){
+		assert(strcmp(M->row,N->row) == 0);
+	}
+	assert(M == NULL && N == NULL);
+	assert(motab_get_meta_lat(bin) == motab_get_meta_lat(tab));
+	char *units = motab_get_units_label(bin,"dni");
+	assert(units); assert(0 == strcmp(units,"W/m2")); free(units);
+	double step;
+	assert(0 == motab_check_timestep(bin,&step));
+	assert(step == 3600.);
+	assert(motab_get_value(bin,5400.,2) == motab_get_value(tab,5400.,2));
+
+	/* the mapping is private: writes do not reach the file */
+	MOTAB_VAL(bin,0,3) = -1.;
+	motab_free(bin);
+	bin = motab_load_binary(binpath);
+	assert(MOTAB_VAL(bin,0,3) == 25.2);
+	motab_free(bin);
+	motab_free(tab);
+
+	MSG("Testing truncated file...");
+	FILE *fp = fopen(binpath,"r+b");
+	assert(fp);
+	assert(fwrite("STMOTAB",1,8,fp) == 8);
+	fclose(fp);
+	assert(0 == truncate(binpath,1000));
+	assert(motab_load_binary(binpath) == NULL);
+	remove(binpath);
+	return 0;
+}
+
+
 typedef int (TestFunction)(void);
 typedef struct{
 	TestFunction *fn;
@@ -222,7 +340,7 @@ typedef struct{
 } NamedFunction;
 #define FN(N) {test_##N, #N}
 const NamedFunction tests[] = {
-	FN(mildura), FN(daggett), FN(wrap), {NULL,NULL}
+	FN(mildura), FN(daggett), FN(wrap), FN(irregular), FN(binary), {NULL,NULL}
 };	
 
 int main(int argc, const char **argv){